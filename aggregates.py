@@ -0,0 +1,287 @@
+import threading
+import pandas as pd
+from cache import LRUCache, hash_bytes, shared_store
+from instrumentation import span
+
+AGGREGATE_CACHE_MAX_ENTRIES = 64
+
+# Format of the cached aggregates, which are also persisted: bump it whenever AGGREGATIONS,
+# DERIVED_COLUMNS or the partials change, so files written by an earlier version are dropped
+AGGREGATE_VERSION = 1
+
+# Incremental appends: the last version of every sheet layout (sheet name + columns) is remembered, so
+# a re-upload that only adds rows merges the new rows into the earlier partials instead of grouping
+# every row again. 'hash' takes the rows after the earlier row count as new; 'watermark' takes the rows
+# with a later 'Tanggal' than the earlier ones as new, wherever they are. The versions are shared by
+# every session, so both check by row hashes that the earlier rows are unchanged before merging
+# (another upload with the same layout is never merged); None always recomputes.
+INCREMENTAL_MODE = 'hash'
+INCREMENTAL_MAX_VERSIONS = 32
+
+# Frames holding only the first rows of a streamed sheet carry this attribute; their aggregates come
+# from the whole sheet (see seed_aggregates) and are never computed from the frame itself
+PREVIEW_ONLY_ATTR = 'preview_only'
+
+# Raised when the seeded aggregates of a preview-only frame are no longer cached: grouping the
+# preview would silently give wrong totals, so the sheet has to be loaded from its workbook again
+class PreviewOnlyError(ValueError):
+    pass
+
+# Name of the row-count column in partial aggregates and of 'size' results.
+# 'mean' aggregations also keep a non-null count per value column ('__count:<column>').
+COUNT_COLUMN = '__count'
+SIZE_COLUMN = 'Jumlah'
+
+# Columns derived from 'Tanggal' once per sheet before grouping
+DERIVED_COLUMNS = {
+    'Bulan': lambda df: df['Tanggal'].dt.to_period('M').dt.to_timestamp(),
+    'Tahun': lambda df: df['Tanggal'].dt.year,
+}
+
+# Every aggregation the dashboard needs, per sheet: name -> (group-by keys, value columns, how).
+# how is 'size' (row count, reported as 'Jumlah'), 'sum' or 'mean' of the value columns.
+AGGREGATIONS = {
+    'Pelanggan': {
+        'jumlah_per_jenis_kelamin': (['Jenis Kelamin Pelanggan'], [], 'size'),
+        'jumlah_per_umur': (['Umur Pelanggan'], [], 'size'),
+        'jumlah_per_segmentasi': (['Segmentasi Pelanggan'], [], 'size'),
+        'jumlah_per_umur_jenis_kelamin': (['Umur Pelanggan', 'Jenis Kelamin Pelanggan'], [], 'size'),
+        'jumlah_per_preferensi_segmentasi': (['Preferensi Pembelian', 'Segmentasi Pelanggan'], [], 'size'),
+    },
+    'Produk': {
+        'terjual_per_produk': (['Produk'], ['Jumlah Terjual'], 'sum'),
+        'terjual_per_kategori': (['Kategori Produk'], ['Jumlah Terjual'], 'sum'),
+        'terjual_per_tanggal_harga': (['Tanggal', 'Harga Produk'], ['Jumlah Terjual'], 'sum'),
+    },
+    'Transaksi Penjualan': {
+        'pendapatan_per_metode': (['Metode Pembayaran'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_tanggal': (['Tanggal'], ['Pendapatan'], 'sum'),
+        'jumlah_per_status_metode': (['Status Penjualan', 'Metode Pembayaran'], [], 'size'),
+    },
+    'Lokasi Penjualan': {
+        'pendapatan_per_lokasi': (['Lokasi'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_kota': (['Kota/Provinsi'], ['Pendapatan'], 'sum'),
+    },
+    'Staf Penjualan': {
+        'komisi_per_staf': (['Nama Staf'], ['Komisi'], 'sum'),
+        'kinerja_per_staf': (['Nama Staf'], ['Penilaian Kinerja'], 'mean'),
+        'jumlah_per_posisi': (['Posisi/Jabatan'], [], 'size'),
+    },
+    'Inventaris': {
+        'stok_per_produk': (['Produk'], ['Stok'], 'sum'),
+        'stok_masuk_keluar_per_tanggal': (['Tanggal'], ['Stok Masuk', 'Stok Keluar'], 'sum'),
+    },
+    'Promosi dan Pemasaran': {
+        'pendapatan_per_kampanye': (['Kampanye Promosi'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_media': (['Media Promosi'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_kode_diskon': (['Kode Diskon'], ['Pendapatan'], 'sum'),
+    },
+    'Feedback dan Pengembalian': {
+        'jumlah_per_masalah': (['Masalah Pelanggan'], [], 'size'),
+        'jumlah_per_alasan_pengembalian': (['Alasan Pengembalian'], [], 'size'),
+        'jumlah_per_status_pengembalian': (['Status Pengembalian'], [], 'size'),
+    },
+    'Analisis Penjualan': {
+        'pendapatan_per_tanggal': (['Tanggal'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_produk': (['Produk'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_bulan': (['Bulan'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_tahun': (['Tahun'], ['Pendapatan'], 'sum'),
+    },
+    'Lainnya': {
+        'pendapatan_per_faktor_eksternal': (['Faktor Eksternal'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_tanggal_faktor_ekonomi': (['Tanggal', 'Faktor Ekonomi'], ['Pendapatan'], 'sum'),
+        'pendapatan_per_faktor_lingkungan': (['Faktor Lingkungan'], ['Pendapatan'], 'sum'),
+    },
+}
+
+# Function to measure a cached aggregate entry (partials, results, append info)
+def _aggregate_nbytes(entry):
+    partials, results, _ = entry
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in list(partials.values()) + list(results.values())))
+
+# Aggregates live in the shared result store (and its file tier, since they are keyed by content)
+_aggregate_cache = shared_store().namespace(
+    'aggregates', max_entries=AGGREGATE_CACHE_MAX_ENTRIES, sizeof=_aggregate_nbytes, persist=True,
+    version=AGGREGATE_VERSION,
+)
+_sheet_versions = LRUCache(max_entries=INCREMENTAL_MAX_VERSIONS)
+_incremental_stats = {'merged': 0, 'rows_reused': 0, 'rows_added': 0}
+_incremental_lock = threading.Lock()
+
+# Function to identify a sheet's data: the workbook hash + sheet name set at load time, else a content hash
+def data_key(df):
+    source_key = df.attrs.get('source_key')
+    if source_key:
+        return source_key
+    return hash_bytes(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+
+# Function to add the derived columns (Bulan, Tahun) that some aggregations group by
+def _with_derived_columns(df):
+    if 'Tanggal' not in df.columns or not pd.api.types.is_datetime64_any_dtype(df['Tanggal']):
+        return df
+    return df.assign(**{name: derive(df) for name, derive in DERIVED_COLUMNS.items()})
+
+# Function to list the aggregations of a sheet whose columns are all present
+def available_aggregations(sheet_name, columns):
+    columns = set(columns)
+    if 'Tanggal' in columns:
+        columns |= set(DERIVED_COLUMNS)
+    return {
+        name: spec for name, spec in AGGREGATIONS.get(sheet_name, {}).items()
+        if set(spec[0]) <= columns and set(spec[1]) <= columns
+    }
+
+# Function to compute combinable partial aggregates in one pass over the sheet: one groupby per
+# distinct key set, holding the sum of every value column needed for those keys plus a row count.
+# by adds leading group-by columns to every key set (e.g. the source of a multi-workbook comparison).
+def compute_partials(sheet_name, df, by=()):
+    df = _with_derived_columns(df)
+    specs = available_aggregations(sheet_name, df.columns)
+    values_by_keys = {}
+    means_by_keys = {}
+    for keys, values, how in specs.values():
+        values_by_keys.setdefault(tuple(by) + tuple(keys), set()).update(values)
+        if how == 'mean':
+            means_by_keys.setdefault(tuple(by) + tuple(keys), set()).update(values)
+    partials = {}
+    for keys, values in values_by_keys.items():
+        grouped = df.groupby(list(keys), observed=True, sort=True)
+        partial = grouped[sorted(values)].sum() if values else pd.DataFrame(index=grouped.size().index)
+        partial[COUNT_COLUMN] = grouped.size()
+        for col in sorted(means_by_keys.get(keys, ())):
+            partial[f'{COUNT_COLUMN}:{col}'] = grouped[col].count()
+        partials[keys] = partial
+    return partials
+
+# Function to merge several partial aggregates (e.g. from chunks or appended rows) into one
+def combine_partials(partials_list):
+    combined = {}
+    for partials in partials_list:
+        for keys, partial in partials.items():
+            combined.setdefault(keys, []).append(partial)
+    return {
+        keys: frames[0] if len(frames) == 1 else pd.concat(frames).groupby(level=list(range(len(keys))), observed=True, sort=True).sum()
+        for keys, frames in combined.items()
+    }
+
+# Function to turn partial aggregates into the named result tables used by the charts
+def finalize_partials(sheet_name, partials, by=()):
+    results = {}
+    for name, (keys, values, how) in AGGREGATIONS.get(sheet_name, {}).items():
+        partial = partials.get(tuple(by) + tuple(keys))
+        if partial is None:
+            continue
+        if how == 'size':
+            result = partial[[COUNT_COLUMN]].rename(columns={COUNT_COLUMN: SIZE_COLUMN})
+        elif how == 'mean':
+            result = pd.DataFrame({
+                col: partial[col] / partial[f'{COUNT_COLUMN}:{col}'].where(partial[f'{COUNT_COLUMN}:{col}'] > 0)
+                for col in values
+            })
+        else:
+            result = partial[values]
+        results[name] = result.reset_index()
+    return results
+
+def _version_key(sheet_name, df, by=()):
+    return (sheet_name, tuple(df.columns), tuple(by))
+
+def _cache_key(sheet_name, df, by=()):
+    key = f"{sheet_name}\x1f{data_key(df)}"
+    return key + f"\x1f{','.join(by)}" if by else key
+
+# Function to find the rows appended since the remembered version of a sheet.
+# Returns (version, new rows) or None when there is no usable earlier version.
+def _find_append(sheet_name, df, row_hashes, by=()):
+    version = _sheet_versions.get(_version_key(sheet_name, df, by))
+    if version is None or version['rows'] > len(df):
+        return None
+    if INCREMENTAL_MODE == 'hash':
+        if hash_bytes(row_hashes[:version['rows']].tobytes()) != version['digest']:
+            return None
+        return version, df.iloc[version['rows']:]
+    if INCREMENTAL_MODE == 'watermark' and version['watermark'] is not None:
+        new_rows = (df['Tanggal'] > version['watermark']).to_numpy()
+        # Every earlier row must still be there (at or before the watermark) for the merge to be exact
+        if int((~new_rows).sum()) != version['rows'] \
+                or hash_bytes(row_hashes[~new_rows].tobytes()) != version['digest']:
+            return None
+        return version, df[new_rows]
+    return None
+
+def _remember_version(sheet_name, df, partials, row_hashes, by=()):
+    watermark = None
+    if 'Tanggal' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Tanggal']):
+        watermark = df['Tanggal'].max()
+    _sheet_versions.put(_version_key(sheet_name, df, by), {
+        'rows': len(df),
+        'digest': hash_bytes(row_hashes.tobytes()),
+        'watermark': None if pd.isna(watermark) else watermark,
+        'partials': partials,
+    })
+
+# Function to compute a sheet's partials, reusing the partials of an earlier version when the sheet
+# only gained rows. Returns (partials, append) where append counts reused and added rows, or is None.
+def _compute_or_extend_partials(sheet_name, df, by=()):
+    if INCREMENTAL_MODE is None:
+        return compute_partials(sheet_name, df, by), None
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    found = _find_append(sheet_name, df, row_hashes, by)
+    append = None
+    if found is None:
+        partials = compute_partials(sheet_name, df, by)
+    else:
+        version, new_rows = found
+        partials = version['partials']
+        if len(new_rows):
+            partials = combine_partials([partials, compute_partials(sheet_name, new_rows, by)])
+        append = {'rows_reused': len(df) - len(new_rows), 'rows_added': len(new_rows)}
+        with _incremental_lock:
+            _incremental_stats['merged'] += 1
+            _incremental_stats['rows_reused'] += append['rows_reused']
+            _incremental_stats['rows_added'] += append['rows_added']
+    _remember_version(sheet_name, df, partials, row_hashes, by)
+    return partials, append
+
+# Function to get every aggregation of a sheet, computed once per distinct data and then cached.
+# The cache keeps the partials next to the results so they can be extended later; a sheet that
+# only appends rows to an earlier upload is merged incrementally (see INCREMENTAL_MODE).
+# With by, every table is also grouped by those columns (which come first in the result).
+def get_aggregates(sheet_name, df, by=()):
+    return _get_entry(sheet_name, df, by)[1]
+
+# Function to get the partial aggregates behind get_aggregates (e.g. to combine several sheets)
+def get_partials(sheet_name, df, by=()):
+    return _get_entry(sheet_name, df, by)[0]
+
+def _get_entry(sheet_name, df, by=()):
+    def compute():
+        if df.attrs.get(PREVIEW_ONLY_ATTR):
+            raise PreviewOnlyError(
+                f"Agregat sheet '{sheet_name}' tidak lagi tersimpan dan tidak dapat dihitung dari pratinjau. "
+                "Silakan muat ulang halaman."
+            )
+        with span('aggregate', sheet=sheet_name, by=','.join(by) or None):
+            partials, append = _compute_or_extend_partials(sheet_name, df, by)
+            return partials, finalize_partials(sheet_name, partials, by), append
+
+    return _aggregate_cache.get_or_compute(_cache_key(sheet_name, df, by), compute)
+
+# Function to tell whether a sheet's aggregates were merged into an earlier upload's: the counts of
+# reused and added rows, or None (also before the aggregates are computed)
+def appended_rows(sheet_name, df, by=()):
+    cached = _aggregate_cache.peek(_cache_key(sheet_name, df, by))
+    return cached[2] if cached is not None else None
+
+# Function to register aggregates computed elsewhere (e.g. chunk by chunk) for a sheet's data key
+def seed_aggregates(sheet_name, df, partials, by=()):
+    key = _cache_key(sheet_name, df, by)
+    if key not in _aggregate_cache:
+        _aggregate_cache.put(key, (partials, finalize_partials(sheet_name, partials, by), None))
+
+# Function to report aggregate cache usage, including incremental merges
+def aggregate_cache_stats():
+    stats = _aggregate_cache.stats()
+    with _incremental_lock:
+        stats['incremental'] = dict(_incremental_stats)
+    return stats
@@ -0,0 +1,188 @@
+import os
+import random
+from abc import ABC, abstractmethod
+import re
+import time
+import tomllib
+from cache import hash_bytes
+
+# Settings of the offline LocalBackend: seconds before the first chunk, seconds between chunks and
+# characters per streamed chunk
+LOCAL_LATENCY = 0.5
+LOCAL_CHUNK_DELAY = 0.02
+LOCAL_CHUNK_CHARS = 40
+
+# Rough token estimates used by LocalBackend.count_tokens (Gemini bills an image as a fixed count)
+LOCAL_CHARS_PER_TOKEN = 4
+LOCAL_IMAGE_TOKENS = 258
+
+# Templated answer of the LocalBackend; {title} is the chart type found in the prompt
+LOCAL_TEMPLATE = (
+    "### 📊 {title}\n\n"
+    "**Ringkasan:** {finding}\n\n"
+    "- {point_1}\n"
+    "- {point_2}\n\n"
+    "*Rekomendasi:* {advice}"
+)
+LOCAL_PHRASES = {
+    'finding': [
+        "Sebagian besar nilai terkumpul pada beberapa kategori utama.",
+        "Terlihat tren naik turun yang cukup stabil sepanjang periode.",
+        "Distribusi data relatif merata di antara kategori.",
+    ],
+    'point': [
+        "Kategori teratas menyumbang porsi terbesar dari total.",
+        "Ada beberapa nilai yang jauh di bawah rata-rata.",
+        "Perubahan terbesar terjadi pada akhir periode.",
+        "Selisih antar kategori tidak terlalu besar.",
+    ],
+    'advice': [
+        "fokuskan promosi pada kategori dengan kinerja terbaik.",
+        "evaluasi kategori dengan kinerja terendah setiap bulan.",
+        "pantau tren ini secara berkala untuk mengatur stok.",
+    ],
+}
+
+# Interface every model backend implements: the subset of genai.GenerativeModel the app uses.
+# Responses have .text and iterate over chunks (with .text) when requested with stream=True;
+# chats have .history and send_message(content, stream=False).
+# Backends missing one of the methods fail when they are created, not mid-request.
+class ModelBackend(ABC):
+    name = 'base'
+
+    # Identifies the backend and model behind an answer (e.g. for cache keys)
+    @property
+    def model_id(self):
+        return self.name
+
+    @abstractmethod
+    def generate_content(self, contents, stream=False, **kwargs):
+        ...
+
+    @abstractmethod
+    def start_chat(self, history=None):
+        ...
+
+    @abstractmethod
+    def count_tokens(self, contents):
+        ...
+
+# Google Gemini through google.generativeai
+class GeminiBackend(ModelBackend):
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name='gemini-1.5-flash'):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name=model_name)
+        self.model_name = model_name
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model_name}"
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self.model.generate_content(contents, stream=stream, **kwargs)
+
+    def start_chat(self, history=None):
+        return self.model.start_chat(history=history or [])
+
+    def count_tokens(self, contents):
+        return self.model.count_tokens(contents)
+
+# Response of the LocalBackend; iterating streams it in chunks with the configured delays
+class LocalResponse:
+    def __init__(self, text, chunk_chars, chunk_delay, sleep):
+        self.text = text
+        self._chunk_chars = chunk_chars
+        self._chunk_delay = chunk_delay
+        self._sleep = sleep
+
+    def __iter__(self):
+        for start in range(0, len(self.text), self._chunk_chars):
+            if start:
+                self._sleep(self._chunk_delay)
+            yield LocalResponse(self.text[start:start + self._chunk_chars], self._chunk_chars, 0, self._sleep)
+
+    def resolve(self):
+        pass
+
+# Token count result shaped like genai's CountTokensResponse
+class LocalTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+# Chat session of the LocalBackend, keeping genai-style history entries
+class LocalChat:
+    def __init__(self, backend, history=None):
+        self._backend = backend
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        response = self._backend.generate_content([f"Pertanyaan: {content}"] + self._texts(), stream=stream)
+        self.history.append({'role': 'user', 'parts': [content]})
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
+
+    def _texts(self):
+        return [part for entry in self.history for part in entry['parts'] if isinstance(part, str)]
+
+# Deterministic offline backend: the answer is a template filled from phrases picked by a hash of
+# the prompt, so identical prompts always get identical text. The first chunk arrives after latency
+# seconds and each further chunk after chunk_delay seconds, which makes it usable for load tests.
+class LocalBackend(ModelBackend):
+    name = 'local'
+
+    def __init__(self, latency=None, chunk_delay=None, chunk_chars=None, template=None, sleep=time.sleep):
+        self.latency = LOCAL_LATENCY if latency is None else latency
+        self.chunk_delay = LOCAL_CHUNK_DELAY if chunk_delay is None else chunk_delay
+        self.chunk_chars = chunk_chars or LOCAL_CHUNK_CHARS
+        self.template = template or LOCAL_TEMPLATE
+        self._sleep = sleep
+
+    def _prompt_text(self, contents):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        return "\n".join(part for part in parts if isinstance(part, str))
+
+    def _answer(self, contents):
+        prompt = self._prompt_text(contents)
+        rng = random.Random(hash_bytes(prompt.encode('utf-8')))
+        match = re.search(r"Tipe Visualisasi: ([^.\n(]+)", prompt) or re.search(r"Pertanyaan: ([^\n]+)", prompt)
+        points = rng.sample(LOCAL_PHRASES['point'], 2)
+        return self.template.format(
+            title=match.group(1).strip() if match else "Analisis Data",
+            finding=rng.choice(LOCAL_PHRASES['finding']),
+            point_1=points[0],
+            point_2=points[1],
+            advice=rng.choice(LOCAL_PHRASES['advice']),
+        )
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self._sleep(self.latency)
+        return LocalResponse(self._answer(contents), self.chunk_chars, self.chunk_delay, self._sleep)
+
+    def start_chat(self, history=None):
+        return LocalChat(self, history)
+
+    def count_tokens(self, contents):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        images = sum(isinstance(part, dict) for part in parts)
+        return LocalTokenCount(len(self._prompt_text(contents)) // LOCAL_CHARS_PER_TOKEN + LOCAL_IMAGE_TOKENS * images)
+
+# Function to read the Gemini API key from the environment or secrets.toml (for the command-line scripts)
+def load_api_key(path='secrets.toml'):
+    if os.environ.get('API_KEY'):
+        return os.environ['API_KEY']
+    for candidate in (path, os.path.join('.streamlit', 'secrets.toml')):
+        if os.path.exists(candidate):
+            with open(candidate, 'rb') as f:
+                return tomllib.load(f)['general']['API_KEY']
+    return None
+
+# Function to create a backend by name ('gemini' needs api_key; 'local' works offline)
+def create_backend(name, api_key=None, model_name='gemini-1.5-flash', **options):
+    if name == 'local':
+        return LocalBackend(**options)
+    if name == 'gemini':
+        return GeminiBackend(api_key, model_name=model_name)
+    raise ValueError(f"Unknown model backend: {name}")
@@ -0,0 +1,405 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from aggregates import compute_partials, get_aggregates
+from backends import LocalBackend, create_backend, load_api_key
+from charts import available_options, build_charts, convert_to_date, get_business_options
+from synthetic import synthetic_workbook
+from workbook import LazyWorkbook, frame_nbytes, prepare_sheet
+from vis_interpret import (
+    VISUALIZERS, build_general_prompt, build_chart_contents,
+    fig_to_png_bytes, interpret_chart, render_stats, start_renderer_pool
+)
+
+# Gemini bills every image as a fixed number of tokens; text is roughly 4 characters per token
+IMAGE_TOKEN_ESTIMATE = 258
+CHARS_PER_TOKEN = 4
+
+# Rows per sheet of the synthetic workbooks of the suite benchmark, and where they are kept between
+# runs (generating the 1M-row workbook takes minutes, so it is only written once)
+SUITE_SCALES = (1_000, 10_000, 100_000, 1_000_000)
+SUITE_WORKBOOK_DIR = os.path.join(tempfile.gettempdir(), 'umkm-benchmark')
+SUITE_MODEL_LATENCY = 0.0  # seconds the local model waits before each answer
+SUITE_RSS_INTERVAL = 0.05  # seconds between memory samples
+
+# Function to collect every chart the app can draw for a workbook, without interpreting them
+def collect_charts(workbook):
+    collected = []
+    for sheet_name in workbook.sheet_names:
+        visualize = VISUALIZERS.get(sheet_name)
+        if visualize is None:
+            continue
+        for option in get_business_options(sheet_name):
+            charts, _ = visualize(workbook[sheet_name], option, None)
+            collected.extend((sheet_name, chart) for chart in charts)
+    return collected
+
+# Function to estimate request size (bytes and tokens) of prepared contents
+def measure_contents(contents, model=None):
+    payload_bytes = 0
+    tokens = 0
+    for part in contents:
+        if isinstance(part, dict):
+            payload_bytes += len(part['data'])
+            tokens += IMAGE_TOKEN_ESTIMATE
+        else:
+            payload_bytes += len(part.encode('utf-8'))
+            tokens += len(part) // CHARS_PER_TOKEN
+    if model is not None:
+        tokens = model.count_tokens(contents).total_tokens
+    return payload_bytes, tokens
+
+# Function to prepare (and optionally send) one chart in a mode, recording latency and memory
+def bench_chart(sheet_name, chart, mode, model=None):
+    general_prompt = build_general_prompt(sheet_name)
+    children_rss_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    contents = build_chart_contents(general_prompt, chart, mode)
+    prepare_ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    payload_bytes, tokens = measure_contents(contents, model)
+    result = {
+        'sheet': sheet_name,
+        'chart_type': chart['type'],
+        'mode': mode,
+        'prepare_ms': round(prepare_ms, 2),
+        'peak_python_kb': round(peak / 1024, 1),
+        'renderer_maxrss_kb': max(0, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss - children_rss_before),
+        'process_maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'payload_bytes': payload_bytes,
+        'tokens': tokens,
+        'tokens_exact': model is not None,
+    }
+    if model is not None:
+        start = time.perf_counter()
+        model.generate_content(contents)
+        result['generate_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+# Function to compare the image and data prompt paths for every chart of a workbook
+def run_interpret_benchmark(path, modes=('image', 'data'), model=None):
+    with open(path, 'rb') as f:
+        workbook = LazyWorkbook(f.read())
+    results = []
+    for sheet_name, chart in collect_charts(workbook):
+        for mode in modes:
+            results.append(bench_chart(sheet_name, chart, mode, model))
+    return results
+
+# Function to time renderer startup, first (uncached) renders and cached re-renders of every chart
+def run_render_benchmark(path):
+    with open(path, 'rb') as f:
+        workbook = LazyWorkbook(f.read())
+    start = time.perf_counter()
+    start_renderer_pool()
+    startup_ms = (time.perf_counter() - start) * 1000
+    results = []
+    for sheet_name, chart in collect_charts(workbook):
+        timings = {}
+        for label in ('render_ms', 'cached_ms'):
+            start = time.perf_counter()
+            png = fig_to_png_bytes(chart['figure'])
+            timings[label] = round((time.perf_counter() - start) * 1000, 2)
+        results.append({'sheet': sheet_name, 'chart_type': chart['type'], 'png_bytes': len(png), **timings})
+    stats = render_stats()
+    summary = {
+        'renderer_startup_ms': round(startup_ms, 2),
+        'cold_ms': stats['cold_ms'],
+        'warm_ms': stats['warm_ms'],
+        'cached_ms': round(sum(row['cached_ms'] for row in results) / len(results), 2) if results else None,
+        'cache': stats['cache'],
+    }
+    return results, summary
+
+# Function to compare memory and group-by latency of every sheet before and after prepare_sheet
+def run_ingest_benchmark(path):
+    results = []
+    for sheet_name, raw in pd.read_excel(path, sheet_name=None).items():
+        raw_bytes = frame_nbytes(raw)
+        # The old path also parsed dates before grouping, so only the dtype changes are compared
+        raw_for_groupby = raw.copy()
+        if 'Tanggal' in raw_for_groupby:
+            raw_for_groupby['Tanggal'] = pd.to_datetime(raw_for_groupby['Tanggal'], errors='coerce')
+        start = time.perf_counter()
+        compute_partials(sheet_name, raw_for_groupby)
+        raw_groupby_ms = (time.perf_counter() - start) * 1000
+        prepared, report = prepare_sheet(raw.copy(), sheet_name)
+        start = time.perf_counter()
+        compute_partials(sheet_name, prepared)
+        prepared_groupby_ms = (time.perf_counter() - start) * 1000
+        results.append({
+            'sheet': sheet_name,
+            'rows': len(raw),
+            'bytes_before': raw_bytes,
+            'bytes_after': report['bytes_after'],
+            'prepare_ms': round(report['prepare_ms'], 2),
+            'groupby_ms_before': round(raw_groupby_ms, 2),
+            'groupby_ms_after': round(prepared_groupby_ms, 2),
+            'missing_columns': report['missing_columns'],
+        })
+    return results
+
+# Function to read the resident memory of this process in KB (None where /proc is unavailable)
+def current_rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+# Per-stage timing and memory of a pipeline run. Times accumulate over every call of a stage.
+# A background thread samples RSS every SUITE_RSS_INTERVAL seconds and keeps the peak per stage;
+# trace_memory also records the peak Python/NumPy allocation with tracemalloc, which slows
+# allocation-heavy stages down several times, so it is off by default.
+class StageRecorder:
+    def __init__(self, trace_memory=False, interval=None):
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.interval = SUITE_RSS_INTERVAL if interval is None else interval
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if current_rss_kb() is not None:
+            self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        name = self._current
+        rss = current_rss_kb()
+        if name is not None and rss is not None:
+            stats = self.stages[name]
+            stats['peak_rss_kb'] = max(stats['peak_rss_kb'] or 0, rss)
+
+    @contextmanager
+    def stage(self, name):
+        stats = self.stages.setdefault(name, {'count': 0, 'ms': 0.0, 'peak_rss_kb': None, 'peak_traced_kb': None})
+        self._current = name
+        self._sample()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats['count'] += 1
+            stats['ms'] += (time.perf_counter() - start) * 1000
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stats['peak_traced_kb'] = max(stats['peak_traced_kb'] or 0, peak // 1024)
+            self._sample()
+            self._current = None
+
+    def summary(self):
+        return {name: {**stats, 'ms': round(stats['ms'], 2)} for name, stats in self.stages.items()}
+
+# Function to run the app's pipeline over one workbook, stage by stage: loading every sheet (parse and
+# prepare, or stream), date conversion, aggregation, chart building, rendering and interpretation
+# with the local model. Meant to run in a fresh process so caches and peak RSS belong to this run.
+def run_pipeline(path, render=True, latency=None, trace_memory=False):
+    model = LocalBackend(latency=SUITE_MODEL_LATENCY if latency is None else latency, chunk_delay=0)
+    charts_total = 0
+    streamed = []
+    with StageRecorder(trace_memory) as recorder:
+        if render:
+            with recorder.stage('renderer_startup'):
+                start_renderer_pool()
+        with recorder.stage('read_file'), open(path, 'rb') as f:
+            file_bytes = f.read()
+        with recorder.stage('load'):
+            workbook = LazyWorkbook(file_bytes)
+        for sheet_name in workbook.sheet_names:
+            with recorder.stage('load'):
+                df = workbook[sheet_name]
+            if workbook.is_streamed(sheet_name):
+                streamed.append(sheet_name)
+            with recorder.stage('convert_to_date'):
+                df = convert_to_date(df, ['Tanggal'])
+            with recorder.stage('aggregate'):
+                get_aggregates(sheet_name, df)
+            for option in available_options(sheet_name, df.columns):
+                with recorder.stage('charts'):
+                    charts = build_charts(sheet_name, option, df)
+                charts_total += len(charts)
+                if render:
+                    with recorder.stage('render'):
+                        for chart in charts:
+                            fig_to_png_bytes(chart['figure'])
+                with recorder.stage('interpret'):
+                    interpret_chart(sheet_name, charts, model, mode=None if render else 'data')
+    stages = recorder.summary()
+    return {
+        'sheets': len(workbook.sheet_names),
+        'streamed_sheets': streamed,
+        'charts': charts_total,
+        'stages': stages,
+        'total_ms': round(sum(stats['ms'] for stats in stages.values()), 2),
+        'sheet_bytes': workbook.nbytes,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+# Function to describe where a suite result was measured, so runs of different versions can be compared
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+# Function to run the pipeline over synthetic workbooks of every scale, each in a fresh process
+def run_suite_benchmark(scales=None, directory=None, sheets=None, seed=0, render=True, latency=None,
+                        trace_memory=False, isolate=True):
+    results = []
+    for rows in scales or SUITE_SCALES:
+        start = time.perf_counter()
+        path = synthetic_workbook(rows, directory or SUITE_WORKBOOK_DIR, sheets, seed)
+        prepare_s = time.perf_counter() - start
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(run_pipeline, path, render, latency, trace_memory).result()
+        else:
+            result = run_pipeline(path, render, latency, trace_memory)
+        results.append({
+            'rows': rows,
+            'workbook': os.path.basename(path),
+            'workbook_bytes': os.path.getsize(path),
+            'workbook_prepare_s': round(prepare_s, 2),
+            **result,
+        })
+    return results
+
+# Function to compare suite results with an earlier run: per scale and stage, the new/old time ratio
+def compare_suite(baseline, results):
+    old_by_rows = {row['rows']: row for row in baseline.get('results', [])}
+    comparison = []
+    for row in results:
+        old = old_by_rows.get(row['rows'])
+        if old is None:
+            continue
+        stages = {}
+        for name, stats in row['stages'].items():
+            old_stats = old['stages'].get(name)
+            if old_stats and old_stats['ms']:
+                stages[name] = {'ms_before': old_stats['ms'], 'ms_after': stats['ms'],
+                                'ratio': round(stats['ms'] / old_stats['ms'], 3)}
+        comparison.append({
+            'rows': row['rows'],
+            'total_ratio': round(row['total_ms'] / old['total_ms'], 3) if old['total_ms'] else None,
+            'maxrss_ratio': round(row['maxrss_kb'] / old['maxrss_kb'], 3) if old['maxrss_kb'] else None,
+            'stages': stages,
+        })
+    return comparison
+
+# Function to summarize per-mode averages of benchmark rows
+def summarize(results):
+    summary = {}
+    for mode in sorted({row['mode'] for row in results}):
+        rows = [row for row in results if row['mode'] == mode]
+        summary[mode] = {
+            key: round(sum(row[key] for row in rows) / len(rows), 2)
+            for key in ('prepare_ms', 'peak_python_kb', 'payload_bytes', 'tokens')
+        }
+        if all('generate_ms' in row for row in rows):
+            summary[mode]['generate_ms'] = round(sum(row['generate_ms'] for row in rows) / len(rows), 2)
+    return summary
+
+# Function to write a benchmark report as JSON to a file or stdout
+def write_report(report, output=None):
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chart interpretation paths of the dashboard.")
+    parser.add_argument('workbook', nargs='?', help="Excel workbook (.xlsx) to benchmark (not used by 'suite')")
+    parser.add_argument('--benchmark', choices=['interpret', 'render', 'ingest', 'suite'], default='interpret',
+                        help="'interpret' compares image vs data prompts, 'render' times chart rendering, "
+                             "'ingest' compares memory and group-by latency before/after dtype preparation, "
+                             "'suite' times every stage over synthetic workbooks of several sizes")
+    parser.add_argument('--modes', default='image,data', help="Comma-separated modes to compare (image, data)")
+    parser.add_argument('--live', action='store_true', help="Count tokens and time generate_content against the model")
+    parser.add_argument('--backend', choices=['gemini', 'local'], default='gemini',
+                        help="Model backend for --live; 'local' answers offline with deterministic text")
+    parser.add_argument('--output', help="Write results as JSON to this file instead of stdout")
+    parser.add_argument('--scales', help="Suite: comma-separated rows per sheet (default: 1000,10000,100000,1000000)")
+    parser.add_argument('--sheets', help="Suite: comma-separated sheets to generate (default: all)")
+    parser.add_argument('--workbook-dir', default=SUITE_WORKBOOK_DIR, help="Suite: where synthetic workbooks are kept")
+    parser.add_argument('--latency', type=float, default=SUITE_MODEL_LATENCY, help="Suite: local model latency in seconds")
+    parser.add_argument('--no-render', action='store_true', help="Suite: skip rendering and interpret in data mode")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Suite: also record peak allocations with tracemalloc (slows stages down)")
+    parser.add_argument('--baseline', help="Suite: earlier suite JSON to compare against")
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'suite':
+        scales = [int(rows) for rows in args.scales.split(',')] if args.scales else None
+        sheets = args.sheets.split(',') if args.sheets else None
+        results = run_suite_benchmark(scales, args.workbook_dir, sheets, render=not args.no_render,
+                                      latency=args.latency, trace_memory=args.trace_memory)
+        report = {'benchmark': 'suite', 'environment': environment_info(), 'results': results}
+        if args.baseline:
+            with open(args.baseline) as f:
+                report['comparison'] = compare_suite(json.load(f), results)
+        write_report(report, args.output)
+        return
+
+    if not args.workbook:
+        parser.error("a workbook is required for this benchmark")
+
+    if args.benchmark == 'render':
+        results, summary = run_render_benchmark(args.workbook)
+        write_report({'benchmark': 'render', 'results': results, 'summary': summary}, args.output)
+        return
+
+    if args.benchmark == 'ingest':
+        write_report({'benchmark': 'ingest', 'results': run_ingest_benchmark(args.workbook)}, args.output)
+        return
+
+    model = None
+    if args.live:
+        api_key = load_api_key() if args.backend == 'gemini' else None
+        model = create_backend(args.backend, api_key=api_key)
+
+    results = run_interpret_benchmark(args.workbook, tuple(args.modes.split(',')), model)
+    write_report({'benchmark': 'interpret', 'results': results, 'summary': summarize(results)}, args.output)
+
+if __name__ == '__main__':
+    main()
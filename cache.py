@@ -0,0 +1,552 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Function to build a content-addressed key from raw bytes (e.g. an uploaded workbook)
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+# In-memory LRU cache bounded by entry count and (optionally) total size in bytes.
+# Thread-safe so a single instance can be shared by every Streamlit session.
+class LRUCache:
+    def __init__(self, max_entries=16, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    # Look an entry up without counting it as a hit or miss or refreshing its recency
+    def peek(self, key, default=None):
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = self._sizeof(value)
+            self._evict()
+
+    # Return the cached value for key, computing and storing it on a miss
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    # Re-measure an entry whose value grows after insertion (e.g. a lazily loaded workbook)
+    def refresh(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._sizes[key] = self._sizeof(self._entries[key])
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': sum(self._sizes.values()),
+            }
+
+    def _evict(self):
+        # Always keep the most recently inserted entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and sum(self._sizes.values()) > self.max_bytes)
+        ):
+            key, _ = self._entries.popitem(last=False)
+            self._sizes.pop(key, None)
+            self.evictions += 1
+
+# In-memory cache whose entries expire after ttl seconds, with LRU eviction on top
+class MemoryTTLCache:
+    def __init__(self, max_entries=512, ttl=None):
+        self.ttl = ttl
+        self._cache = LRUCache(max_entries=max_entries)
+        self.expired = 0
+
+    def get(self, key, default=None):
+        entry = self._cache.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.time():
+            self.expired += 1
+            return default
+        return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self._cache.put(key, (expires_at, value))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        # Expired entries were found by the LRU layer but are misses for the caller
+        stats['hits'] -= self.expired
+        stats['misses'] += self.expired
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['expired'] = self.expired
+        return stats
+
+# SQLite-backed cache for text values that survives restarts and is shared by every session.
+# Entries expire after ttl seconds; the least recently used rows are dropped past max_entries.
+class SQLiteTTLCache:
+    def __init__(self, path, max_entries=2048, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, created_at = row
+            if self.ttl and created_at + self.ttl < now:
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, value, now, now),
+            )
+            if self.ttl:
+                self._conn.execute('DELETE FROM entries WHERE created_at < ?', (now - self.ttl,))
+            count = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM entries WHERE key IN ('
+                    'SELECT key FROM entries ORDER BY accessed_at ASC LIMIT ?)',
+                    (count - self.max_entries,),
+                )
+                self.evictions += count - self.max_entries
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM entries')
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'entries': entries,
+        }
+
+# Memory budget of the process-wide result store shared by every session (see shared_store)
+RESULT_STORE_MAX_BYTES = 1024 * 1024 * 1024
+
+# A computation in progress that identical concurrent requests wait for
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+# One kind of result in a ResultStore (e.g. aggregates or rendered charts), with the same interface
+# as LRUCache. Limits and sizes are per namespace; the store's memory budget is shared by all of them.
+class StoreNamespace:
+    def __init__(self, store, name, max_entries=None, max_bytes=None, sizeof=None, ttl=None, persist=False,
+                 version=None):
+        self.store = store
+        self.name = name
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.ttl = ttl
+        self.persist = persist
+        # Sizes of this namespace's entries (least recently used first) and their total, kept by the store
+        self.sizes = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.file_hits = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return self.store._contains(self, key)
+
+    def __len__(self):
+        return self.store._count(self)
+
+    def get(self, key, default=None):
+        found, value = self.store._lookup(self, key)
+        return value if found else default
+
+    def peek(self, key, default=None):
+        return self.store._peek(self, key, default)
+
+    def put(self, key, value):
+        self.store._put(self, key, value)
+
+    # Return the stored value for key, computing it on a miss. Concurrent callers asking for the
+    # same missing key wait for one computation instead of repeating it.
+    def get_or_compute(self, key, compute):
+        found, value = self.store._lookup(self, key)
+        if found:
+            return value
+        return self.store._compute(self, key, compute)
+
+    def refresh(self, key):
+        self.store._refresh(self, key)
+
+    def clear(self):
+        self.store._clear(self)
+
+    def stats(self):
+        return self.store._namespace_stats(self)
+
+# Process-wide, thread-safe store of results shared by every session: parsed workbooks, aggregates,
+# charts, rendered images and interpretations, each in its own namespace. Entries are evicted least
+# recently used first once a namespace exceeds its own limits or all namespaces together exceed
+# max_bytes. With a file tier enabled, namespaces created with persist=True also write their
+# entries to disk (pickled), so they survive restarts and evictions from memory. Persisted files
+# are kept per namespace version; files of any other version (e.g. written before a deploy that
+# changed the stored format) are deleted when the namespace meets the file tier.
+class ResultStore:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = RESULT_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        self.directory = None
+        self.file_max_bytes = None
+        self._entries = OrderedDict()  # (namespace, key) -> [value, size, created_at]
+        self._bytes = 0
+        self._file_bytes = 0
+        self._namespaces = {}
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    # Function to get (or create) a namespace; later calls with the same name return the same one.
+    # version names the format of persisted values: bump it whenever what a key maps to changes.
+    def namespace(self, name, max_entries=None, max_bytes=None, sizeof=None, ttl=None, persist=False, version=None):
+        with self._lock:
+            if name not in self._namespaces:
+                namespace = StoreNamespace(self, name, max_entries, max_bytes, sizeof, ttl, persist, version)
+                self._namespaces[name] = namespace
+                if persist and self.directory:
+                    self._remove_stale_files(namespace)
+            return self._namespaces[name]
+
+    # Function to keep persisted namespaces in directory as well, using at most max_bytes of disk
+    def enable_file_tier(self, directory, max_bytes=1024 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self.directory = directory
+            self.file_max_bytes = max_bytes
+            for namespace in self._namespaces.values():
+                if namespace.persist:
+                    self._remove_stale_files(namespace)
+            self._file_bytes = sum(size for _, _, size in self._files())
+
+    def _expired(self, namespace, created_at):
+        return namespace.ttl is not None and created_at + namespace.ttl < time.time()
+
+    def _contains(self, namespace, key):
+        with self._lock:
+            return (namespace.name, key) in self._entries
+
+    def _count(self, namespace):
+        with self._lock:
+            return len(namespace.sizes)
+
+    def _peek(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._entries.get((namespace.name, key))
+            return entry[0] if entry is not None else default
+
+    def _lookup(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace.name, key))
+            if entry is not None:
+                if not self._expired(namespace, entry[2]):
+                    self._entries.move_to_end((namespace.name, key))
+                    namespace.sizes.move_to_end(key)
+                    namespace.hits += 1
+                    return True, entry[0]
+                self._remove((namespace.name, key))
+                namespace.expired += 1
+        if namespace.persist and self.directory:
+            found, value, created_at = self._read_file(namespace, key)
+            if found:
+                self._put(namespace, key, value, created_at=created_at, write_file=False)
+                with self._lock:
+                    namespace.hits += 1
+                    namespace.file_hits += 1
+                return True, value
+        with self._lock:
+            namespace.misses += 1
+        return False, None
+
+    def _compute(self, namespace, key, compute):
+        with self._lock:
+            pending = self._pending.get((namespace.name, key))
+            leader = pending is None
+            if leader:
+                pending = self._pending[(namespace.name, key)] = _Pending()
+            else:
+                namespace.coalesced += 1
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+        try:
+            value = compute()
+            self._put(namespace, key, value)
+            pending.value = value
+            return value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop((namespace.name, key), None)
+            pending.done.set()
+
+    def _put(self, namespace, key, value, created_at=None, write_file=True):
+        size = namespace.sizeof(value)
+        created_at = time.time() if created_at is None else created_at
+        with self._lock:
+            self._remove((namespace.name, key))
+            self._entries[(namespace.name, key)] = [value, size, created_at]
+            self._bytes += size
+            namespace.sizes[key] = size
+            namespace.bytes += size
+            self._evict(namespace, keep=(namespace.name, key))
+        if write_file and namespace.persist and self.directory:
+            self._write_file(namespace, key, value, created_at)
+
+    def _refresh(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace.name, key))
+            if entry is not None:
+                size = namespace.sizeof(entry[0])
+                self._bytes += size - entry[1]
+                namespace.bytes += size - entry[1]
+                namespace.sizes[key] = size
+                entry[1] = size
+                self._evict(namespace, keep=(namespace.name, key))
+
+    def _remove(self, full_key):
+        entry = self._entries.pop(full_key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            namespace = self._namespaces[full_key[0]]
+            namespace.sizes.pop(full_key[1], None)
+            namespace.bytes -= entry[1]
+
+    def _clear(self, namespace):
+        with self._lock:
+            for key in list(namespace.sizes):
+                self._remove((namespace.name, key))
+
+    def _evict(self, namespace, keep):
+        # Namespace limits first (oldest entry of that namespace), then the shared budget (oldest overall).
+        # The entry just inserted is always kept, even if it alone exceeds a budget.
+        while (namespace.max_entries is not None and len(namespace.sizes) > namespace.max_entries) \
+                or (namespace.max_bytes is not None and namespace.bytes > namespace.max_bytes):
+            victim = next((key for key in namespace.sizes if (namespace.name, key) != keep), None)
+            if victim is None:
+                break
+            self._remove((namespace.name, victim))
+            namespace.evictions += 1
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            full_key = next(iter(self._entries))
+            if full_key == keep:
+                self._entries.move_to_end(full_key)
+                full_key = next(iter(self._entries))
+            self._remove(full_key)
+            self._namespaces[full_key[0]].evictions += 1
+
+    def _version_directory(self, namespace):
+        return os.path.join(self.directory, namespace.name, f"v{namespace.version or 0}")
+
+    def _file_path(self, namespace, key):
+        return os.path.join(self._version_directory(namespace), hash_bytes(repr(key).encode('utf-8')) + '.pkl')
+
+    # Function to delete a namespace's files that belong to another version than its current one
+    def _remove_stale_files(self, namespace):
+        current = self._version_directory(namespace)
+        removed = 0
+        for _, path, size in list(self._files(os.path.join(self.directory, namespace.name))):
+            if os.path.dirname(path) == current:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += size
+        self._file_bytes = max(0, self._file_bytes - removed)
+
+    def _files(self, directory=None):
+        for root, _, names in os.walk(directory or self.directory):
+            for name in names:
+                if name.endswith('.pkl'):
+                    stat = os.stat(os.path.join(root, name))
+                    yield stat.st_mtime, os.path.join(root, name), stat.st_size
+
+    def _read_file(self, namespace, key):
+        path = self._file_path(namespace, key)
+        # The file may be deleted meanwhile (e.g. evicted by another thread); that is a miss as well
+        try:
+            with open(path, 'rb') as f:
+                stored_key, created_at, value = pickle.load(f)
+            if stored_key != key or self._expired(namespace, created_at):
+                return False, None, None
+            os.utime(path)  # marks the file as recently used for eviction
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+            return False, None, None
+        return True, value, created_at
+
+    def _write_file(self, namespace, key, value, created_at):
+        path = self._file_path(namespace, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((key, created_at, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            # Values that cannot be pickled simply stay memory-only
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._file_bytes += os.path.getsize(path) - old_size
+            if self._file_bytes > self.file_max_bytes:
+                self._evict_files(keep=path)
+
+    def _evict_files(self, keep):
+        for _, path, size in sorted(self._files()):
+            if self._file_bytes <= self.file_max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._file_bytes -= size
+
+    def _namespace_stats(self, namespace):
+        with self._lock:
+            lookups = namespace.hits + namespace.misses
+            return {
+                'hits': namespace.hits,
+                'misses': namespace.misses,
+                'hit_rate': namespace.hits / lookups if lookups else 0.0,
+                'file_hits': namespace.file_hits,
+                'coalesced': namespace.coalesced,
+                'expired': namespace.expired,
+                'evictions': namespace.evictions,
+                'entries': len(namespace.sizes),
+                'bytes': namespace.bytes,
+            }
+
+    def stats(self):
+        with self._lock:
+            namespaces = list(self._namespaces.values())
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'file_bytes': self._file_bytes if self.directory else None,
+            }
+        stats['namespaces'] = {namespace.name: namespace.stats() for namespace in namespaces}
+        return stats
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+# Function to get the result store shared by every session of this process
+def shared_store():
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = ResultStore()
+        return _shared_store
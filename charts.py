@@ -0,0 +1,263 @@
+import pandas as pd
+import plotly.express as px
+from aggregates import AGGREGATIONS, available_aggregations, data_key, get_aggregates
+from cache import shared_store
+from downsample import downsample_series
+from instrumentation import span
+
+# Built charts are cached per (sheet, option, chart, data, comparison column)
+CHART_CACHE_MAX_ENTRIES = 256
+
+# Facet columns per row when a comparison splits a chart into one panel per source
+COMPARISON_FACET_WRAP = 3
+
+# Function to declare one chart of a business option.
+# aggregation names a table of aggregates.AGGREGATIONS; kind is the plotly.express function.
+# sort/top_n order the table (descending) and keep its first rows, melt reshapes it with
+# DataFrame.melt, downsample reduces long time series (see downsample.py) before plotting.
+# The remaining keyword arguments go to the plotly.express function.
+def chart_spec(aggregation, kind, sort=None, top_n=None, melt=None, downsample=False, **figure):
+    return {
+        'aggregation': aggregation,
+        'kind': kind,
+        'sort': sort,
+        'top_n': top_n,
+        'melt': melt,
+        'downsample': downsample,
+        'figure': figure,
+    }
+
+# Every business option per sheet, in menu order, with the charts it draws.
+# Adding an analysis only needs an entry here (and its aggregation in aggregates.AGGREGATIONS).
+CHART_REGISTRY = {
+    'Pelanggan': {
+        'Analisis demografi pelanggan': [
+            chart_spec('jumlah_per_jenis_kelamin', 'bar', sort='Jumlah', x='Jenis Kelamin Pelanggan', y='Jumlah'),
+            chart_spec('jumlah_per_umur', 'bar', sort='Jumlah', x='Umur Pelanggan', y='Jumlah'),
+            chart_spec('jumlah_per_segmentasi', 'pie', sort='Jumlah', names='Segmentasi Pelanggan', values='Jumlah'),
+        ],
+        'Distribusi usia dan jenis kelamin pelanggan': [
+            chart_spec('jumlah_per_umur_jenis_kelamin', 'histogram', x='Umur Pelanggan', y='Jumlah',
+                       color='Jenis Kelamin Pelanggan', barmode='group'),
+        ],
+        'Segmentasi pelanggan berdasarkan preferensi': [
+            chart_spec('jumlah_per_preferensi_segmentasi', 'sunburst',
+                       path=['Preferensi Pembelian', 'Segmentasi Pelanggan'], values='Jumlah'),
+        ],
+    },
+    'Produk': {
+        'Kinerja penjualan produk dan stok': [
+            chart_spec('terjual_per_produk', 'bar', x='Produk', y='Jumlah Terjual'),
+        ],
+        'Distribusi penjualan berdasarkan kategori produk': [
+            chart_spec('terjual_per_kategori', 'pie', names='Kategori Produk', values='Jumlah Terjual'),
+        ],
+        'Analisis harga produk dan trend penjualan': [
+            chart_spec('terjual_per_tanggal_harga', 'line', downsample=True, x='Tanggal', y='Jumlah Terjual',
+                       color='Harga Produk'),
+        ],
+    },
+    'Transaksi Penjualan': {
+        'Jumlah penjualan, pendapatan, dan metode pembayaran': [
+            chart_spec('pendapatan_per_metode', 'bar', x='Metode Pembayaran', y='Pendapatan'),
+        ],
+        'Tren penjualan': [
+            chart_spec('pendapatan_per_tanggal', 'line', downsample=True, x='Tanggal', y='Pendapatan'),
+        ],
+        'Analisis status penjualan dan metode pembayaran': [
+            chart_spec('jumlah_per_status_metode', 'bar', x='Status Penjualan', y='Jumlah',
+                       color='Metode Pembayaran', barmode='group'),
+        ],
+    },
+    'Lokasi Penjualan': {
+        'Kinerja penjualan di berbagai lokasi': [
+            chart_spec('pendapatan_per_lokasi', 'bar', x='Lokasi', y='Pendapatan'),
+        ],
+        'Distribusi penjualan berdasarkan kota/provinsi': [
+            chart_spec('pendapatan_per_kota', 'pie', names='Kota/Provinsi', values='Pendapatan'),
+        ],
+        'Analisis lokasi dengan penjualan tertinggi/rendah': [
+            chart_spec('pendapatan_per_lokasi', 'bar', sort='Pendapatan', top_n=10, x='Lokasi', y='Pendapatan'),
+        ],
+    },
+    'Staf Penjualan': {
+        'Kinerja dan komisi staf penjualan': [
+            chart_spec('komisi_per_staf', 'bar', x='Nama Staf', y='Komisi'),
+        ],
+        'Analisis penilaian kinerja staf': [
+            chart_spec('kinerja_per_staf', 'bar', x='Nama Staf', y='Penilaian Kinerja'),
+        ],
+        'Distribusi staf berdasarkan posisi/jabatan': [
+            chart_spec('jumlah_per_posisi', 'pie', sort='Jumlah', names='Posisi/Jabatan', values='Jumlah'),
+        ],
+    },
+    'Inventaris': {
+        'Manajemen stok produk': [
+            chart_spec('stok_per_produk', 'bar', x='Produk', y='Stok'),
+        ],
+        'Tren stok masuk dan keluar': [
+            chart_spec('stok_masuk_keluar_per_tanggal', 'line', downsample=True,
+                       melt={'id_vars': 'Tanggal', 'value_vars': ['Stok Masuk', 'Stok Keluar'],
+                             'var_name': 'Tipe', 'value_name': 'Jumlah'},
+                       x='Tanggal', y='Jumlah', color='Tipe'),
+        ],
+        'Analisis produk dengan stok terbanyak/terkecil': [
+            chart_spec('stok_per_produk', 'bar', sort='Stok', top_n=10, x='Produk', y='Stok'),
+        ],
+    },
+    'Promosi dan Pemasaran': {
+        'Efektivitas kampanye promosi': [
+            chart_spec('pendapatan_per_kampanye', 'bar', x='Kampanye Promosi', y='Pendapatan'),
+        ],
+        'Distribusi penjualan berdasarkan media promosi': [
+            chart_spec('pendapatan_per_media', 'pie', names='Media Promosi', values='Pendapatan'),
+        ],
+        'Analisis kode diskon promosi': [
+            chart_spec('pendapatan_per_kode_diskon', 'bar', x='Kode Diskon', y='Pendapatan'),
+        ],
+    },
+    'Feedback dan Pengembalian': {
+        'Masalah dan kepuasan pelanggan': [
+            chart_spec('jumlah_per_masalah', 'bar', sort='Jumlah', x='Masalah Pelanggan', y='Jumlah'),
+        ],
+        'Distribusi alasan pengembalian produk': [
+            chart_spec('jumlah_per_alasan_pengembalian', 'pie', sort='Jumlah', names='Alasan Pengembalian', values='Jumlah'),
+        ],
+        'Status pengembalian produk': [
+            chart_spec('jumlah_per_status_pengembalian', 'bar', sort='Jumlah', x='Status Pengembalian', y='Jumlah'),
+        ],
+    },
+    'Analisis Penjualan': {
+        'Penjualan agregat dan tren': [
+            chart_spec('pendapatan_per_tanggal', 'line', downsample=True, x='Tanggal', y='Pendapatan'),
+        ],
+        'Analisis penjualan berdasarkan produk/kategori': [
+            chart_spec('pendapatan_per_produk', 'bar', x='Produk', y='Pendapatan'),
+        ],
+        'Tren penjualan/tahunan': [
+            chart_spec('pendapatan_per_bulan', 'line', x='Bulan', y='Pendapatan'),
+            chart_spec('pendapatan_per_tahun', 'line', x='Tahun', y='Pendapatan'),
+        ],
+    },
+    'Lainnya': {
+        'Analisis tambahan dan faktor eksternal': [
+            chart_spec('pendapatan_per_faktor_eksternal', 'bar', x='Faktor Eksternal', y='Pendapatan'),
+        ],
+        'Tren penjualan berdasarkan faktor ekonomi': [
+            chart_spec('pendapatan_per_tanggal_faktor_ekonomi', 'line', downsample=True, x='Tanggal',
+                       y='Pendapatan', color='Faktor Ekonomi'),
+        ],
+        'Analisis faktor lingkungan dan penjualan': [
+            chart_spec('pendapatan_per_faktor_lingkungan', 'bar', x='Faktor Lingkungan', y='Pendapatan'),
+        ],
+    },
+}
+
+# Function to estimate the memory of a built chart: its table plus the arrays held by the figure
+def _chart_nbytes(chart):
+    nbytes = int(chart['data'].memory_usage(index=True, deep=True).sum())
+    for trace in chart['figure'].data:
+        for name in ('x', 'y', 'values', 'labels', 'ids', 'parents'):
+            value = getattr(trace, name, None)
+            nbytes += getattr(value, 'nbytes', 0) if value is not None else 0
+    return nbytes
+
+_chart_cache = shared_store().namespace('charts', max_entries=CHART_CACHE_MAX_ENTRIES, sizeof=_chart_nbytes)
+
+# Function to get business info options based on selected sheet
+def get_business_options(sheet_name):
+    return list(CHART_REGISTRY.get(sheet_name, {}))
+
+# Function to list the options of a sheet that can draw at least one chart from the given columns
+def available_options(sheet_name, columns):
+    aggregations = available_aggregations(sheet_name, columns)
+    return [
+        option for option, specs in CHART_REGISTRY.get(sheet_name, {}).items()
+        if any(spec['aggregation'] in aggregations for spec in specs)
+    ]
+
+# Function to list the columns a chart needs (derived columns such as Bulan need Tanggal)
+def required_columns(sheet_name, spec):
+    keys, values, _ = AGGREGATIONS[sheet_name][spec['aggregation']]
+    return sorted({'Tanggal' if col in ('Bulan', 'Tahun') else col for col in keys + values})
+
+# Function to turn a chart spec into its comparison version for aggregates grouped by column as well:
+# the column becomes the chart's color, or one panel per value when the chart already uses color
+# (and for pies); sunbursts get it as their innermost ring
+def comparison_spec(spec, column):
+    figure = dict(spec['figure'])
+    if spec['kind'] == 'sunburst':
+        figure['path'] = [column] + list(figure['path'])
+    elif spec['kind'] == 'pie' or 'color' in figure:
+        figure['facet_col'] = column
+        figure['facet_col_wrap'] = COMPARISON_FACET_WRAP
+    else:
+        figure['color'] = column
+        if spec['kind'] in ('bar', 'histogram'):
+            figure['barmode'] = 'group'
+    melt = spec['melt']
+    if melt:
+        id_vars = melt['id_vars']
+        melt = {**melt, 'id_vars': [column] + ([id_vars] if isinstance(id_vars, str) else list(id_vars))}
+    return {**spec, 'melt': melt, 'figure': figure}
+
+# Function to build one chart dict from its spec and the sheet's aggregates.
+# With compare_by (a column the aggregates are also grouped by) top_n keeps the labels with the
+# largest total over all of its values, so every source shows the same labels.
+def build_chart(option, spec, aggregates, compare_by=None):
+    data = aggregates[spec['aggregation']]
+    if spec['sort']:
+        data = data.sort_values(spec['sort'], ascending=False, kind='stable')
+    if spec['top_n'] and compare_by:
+        label = spec['figure'].get('x', spec['figure'].get('names'))
+        top = data.groupby(label, observed=True)[spec['sort']].sum().nlargest(spec['top_n']).index
+        data = data[data[label].isin(top)]
+    elif spec['top_n']:
+        data = data.head(spec['top_n'])
+    if spec['melt']:
+        data = data.melt(**spec['melt'])
+    chart = {'type': option, 'data': data}
+    if compare_by:
+        chart['compare_by'] = compare_by
+    plot_data = data
+    if spec['downsample']:
+        figure = spec['figure']
+        lines = [col for col in (figure.get('color'), figure.get('facet_col')) if col]
+        plot_data, chart['reduction'] = downsample_series(data, figure['x'], figure['y'], color=lines)
+    with span('build_figure', kind=spec['kind']):
+        chart['figure'] = getattr(px, spec['kind'])(data_frame=plot_data, **spec['figure'])
+    return chart
+
+# Function to make sure date columns are datetimes before aggregating
+def convert_to_date(df, columns):
+    for col in columns:
+        if (col in df.columns) and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+# Function to build the charts of one business option; charts whose columns are missing are skipped.
+# compare_by names a column of df (e.g. the source of a multi-workbook comparison) that every
+# aggregate is also grouped by, drawn as described in comparison_spec.
+def build_charts(sheet_name, selected_business_info, df, compare_by=None):
+    specs = CHART_REGISTRY.get(sheet_name, {}).get(selected_business_info, [])
+    if not specs:
+        return []
+    df = convert_to_date(df, ['Tanggal'])
+    by = [compare_by] if compare_by else []
+    aggregates = get_aggregates(sheet_name, df, by)
+    source = data_key(df)
+    charts = []
+    for index, spec in enumerate(specs):
+        if spec['aggregation'] not in aggregates:
+            continue
+        if compare_by:
+            spec = comparison_spec(spec, compare_by)
+        charts.append(_chart_cache.get_or_compute(
+            (sheet_name, selected_business_info, index, source, compare_by),
+            lambda: build_chart(selected_business_info, spec, aggregates, compare_by),
+        ))
+    return charts
+
+# Function to report chart cache usage
+def chart_cache_stats():
+    return _chart_cache.stats()
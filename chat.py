@@ -0,0 +1,90 @@
+from google.generativeai.types import BrokenResponseError, IncompleteIterationError
+from vis_interpret import CHARS_PER_TOKEN, summarize_charts
+
+# Once the chat history grows past this many (estimated) tokens, older turns are dropped
+# and only the context plus the last CHAT_KEEP_TURNS question/answer pairs are kept
+CHAT_HISTORY_TOKEN_BUDGET = 6000
+CHAT_KEEP_TURNS = 4
+
+CHAT_ACKNOWLEDGEMENT = "Baik, saya sudah memahami chart dan interpretasinya. Silakan ajukan pertanyaan."
+
+# Function to build the context sent once at the start of a chat session
+def build_chat_context(charts, interpretation_text):
+    return (
+        f"Ringkasan chart yang telah divisualkan:\n{summarize_charts(charts)}\n"
+        f"Hasil interpretasi: {interpretation_text}\n"
+        "Jawab setiap pertanyaan berikutnya dalam konteks bisnis."
+    )
+
+# Function to read the text of a history entry (genai Content objects or plain dicts)
+def _content_text(content):
+    parts = content['parts'] if isinstance(content, dict) else content.parts
+    return "".join(part if isinstance(part, str) else getattr(part, 'text', '') for part in parts)
+
+# Function to estimate the token size of a chat history
+def estimate_history_tokens(history):
+    return sum(len(_content_text(content)) for content in history) // CHARS_PER_TOKEN
+
+# Function to start a chat whose history already holds the chart context (and optional earlier turns)
+def _start_chat(model, context, turns=()):
+    history = [
+        {'role': 'user', 'parts': [context]},
+        {'role': 'model', 'parts': [CHAT_ACKNOWLEDGEMENT]},
+    ]
+    for question, answer in turns:
+        history.append({'role': 'user', 'parts': [question]})
+        history.append({'role': 'model', 'parts': [answer]})
+    return model.start_chat(history=history)
+
+# Function to get (or create) the chat state for one sheet/business option.
+# sessions is a dict kept in st.session_state; a new chat starts whenever the context changes.
+# chat_context is the context the current chat was started with (see trim_chat_history).
+def get_chat_state(sessions, key, model, context):
+    state = sessions.get(key)
+    if state is None or state['context'] != context:
+        state = {
+            'context': context,
+            'chat_context': context,
+            'chat': _start_chat(model, context),
+            'turns': [],
+            'dropped_turns': 0,
+        }
+        sessions[key] = state
+    return state
+
+# Function to restart the chat with only the latest turns once the history exceeds the token budget
+def trim_chat_history(state, model, token_budget=None, keep_turns=None):
+    token_budget = CHAT_HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    keep_turns = CHAT_KEEP_TURNS if keep_turns is None else keep_turns
+    if estimate_history_tokens(state['chat'].history) <= token_budget or len(state['turns']) <= keep_turns:
+        return False
+    dropped = state['turns'][:-keep_turns]
+    kept = state['turns'][-keep_turns:]
+    context = state['context']
+    if dropped:
+        # Keep a one-line trace of the dropped questions so follow-ups still make sense
+        context += "\nPertanyaan sebelumnya yang sudah dijawab: " + "; ".join(q for q, _ in dropped)
+    state['chat'] = _start_chat(model, context, kept)
+    state['chat_context'] = context
+    state['dropped_turns'] = len(dropped)
+    return True
+
+# Function to start the chat again from the recorded turns, e.g. after a streamed answer was
+# interrupted by a rerun and left the chat session's history broken
+def restart_chat(state, model):
+    state['chat'] = _start_chat(model, state['chat_context'], state['turns'][state['dropped_turns']:])
+
+# Function to send a question to the chat session; returns a streaming response. The model API is
+# stateless, so every question resends the whole history (context included); trim_chat_history
+# keeps that history within CHAT_HISTORY_TOKEN_BUDGET.
+def send_question(state, model, question):
+    try:
+        trim_chat_history(state, model)
+        return state['chat'].send_message(question, stream=True)
+    except (BrokenResponseError, IncompleteIterationError):
+        restart_chat(state, model)
+        return state['chat'].send_message(question, stream=True)
+
+# Function to record a completed answer so it can be shown again on reruns
+def record_answer(state, question, answer):
+    state['turns'].append((question, answer))
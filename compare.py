@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import pandas as pd
+from aggregates import PREVIEW_ONLY_ATTR, combine_partials, data_key, get_partials, seed_aggregates
+from cache import hash_bytes, shared_store
+from instrumentation import span
+from workbook import frame_nbytes
+
+# Column holding the workbook every row of a comparison comes from
+SOURCE_COLUMN = 'Sumber'
+
+# At most this many workbooks are compared at once, and combined sheets kept for reuse
+COMPARE_MAX_SOURCES = 6
+COMPARE_CACHE_MAX_ENTRIES = 8
+
+# Combined sheets live in the shared result store, keyed by their sources' data
+_combined_cache = shared_store().namespace('comparisons', max_entries=COMPARE_CACHE_MAX_ENTRIES, sizeof=frame_nbytes)
+
+# Function to name the sources of a comparison after their file names (without extension);
+# repeated names get a number so every source stays distinguishable
+def source_labels(file_names):
+    labels = []
+    for file_name in file_names:
+        label = os.path.splitext(os.path.basename(file_name))[0] or "Data"
+        candidate, n = label, 2
+        while candidate in labels:
+            candidate = f"{label} ({n})"
+            n += 1
+        labels.append(candidate)
+    return labels
+
+# Function to list the sheets found in every workbook, in the order of the first one
+def common_sheets(workbooks):
+    if not workbooks:
+        return []
+    return [name for name in workbooks[0].sheet_names if all(name in workbook for workbook in workbooks[1:])]
+
+# Function to identify a comparison by its sources' labels and data
+def comparison_key(sheet_name, frames):
+    parts = [sheet_name] + [f"{label}\x1e{data_key(df)}" for label, df in frames]
+    return hash_bytes("\x1f".join(parts).encode('utf-8'))
+
+# Function to stack the sheets of every source into one frame with the source as a categorical
+# column (in upload order). Only the columns all sources share are kept, and columns that are
+# categorical in every source stay categorical.
+def _concat_sources(frames):
+    columns = [col for col in frames[0][1].columns if all(col in df.columns for _, df in frames[1:])]
+    combined = pd.concat([df[columns] for _, df in frames], ignore_index=True)
+    for col in columns:
+        if all(isinstance(df[col].dtype, pd.CategoricalDtype) for _, df in frames) \
+                and not isinstance(combined[col].dtype, pd.CategoricalDtype):
+            combined[col] = combined[col].astype('category')
+    combined[SOURCE_COLUMN] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(frames)), [len(df) for _, df in frames]),
+        categories=[label for label, _ in frames],
+    )
+    return combined
+
+# Function to add the source as the outermost level of a sheet's partial aggregates
+def _with_source(partials, label):
+    return {
+        (SOURCE_COLUMN,) + keys: pd.concat({label: partial}, names=[SOURCE_COLUMN])
+        for keys, partial in partials.items()
+    }
+
+# Function to combine one sheet of several workbooks for comparison; sources is a list of
+# (label, LazyWorkbook). The result is aggregated like any sheet with SOURCE_COLUMN as an extra
+# group-by column (aggregates.get_aggregates(..., by=[SOURCE_COLUMN])), so every aggregation runs
+# as one groupby over all sources. Streamed sheets only hold a preview, so when a source is
+# streamed the comparison aggregates are seeded from each source's partials instead.
+def combine_sheets(sheet_name, sources):
+    frames = [(label, workbook[sheet_name]) for label, workbook in sources]
+    key = comparison_key(sheet_name, frames)
+
+    def compute():
+        with span('combine_sheets', sheet=sheet_name, sources=len(frames)):
+            combined = _concat_sources(frames)
+        combined.attrs['source_key'] = f"compare:{key}"
+        if any(df.attrs.get(PREVIEW_ONLY_ATTR) for _, df in frames):
+            combined.attrs[PREVIEW_ONLY_ATTR] = True
+        return combined
+
+    combined = _combined_cache.get_or_compute(key, compute)
+    if any(workbook.is_streamed(sheet_name) for _, workbook in sources):
+        partials = combine_partials([_with_source(get_partials(sheet_name, df), label) for label, df in frames])
+        seed_aggregates(sheet_name, combined, partials, by=[SOURCE_COLUMN])
+    return combined
+
+# Function to summarize the sources of a comparison: rows and date range per source
+# (streamed sheets only hold a preview, so their date range is left out)
+def describe_sources(sheet_name, sources):
+    rows = []
+    for label, workbook in sources:
+        df = workbook[sheet_name]
+        report = workbook.reports.get(sheet_name) or {}
+        row = {SOURCE_COLUMN: label, 'Baris': report.get('rows', len(df))}
+        if not workbook.is_streamed(sheet_name) and 'Tanggal' in df.columns \
+                and pd.api.types.is_datetime64_any_dtype(df['Tanggal']):
+            row['Dari'] = df['Tanggal'].min()
+            row['Sampai'] = df['Tanggal'].max()
+        rows.append(row)
+    return pd.DataFrame(rows)
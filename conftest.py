@@ -0,0 +1,2 @@
+# Puts the repository root on sys.path so the tests can import the app's top-level modules
+# (gemini_client, vis_interpret, ...) when pytest is run from here
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# Time-series charts are reduced to at most TREND_MAX_POINTS points per line before px.line.
+# TREND_DOWNSAMPLE_METHOD is 'lttb' (largest triangle three buckets, keeps the visual shape),
+# 'minmax' (keeps every bucket's extremes), 'resample' (sums into weeks/months/years) or None.
+TREND_MAX_POINTS = 1000
+TREND_DOWNSAMPLE_METHOD = 'lttb'
+
+# Resampling frequencies tried in order, with the label shown to users
+RESAMPLE_FREQUENCIES = [('W-MON', 'mingguan'), ('MS', 'bulanan'), ('YS', 'tahunan')]
+
+# Function to turn an x column into floats for the triangle areas (datetimes become nanoseconds)
+def _numeric_x(x):
+    if pd.api.types.is_datetime64_any_dtype(x):
+        values = x.astype('int64').to_numpy()
+        return (values - values[0]).astype(float)
+    return pd.to_numeric(x, errors='coerce').to_numpy(dtype=float)
+
+# Function to pick n indices of a series with Largest-Triangle-Three-Buckets; first and last are kept
+def lttb_indices(x, y, n):
+    length = len(x)
+    if n >= length or n < 3:
+        return np.arange(length)
+    x = np.nan_to_num(np.asarray(x, dtype=float))
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # n - 2 buckets between the first and last point; the final bound makes the last point the next bucket
+    bounds = np.append(np.linspace(1, length - 1, n - 1).astype(int), length)
+    selected = np.empty(n, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(n - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_start, next_end = bounds[i + 1], bounds[i + 2]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    selected[-1] = length - 1
+    return selected
+
+# Function to pick about n indices keeping the minimum and maximum of every bucket; first and last are kept
+def minmax_indices(y, n):
+    length = len(y)
+    if n >= length or n < 4:
+        return np.arange(length)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    bounds = np.linspace(1, length - 1, (n - 2) // 2 + 1).astype(int)
+    selected = {0, length - 1}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end > start:
+            selected.add(start + int(y[start:end].argmin()))
+            selected.add(start + int(y[start:end].argmax()))
+    return np.array(sorted(selected))
+
+# Function to sum a time series into the finest of RESAMPLE_FREQUENCIES that fits max_points per line
+def _resample(data, x, y, colors, max_points):
+    for freq, label in RESAMPLE_FREQUENCIES:
+        keys = [pd.Grouper(key=x, freq=freq)] + colors
+        resampled = data.groupby(keys, observed=True, sort=True)[y].sum().reset_index()
+        per_line = resampled.groupby(colors, observed=True).size().max() if colors else len(resampled)
+        if per_line <= max_points:
+            break
+    if colors:
+        resampled = resampled.sort_values(colors + [x], kind='stable').reset_index(drop=True)
+    return resampled, label
+
+# Function to reduce a (possibly multi-line) time series to at most max_points points per line.
+# color is a column or a list of columns that together identify a line (e.g. color and facet);
+# data must be sorted by x within each color group, as the aggregate tables are.
+# Returns (plot_data, reduction); reduction is None when the data was already small enough,
+# else a dict with the method, resampling frequency and row counts before and after.
+def downsample_series(data, x, y, color=None, max_points=None, method=None):
+    max_points = TREND_MAX_POINTS if max_points is None else max_points
+    method = TREND_DOWNSAMPLE_METHOD if method is None else method
+    colors = [color] if isinstance(color, str) else list(color or [])
+    groups = data.groupby(colors, observed=True, sort=False).indices if colors else {None: np.arange(len(data))}
+    if not method or not max_points or max(len(positions) for positions in groups.values()) <= max_points:
+        return data, None
+
+    frequency = None
+    if method == 'resample' and pd.api.types.is_datetime64_any_dtype(data[x]):
+        reduced, frequency = _resample(data, x, y, colors, max_points)
+    else:
+        if method == 'resample':
+            method = 'lttb'
+        keep = []
+        for positions in groups.values():
+            group = data.iloc[positions]
+            if method == 'minmax':
+                picked = minmax_indices(group[y], max_points)
+            else:
+                picked = lttb_indices(_numeric_x(group[x]), group[y], max_points)
+            keep.append(positions[picked])
+        reduced = data.iloc[np.sort(np.concatenate(keep))].reset_index(drop=True)
+
+    return reduced, {
+        'method': method,
+        'frequency': frequency,
+        'rows_before': len(data),
+        'rows_after': len(reduced),
+    }
+
+# Function to describe an applied reduction for a chart caption
+def describe_reduction(reduction):
+    if reduction['method'] == 'resample':
+        how = f"dijumlahkan per periode {reduction['frequency']}"
+    elif reduction['method'] == 'minmax':
+        how = "diringkas dengan nilai minimum/maksimum per kelompok"
+    else:
+        how = "diringkas dengan LTTB"
+    return f"Grafik menampilkan {reduction['rows_after']:,} dari {reduction['rows_before']:,} titik data ({how})."
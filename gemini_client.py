@@ -0,0 +1,351 @@
+import random
+import threading
+import time
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+from cache import hash_bytes
+from instrumentation import count, observe, span
+
+# Process-wide Gemini limits: a token bucket of GEMINI_RATE_PER_MINUTE requests with bursts of up to
+# GEMINI_BURST, at most GEMINI_RETRIES retries per request with exponential backoff (plus jitter),
+# and a retry budget: every request earns GEMINI_RETRY_BUDGET_RATIO of a retry, so under sustained
+# errors retries stay a fraction of traffic instead of multiplying it
+GEMINI_RATE_PER_MINUTE = 60
+GEMINI_BURST = 10
+GEMINI_RETRIES = 2
+GEMINI_RETRY_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+GEMINI_RETRY_BUDGET_RATIO = 0.2
+GEMINI_RETRY_BUDGET_CAPACITY = 10  # retries that can be spent in a burst
+
+# Errors worth retrying: server errors, timeouts and quota (429) responses
+RETRYABLE_ERRORS = (InternalServerError, DeadlineExceeded, ResourceExhausted, ServiceUnavailable)
+
+# Token estimates for responses without usage metadata (e.g. the local backend): Gemini bills an
+# image as a fixed number of tokens and text is roughly 4 characters per token
+ESTIMATED_IMAGE_TOKENS = 258
+ESTIMATED_CHARS_PER_TOKEN = 4
+
+# Token bucket refilled continuously at rate tokens per second, holding at most capacity tokens
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    # Function to take one token, waiting until one is available; returns the seconds waited
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+# Budget shared by all requests: each request deposits ratio (up to capacity), each retry withdraws one
+class RetryBudget:
+    def __init__(self, ratio, capacity):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+# Response-like object handed to coalesced callers (and yielded as a single chunk when streaming)
+class CoalescedResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        yield self
+
+    def resolve(self):
+        pass
+
+# One in-flight request that identical concurrent requests wait for. A flight is abandoned when
+# its leader stops reading a stream early (e.g. a rerun closes it); its followers then call again.
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.error = None
+        self.abandoned = False
+
+# Function to encode the parts of a request as bytes (text as UTF-8; images are already
+# {'mime_type', 'data'} parts holding PNG bytes, see vis_interpret.fig_to_image_part)
+def content_parts(contents):
+    parts = []
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, dict) and 'mime_type' in part:
+            parts.append(('image', part['data']))
+        else:
+            parts.append(('text', str(part).encode('utf-8')))
+    return parts
+
+# Function to encode the text of a chat history (genai Content objects or plain dicts) as request parts
+def history_parts(history):
+    parts = []
+    for content in history or []:
+        for part in content['parts'] if isinstance(content, dict) else content.parts:
+            text = part if isinstance(part, str) else getattr(part, 'text', '')
+            if text:
+                parts.append(('text', text.encode('utf-8')))
+    return parts
+
+# Function to build the coalescing key of a request from its encoded parts
+def request_key(parts, kwargs):
+    digest = [hash_bytes(data) for _, data in parts]
+    options = {key: value for key, value in kwargs.items() if key != 'request_options'}
+    return hash_bytes(("\x1f".join(digest) + repr(sorted(options.items()))).encode('utf-8'))
+
+# Function to count the tokens and bytes of one API call. Token counts come from the response's
+# usage metadata when the backend reports it, otherwise they are estimated from the payload.
+def record_usage(parts, text, usage=None, kind='generate'):
+    count('request_bytes', sum(len(data) for _, data in parts), kind=kind)
+    count('response_bytes', len(text.encode('utf-8')), kind=kind)
+    if usage is not None and getattr(usage, 'prompt_token_count', None) is not None:
+        prompt_tokens = usage.prompt_token_count
+        response_tokens = usage.candidates_token_count or 0
+        source = 'usage'
+    else:
+        prompt_tokens = sum(
+            ESTIMATED_IMAGE_TOKENS if part_kind == 'image' else len(data) // ESTIMATED_CHARS_PER_TOKEN
+            for part_kind, data in parts
+        )
+        response_tokens = len(text) // ESTIMATED_CHARS_PER_TOKEN
+        source = 'estimate'
+    count('prompt_tokens', prompt_tokens, kind=kind, source=source)
+    count('response_tokens', response_tokens, kind=kind, source=source)
+
+# Process-wide wrapper around a genai.GenerativeModel (or any object with the same methods, e.g. a
+# local fake for tests). generate_content is rate limited, retried with backoff within the retry
+# budget and coalesced: concurrent identical prompts share one in-flight call.
+# Everything else (count_tokens, model_name, ...) is passed through to the wrapped model.
+class GeminiClient:
+    def __init__(self, model, rate_per_minute=None, burst=None, retries=None, backoff=None,
+                 budget_ratio=None, budget_capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.model = model
+        self.retries = GEMINI_RETRIES if retries is None else retries
+        self.backoff = GEMINI_RETRY_BACKOFF if backoff is None else backoff
+        self._sleep = sleep
+        self._bucket = TokenBucket(
+            (GEMINI_RATE_PER_MINUTE if rate_per_minute is None else rate_per_minute) / 60.0,
+            GEMINI_BURST if burst is None else burst,
+            clock=clock, sleep=sleep,
+        )
+        self._budget = RetryBudget(
+            GEMINI_RETRY_BUDGET_RATIO if budget_ratio is None else budget_ratio,
+            GEMINI_RETRY_BUDGET_CAPACITY if budget_capacity is None else budget_capacity,
+        )
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'api_calls': 0, 'coalesced': 0, 'retries': 0,
+                       'budget_exhausted': 0, 'throttled_s': 0.0}
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    # Function to wait for a rate-limit token and make one API call
+    def _call(self, fn, *args, **kwargs):
+        waited = self._bucket.acquire()
+        if waited:
+            self._count('throttled_s', waited)
+        self._count('api_calls')
+        return fn(*args, **kwargs)
+
+    # Function to decide whether a failed attempt may be retried; waits out the backoff if so
+    def _may_retry(self, attempt):
+        if attempt >= self.retries:
+            return False
+        if not self._budget.try_spend():
+            self._count('budget_exhausted')
+            return False
+        self._count('retries')
+        self._sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        return True
+
+    # Function to run fn with retries on transient errors while attempts and the budget allow
+    def _with_retries(self, fn, *args, **kwargs):
+        self._budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return self._call(fn, *args, **kwargs)
+            except RETRYABLE_ERRORS:
+                if not self._may_retry(attempt):
+                    raise
+                attempt += 1
+
+    # Function to join an identical in-flight request, or register this one as the leader.
+    # rejoin is set by followers of an abandoned flight, which were already counted.
+    def _join_flight(self, key, rejoin=False):
+        with self._lock:
+            if not rejoin:
+                self._stats['requests'] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                if not rejoin:
+                    self._stats['coalesced'] += 1
+                return flight, False
+            if rejoin:
+                # The follower of an abandoned flight makes its own call after all
+                self._stats['coalesced'] -= 1
+            flight = _Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def _finish_flight(self, key, flight, text=None, error=None, abandoned=False):
+        flight.text = text
+        flight.error = error
+        flight.abandoned = abandoned
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    # Function to wait for the leader's answer; returns None if the leader abandoned the flight
+    def _follow(self, flight):
+        flight.done.wait()
+        if flight.abandoned:
+            return None
+        if flight.error is not None:
+            raise flight.error
+        return CoalescedResponse(flight.text)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        parts = content_parts(contents)
+        key = request_key(parts, kwargs)
+        if stream:
+            return self._stream(key, parts, contents, kwargs)
+        flight, leader = self._join_flight(key)
+        while not leader:
+            response = self._follow(flight)
+            if response is not None:
+                return response
+            flight, leader = self._join_flight(key, rejoin=True)
+        try:
+            with span('generate_content', stream=False):
+                response = self._with_retries(self.model.generate_content, contents, **kwargs)
+                text = response.text
+        except Exception as e:
+            self._finish_flight(key, flight, error=e)
+            raise
+        except BaseException:
+            self._finish_flight(key, flight, abandoned=True)
+            raise
+        self._finish_flight(key, flight, text=text)
+        record_usage(parts, text, getattr(response, 'usage_metadata', None))
+        return response
+
+    # Streaming calls yield chunks as they arrive; retries happen only before the first chunk.
+    # Followers of an identical in-flight request get the leader's full text as one chunk; if the
+    # leader's stream is closed before its end, they make their own call instead.
+    # The request only joins (or leads) a flight once iteration starts. The time to the first
+    # chunk is recorded as its own span, since the whole stream also includes the consumer's time.
+    def _stream(self, key, request_parts, contents, kwargs):
+        flight, leader = self._join_flight(key)
+        while not leader:
+            response = self._follow(flight)
+            if response is not None:
+                yield from response
+                return
+            flight, leader = self._join_flight(key, rejoin=True)
+        parts = []
+        usage = None
+        self._budget.record_request()
+        attempt = 0
+        start = time.perf_counter()
+        try:
+            with span('generate_content', stream=True):
+                while True:
+                    try:
+                        for chunk in self._call(self.model.generate_content, contents, stream=True, **kwargs):
+                            if not parts:
+                                observe('generate_first_chunk', time.perf_counter() - start)
+                            parts.append(chunk.text)
+                            usage = getattr(chunk, 'usage_metadata', None) or usage
+                            yield chunk
+                        break
+                    except RETRYABLE_ERRORS:
+                        if parts or not self._may_retry(attempt):
+                            raise
+                        attempt += 1
+        except Exception as e:
+            self._finish_flight(key, flight, error=e)
+            raise
+        except BaseException:
+            # GeneratorExit (the consumer closed the stream) or an interrupt: not the followers' error
+            self._finish_flight(key, flight, abandoned=True)
+            raise
+        text = "".join(parts)
+        self._finish_flight(key, flight, text=text)
+        record_usage(request_parts, text, usage)
+
+    # Chat sessions are per user, so they are rate limited and retried but never coalesced
+    def start_chat(self, **kwargs):
+        return GeminiChat(self, self.model.start_chat(**kwargs))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['throttled_s'] = round(stats['throttled_s'], 2)
+        return stats
+
+# Chat session whose send_message goes through the client's rate limiter and retries.
+# Usage counts the history sent along with every message, since the API resends it each turn.
+class GeminiChat:
+    def __init__(self, client, chat):
+        self._client = client
+        self._chat = chat
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+    def send_message(self, content, **kwargs):
+        self._client._count('requests')
+        parts = history_parts(self._chat.history) + content_parts(content)
+        with span('chat_message', stream=bool(kwargs.get('stream'))):
+            response = self._client._with_retries(self._chat.send_message, content, **kwargs)
+        if kwargs.get('stream'):
+            return CountedStream(response, parts)
+        record_usage(parts, response.text, getattr(response, 'usage_metadata', None), kind='chat')
+        return response
+
+# Streaming chat response that records its usage once it has been read to the end
+class CountedStream:
+    def __init__(self, response, parts):
+        self._response = response
+        self._parts = parts
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        texts = []
+        usage = None
+        for chunk in self._response:
+            texts.append(chunk.text)
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            yield chunk
+        record_usage(self._parts, "".join(texts), usage, kind='chat')
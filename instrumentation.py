@@ -0,0 +1,208 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Spans kept per process for inspection, and the prefix of exported metric names
+SPAN_HISTORY = 500
+METRICS_PREFIX = 'umkm'
+
+logger = logging.getLogger('umkm.instrumentation')
+
+# The trace of the dashboard run the current code belongs to (None outside a run, e.g. in prefetch workers)
+_current_trace = contextvars.ContextVar('umkm_trace', default=None)
+
+# Spans and counters of one dashboard run (one Streamlit script run of a session)
+class Trace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def add_count(self, name, amount):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Function to total the spans of this run per name: count, total and slowest in milliseconds
+    def summary(self):
+        with self._lock:
+            spans = list(self.spans)
+        totals = {}
+        for record in spans:
+            stats = totals.setdefault(record['span'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += record['ms']
+            stats['max_ms'] = max(stats['max_ms'], record['ms'])
+        return totals
+
+# Process-wide span statistics and counters, labelled like Prometheus series
+class Metrics:
+    def __init__(self, history=None):
+        self._spans = {}
+        self._counters = {}
+        self.recent = deque(maxlen=SPAN_HISTORY if history is None else history)
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, labels, error=False):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            stats = self._spans.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0})
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['errors'] += bool(error)
+
+    def count(self, name, amount, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return (
+                {key: dict(stats) for key, stats in self._spans.items()},
+                dict(self._counters),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self.recent.clear()
+
+_metrics = Metrics()
+
+# Function to start a new trace for the current dashboard run; spans and counts recorded in this
+# context (and in work handed off with bind_context) are added to it
+def start_trace():
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+def current_trace():
+    return _current_trace.get()
+
+# Function to wrap fn so it runs in the caller's context (and thus trace) when called from another
+# thread, e.g. by a ThreadPoolExecutor; every call gets its own copy so calls may run concurrently
+def bind_context(fn):
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+# Function to record a finished span of the given duration
+def observe(name, seconds, error=False, **labels):
+    labels = {key: str(value) for key, value in labels.items() if value is not None}
+    _metrics.observe(name, seconds, labels, error)
+    trace = _current_trace.get()
+    record = {'span': name, 'ms': round(seconds * 1000, 2), **labels}
+    if error:
+        record['error'] = True
+    if trace is not None:
+        record['trace'] = trace.id
+        record['start_ms'] = round((time.perf_counter() - trace.started - seconds) * 1000, 2)
+        trace.add_span(record)
+    _metrics.recent.append(record)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({'event': 'span', **record}, ensure_ascii=False))
+
+# Context manager timing a block as a span; exceptions are recorded on the span and re-raised
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, error, **labels)
+
+# Function to add to a counter (e.g. tokens or payload bytes), process-wide and for the current trace
+def count(name, amount=1, **labels):
+    labels = {key: str(value) for key, value in labels.items() if value is not None}
+    _metrics.count(name, amount, labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count(name, amount)
+
+# Function to list the most recent spans of the process (newest last)
+def recent_spans():
+    return list(_metrics.recent)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+# Function to render every span statistic and counter in the Prometheus text exposition format
+def render_prometheus():
+    spans, counters = _metrics.snapshot()
+    lines = [
+        f"# HELP {METRICS_PREFIX}_span_seconds Duration of instrumented stages.",
+        f"# TYPE {METRICS_PREFIX}_span_seconds summary",
+    ]
+    for (name, labels), stats in sorted(spans.items()):
+        series = _format_labels((('span', name),) + labels)
+        lines.append(f"{METRICS_PREFIX}_span_seconds_count{series} {stats['count']}")
+        lines.append(f"{METRICS_PREFIX}_span_seconds_sum{series} {stats['sum']:.6f}")
+    lines.append(f"# TYPE {METRICS_PREFIX}_span_seconds_max gauge")
+    for (name, labels), stats in sorted(spans.items()):
+        lines.append(f"{METRICS_PREFIX}_span_seconds_max{_format_labels((('span', name),) + labels)} {stats['max']:.6f}")
+    lines.append(f"# TYPE {METRICS_PREFIX}_span_errors_total counter")
+    for (name, labels), stats in sorted(spans.items()):
+        lines.append(f"{METRICS_PREFIX}_span_errors_total{_format_labels((('span', name),) + labels)} {stats['errors']}")
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{METRICS_PREFIX}_{name}_total{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Function to serve GET /metrics on host:port from a daemon thread; returns the server
+def start_metrics_server(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+# Function to write every span as one JSON line to stderr (or the given handler)
+def configure_logging(level=logging.INFO, handler=None):
+    handler = handler or logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return handler
+
+# Function to reset the process-wide statistics (e.g. between benchmark runs)
+def reset_metrics():
+    _metrics.clear()
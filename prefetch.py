@@ -0,0 +1,101 @@
+import queue
+import threading
+
+# Worker threads and queue size of the shared prefetcher; tasks beyond the queue size are dropped
+PREFETCH_WORKERS = 2
+PREFETCH_QUEUE_SIZE = 16
+
+# Background pool that runs low-priority work (e.g. charts and interpretations of options the
+# user has not opened yet) so their results are already cached when they are needed.
+# Tasks belong to the sessions that asked for them; cancel(session_id) withdraws that session from
+# every task still queued, and a task is skipped once all of its sessions have withdrawn.
+# Work is deduplicated by key while it is queued or running: a second session asking for a queued
+# key joins the task instead of queueing it again. A session's generation is only kept while it
+# has tasks pending, so sessions that come and go leave nothing behind.
+class Prefetcher:
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = PREFETCH_WORKERS if workers is None else workers
+        self._queue = queue.Queue(maxsize=PREFETCH_QUEUE_SIZE if queue_size is None else queue_size)
+        self._lock = threading.Lock()
+        self._generations = {}  # session_id -> generation, for sessions with pending tasks
+        self._pending = {}  # key -> {session_id: generation} of the sessions that asked for it
+        self._threads = []
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"prefetch-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Function to queue fn(*args) for a session; returns False when it is already pending (the session
+    # then joins the pending task) or the queue is full
+    def submit(self, session_id, key, fn, *args):
+        with self._lock:
+            generation = self._generations.get(session_id, 0)
+            if key in self._pending:
+                self._pending[key][session_id] = generation
+                return False
+            self._start()
+            try:
+                self._queue.put_nowait((key, fn, args))
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self._pending[key] = {session_id: generation}
+            self.submitted += 1
+            return True
+
+    # Function to withdraw a session from every task that has not started yet
+    def cancel(self, session_id):
+        with self._lock:
+            if self._has_pending(session_id):
+                self._generations[session_id] = self._generations.get(session_id, 0) + 1
+            else:
+                self._generations.pop(session_id, None)
+
+    def _has_pending(self, session_id):
+        return any(session_id in sessions for sessions in self._pending.values())
+
+    def _run(self):
+        while True:
+            key, fn, args = self._queue.get()
+            try:
+                with self._lock:
+                    cancelled = all(
+                        generation != self._generations.get(session_id, 0)
+                        for session_id, generation in self._pending[key].items()
+                    )
+                    if cancelled:
+                        self.cancelled += 1
+                if cancelled:
+                    continue
+                try:
+                    fn(*args)
+                except Exception:
+                    # A failed prefetch is simply recomputed when the user opens the option
+                    with self._lock:
+                        self.failed += 1
+                else:
+                    with self._lock:
+                        self.completed += 1
+            finally:
+                with self._lock:
+                    for session_id in self._pending.pop(key, {}):
+                        if not self._has_pending(session_id):
+                            self._generations.pop(session_id, None)
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queued': self._queue.qsize(),
+        }
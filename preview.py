@@ -0,0 +1,53 @@
+import math
+import numpy as np
+import pandas as pd
+from aggregates import data_key
+from cache import LRUCache
+
+# Rows per preview page and how many pages/filter results each session keeps
+PREVIEW_PAGE_SIZE = 50
+PREVIEW_CACHE_ENTRIES = 32
+
+# Function to create the per-session cache of preview pages (kept in st.session_state)
+def new_preview_cache():
+    return LRUCache(max_entries=PREVIEW_CACHE_ENTRIES)
+
+# Function to find the row positions whose value in column contains query (case-insensitive).
+# Categorical columns only match their categories, so the rows themselves are not converted to text.
+def filter_positions(df, column=None, query=""):
+    if not column or not query or column not in df.columns:
+        return np.arange(len(df))
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        matched = categories[categories.astype(str).str.contains(query, case=False, regex=False)]
+        mask = values.isin(matched)
+    else:
+        mask = values.astype(str).str.contains(query, case=False, regex=False)
+    return np.flatnonzero(mask.to_numpy(dtype=bool, na_value=False))
+
+# Function to count the pages needed for total rows (at least one, so empty results still show a page)
+def page_count(total, page_size=None):
+    page_size = page_size or PREVIEW_PAGE_SIZE
+    return max(1, math.ceil(total / page_size))
+
+# Function to get the filtered row positions of a sheet through the cache
+def cached_positions(cache, df, filter_column=None, query=""):
+    return cache.get_or_compute(
+        ('filter', data_key(df), filter_column, query),
+        lambda: filter_positions(df, filter_column, query),
+    )
+
+# Function to get one page of the (filtered) sheet with only the selected columns.
+# Filter results and pages are cached per data/columns/filter, so revisiting a page costs nothing.
+# Returns (page DataFrame, total matching rows).
+def preview_page(cache, df, columns=None, filter_column=None, query="", page=1, page_size=None):
+    page_size = page_size or PREVIEW_PAGE_SIZE
+    columns = [col for col in (columns or df.columns) if col in df.columns]
+    positions = cached_positions(cache, df, filter_column, query)
+    start = (page - 1) * page_size
+    rows = cache.get_or_compute(
+        ('page', data_key(df), tuple(columns), filter_column, query, page, page_size),
+        lambda: df.iloc[positions[start:start + page_size]][columns],
+    )
+    return rows, len(positions)
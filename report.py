@@ -0,0 +1,246 @@
+import argparse
+import base64
+import html
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from backends import create_backend, load_api_key
+from charts import CHART_REGISTRY, available_options, build_charts
+from gemini_client import GeminiClient
+from vis_interpret import (
+    INTERPRET_CONCURRENCY, RENDER_POOL_SIZE, build_general_prompt, fig_to_png_bytes,
+    interpret_mode_for, interpret_single_chart, start_renderer_pool
+)
+from workbook import LazyWorkbook
+
+# Gemini requests per minute allowed across the whole batch run, and the worker pool sizes
+REPORT_RATE_LIMIT = 60
+REPORT_INTERPRET_WORKERS = INTERPRET_CONCURRENCY
+REPORT_RENDER_WORKERS = RENDER_POOL_SIZE
+
+# Thread-safe per-stage timing (count, total and slowest call in milliseconds)
+class StageTimer:
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                stats = self._stages.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                stats['count'] += 1
+                stats['total_ms'] += elapsed
+                stats['max_ms'] = max(stats['max_ms'], elapsed)
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': stats['count'],
+                    'total_ms': round(stats['total_ms'], 2),
+                    'mean_ms': round(stats['total_ms'] / stats['count'], 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                }
+                for name, stats in self._stages.items()
+            }
+
+def _render(timer, figure):
+    with timer.stage('render'):
+        return fig_to_png_bytes(figure)
+
+# Image-mode interpretations wait for their chart's render so the PNG is reused, not drawn twice
+def _interpret(timer, sheet_name, chart, model, general_prompt, png_future, mode=None):
+    if png_future is not None and interpret_mode_for(chart, mode) == 'image':
+        png_future.result()
+    with timer.stage('interpret'):
+        return interpret_single_chart(sheet_name, chart, model, general_prompt, mode=mode)
+
+def _result(future):
+    if future is None:
+        return None, None
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+# Function to run every available option of every sheet of a workbook. Charts are built in order
+# while rendering and Gemini calls run concurrently in separate pools, with every Gemini request
+# going through one rate-limited GeminiClient. model=None skips interpretation and render=False
+# skips figures. If the renderer cannot start (e.g. no Chrome on this host), every chart records the
+# render error and is interpreted from its data instead of its image.
+# Returns (sections, summary); each section holds a sheet, an option and its charts.
+def run_report(path, model=None, rate_per_minute=None, sheets=None, render=True,
+               interpret_workers=None, render_workers=None):
+    timer = StageTimer()
+    start = time.perf_counter()
+    with timer.stage('load'), open(path, 'rb') as f:
+        workbook = LazyWorkbook(f.read())
+    if model is not None and not isinstance(model, GeminiClient):
+        model = GeminiClient(model, rate_per_minute=REPORT_RATE_LIMIT if rate_per_minute is None else rate_per_minute)
+    renderer_error = None
+    if render:
+        try:
+            with timer.stage('renderer_startup'):
+                start_renderer_pool()
+        except Exception as e:
+            renderer_error = f"{type(e).__name__}: {e}"
+            render = False
+    interpret_mode = 'data' if renderer_error else None
+
+    sections = []
+    with ThreadPoolExecutor(max_workers=render_workers or REPORT_RENDER_WORKERS) as render_pool, \
+            ThreadPoolExecutor(max_workers=interpret_workers or REPORT_INTERPRET_WORKERS) as interpret_pool:
+        for sheet_name in workbook.sheet_names:
+            if sheet_name not in CHART_REGISTRY or (sheets and sheet_name not in sheets):
+                continue
+            with timer.stage('load'):
+                df = workbook[sheet_name]
+            general_prompt = build_general_prompt(sheet_name)
+            for option in available_options(sheet_name, df.columns):
+                with timer.stage('charts'):
+                    charts = build_charts(sheet_name, option, df)
+                pending = []
+                for chart in charts:
+                    png = render_pool.submit(_render, timer, chart['figure']) if render else None
+                    text = None
+                    if model is not None:
+                        text = interpret_pool.submit(
+                            _interpret, timer, sheet_name, chart, model, general_prompt, png, interpret_mode
+                        )
+                    pending.append((chart, png, text))
+                sections.append({'sheet': sheet_name, 'option': option, 'pending': pending})
+
+        errors = 0
+        for section in sections:
+            section['charts'] = []
+            for chart, png_future, text_future in section.pop('pending'):
+                png, render_error = _result(png_future)
+                render_error = render_error or renderer_error
+                text, interpret_error = _result(text_future)
+                errors += bool(render_error) + bool(interpret_error)
+                section['charts'].append({
+                    'type': chart['type'],
+                    'png': png,
+                    'interpretation': text,
+                    'errors': [error for error in (render_error, interpret_error) if error],
+                })
+
+    wall_ms = (time.perf_counter() - start) * 1000
+    chart_count = sum(len(section['charts']) for section in sections)
+    summary = {
+        'workbook': os.path.basename(path),
+        'sheets': len({section['sheet'] for section in sections}),
+        'options': len(sections),
+        'charts': chart_count,
+        'errors': errors,
+        'wall_ms': round(wall_ms, 2),
+        'charts_per_second': round(chart_count / (wall_ms / 1000), 2) if wall_ms else None,
+        'stages': timer.summary(),
+    }
+    if model is not None:
+        summary['gemini'] = model.stats()
+    return sections, summary
+
+def _png_data_uri(png):
+    return "data:image/png;base64," + base64.b64encode(png).decode('ascii')
+
+# Function to write the report as a single Markdown file with embedded figures
+def write_markdown(sections, summary, output):
+    lines = [f"# Laporan Lengkap - {summary['workbook']}", ""]
+    current_sheet = None
+    for section in sections:
+        if section['sheet'] != current_sheet:
+            current_sheet = section['sheet']
+            lines += [f"## {current_sheet}", ""]
+        lines += [f"### {section['option']}", ""]
+        for chart in section['charts']:
+            if chart['png']:
+                lines += [f"![{chart['type']}]({_png_data_uri(chart['png'])})", ""]
+            if chart['interpretation']:
+                lines += [chart['interpretation'], ""]
+            for error in chart['errors']:
+                lines += [f"> Gagal: {error}", ""]
+    lines += ["## Waktu Proses", "", "| Tahap | Jumlah | Total (ms) | Rata-rata (ms) | Maks (ms) |", "|---|---|---|---|---|"]
+    for name, stats in summary['stages'].items():
+        lines.append(f"| {name} | {stats['count']} | {stats['total_ms']} | {stats['mean_ms']} | {stats['max_ms']} |")
+    lines += ["", f"{summary['charts']} grafik dalam {summary['wall_ms'] / 1000:.1f} detik "
+                  f"({summary['charts_per_second']} grafik/detik).", ""]
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+
+# Function to write the report as a single self-contained HTML file with embedded figures
+def write_html(sections, summary, output):
+    title = html.escape(f"Laporan Lengkap - {summary['workbook']}")
+    parts = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset=\"utf-8\"><title>{title}</title>",
+        "<style>body{font-family:sans-serif;max-width:960px;margin:auto}img{max-width:100%}"
+        ".text{white-space:pre-wrap}.error{color:#b00}table{border-collapse:collapse}"
+        "td,th{border:1px solid #ccc;padding:4px 8px}</style></head><body>",
+        f"<h1>{title}</h1>",
+    ]
+    current_sheet = None
+    for section in sections:
+        if section['sheet'] != current_sheet:
+            current_sheet = section['sheet']
+            parts.append(f"<h2>{html.escape(current_sheet)}</h2>")
+        parts.append(f"<h3>{html.escape(section['option'])}</h3>")
+        for chart in section['charts']:
+            if chart['png']:
+                parts.append(f"<img alt=\"{html.escape(chart['type'])}\" src=\"{_png_data_uri(chart['png'])}\">")
+            if chart['interpretation']:
+                parts.append(f"<div class=\"text\">{html.escape(chart['interpretation'])}</div>")
+            for error in chart['errors']:
+                parts.append(f"<p class=\"error\">Gagal: {html.escape(error)}</p>")
+    parts.append("<h2>Waktu Proses</h2><table><tr><th>Tahap</th><th>Jumlah</th><th>Total (ms)</th>"
+                 "<th>Rata-rata (ms)</th><th>Maks (ms)</th></tr>")
+    for name, stats in summary['stages'].items():
+        parts.append(f"<tr><td>{html.escape(name)}</td><td>{stats['count']}</td><td>{stats['total_ms']}</td>"
+                     f"<td>{stats['mean_ms']}</td><td>{stats['max_ms']}</td></tr>")
+    parts.append(f"</table><p>{summary['charts']} grafik dalam {summary['wall_ms'] / 1000:.1f} detik "
+                 f"({summary['charts_per_second']} grafik/detik).</p></body></html>")
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write("\n".join(parts))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Interpret every sheet and business option of a workbook into one report.")
+    parser.add_argument('workbook', help="Excel workbook (.xlsx) to report on")
+    parser.add_argument('--output', default='report.html', help="Report file (.html or .md)")
+    parser.add_argument('--format', choices=['html', 'markdown'], help="Report format (default: from the output extension)")
+    parser.add_argument('--sheets', help="Comma-separated sheets to include (default: all)")
+    parser.add_argument('--rate', type=float, default=REPORT_RATE_LIMIT, help="Gemini requests per minute")
+    parser.add_argument('--no-render', action='store_true', help="Leave figures out of the report")
+    parser.add_argument('--no-interpret', action='store_true', help="Only draw the charts, without Gemini")
+    parser.add_argument('--backend', choices=['gemini', 'local'], default='gemini',
+                        help="Model backend; 'local' answers offline with deterministic text")
+    parser.add_argument('--summary', help="Write the timing summary as JSON to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    model = None
+    if not args.no_interpret:
+        api_key = load_api_key() if args.backend == 'gemini' else None
+        model = create_backend(args.backend, api_key=api_key)
+
+    sheets = set(args.sheets.split(',')) if args.sheets else None
+    sections, summary = run_report(args.workbook, model, args.rate, sheets, render=not args.no_render)
+    report_format = args.format or ('markdown' if args.output.endswith(('.md', '.markdown')) else 'html')
+    (write_markdown if report_format == 'markdown' else write_html)(sections, summary, args.output)
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,26 @@
+import os
 import streamlit as st
 import pandas as pd
 import time
-import google.generativeai as genai
-from google.api_core.exceptions import InternalServerError
+import uuid
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted
 from dotenv import load_dotenv
-from vis_interpret import (
-    visualize_pelanggan, visualize_produk, visualize_transaksi_penjualan, 
-    visualize_lokasi_penjualan, visualize_staf_penjualan, visualize_inventaris, 
-    visualize_promosi_pemasaran, visualize_feedback_pengembalian, 
-    visualize_analisis_penjualan, visualize_lainnya
-)
+from backends import create_backend
+from instrumentation import configure_logging, span, start_metrics_server, start_trace
+from gemini_client import GeminiClient
+from cache import MemoryTTLCache, SQLiteTTLCache, hash_bytes, shared_store
+from workbook import LazyWorkbook, ParquetSheetCache, WorkbookTooLargeError, check_upload_size
+from aggregates import PreviewOnlyError, aggregate_cache_stats, appended_rows, data_key
+from compare import COMPARE_MAX_SOURCES, SOURCE_COLUMN, combine_sheets, common_sheets, describe_sources, source_labels
+from downsample import describe_reduction
+from prefetch import Prefetcher
+from preview import PREVIEW_PAGE_SIZE, cached_positions, new_preview_cache, page_count, preview_page
+from chat import build_chat_context, get_chat_state, record_answer, send_question
+from charts import available_options, chart_cache_stats
+from vis_interpret import PROMPT_VERSION, visualize, set_interpretation_cache, start_renderer_pool, render_stats
+
+# Every script run gets its own trace of timed stages (shown in the debug panel)
+trace = start_trace()
 
 st.title("🚀Pantau Kinerja Bisnis Kamu!")
 st.write(
@@ -19,191 +30,474 @@ st.write(
 # Section divider
 st.markdown("---")
 
-# Ambil API key dari variabel lingkungan
-API_KEY = st.secrets["general"]["API_KEY"]
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel(model_name='gemini-1.5-flash')  # Model untuk interpretasi dan chatbot
+# Model backend: 'gemini' (needs the API key from secrets.toml) or 'local', an offline stub with
+# deterministic answers for load testing. Set MODEL_BACKEND in the environment to switch.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')
+
+# One model client per process, shared by every session: rate limited, retried and coalesced
+@st.cache_resource
+def get_model():
+    if MODEL_BACKEND == 'local':
+        return GeminiClient(create_backend('local'))
+    # Ambil API key dari secrets
+    API_KEY = st.secrets["general"]["API_KEY"]
+    return GeminiClient(create_backend('gemini', api_key=API_KEY, model_name='gemini-1.5-flash'))
+
+model = get_model()  # Model untuk interpretasi dan chatbot
+
+# Instrumentation outputs: METRICS_PORT serves Prometheus text at http://127.0.0.1:<port>/metrics
+# for a local scraper, INSTRUMENTATION_LOG=1 writes every timed stage as a JSON line to stderr
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+INSTRUMENTATION_LOG = os.environ.get('INSTRUMENTATION_LOG') == '1'
+
+@st.cache_resource
+def start_instrumentation():
+    if INSTRUMENTATION_LOG:
+        configure_logging()
+    if METRICS_PORT:
+        try:
+            start_metrics_server(METRICS_PORT)
+        except OSError as e:
+            return str(e)
+    return None
+
+start_instrumentation()
+
+# Result store shared by every session (parsed workbooks, aggregates, charts, rendered images and
+# interpretations); its file tier keeps renders, aggregates and interpretations across restarts
+RESULT_STORE_DIR = '.cache/results'
+RESULT_STORE_FILE_MAX_BYTES = 1024 * 1024 * 1024
+
+@st.cache_resource
+def get_result_store():
+    store = shared_store()
+    store.enable_file_tier(RESULT_STORE_DIR, max_bytes=RESULT_STORE_FILE_MAX_BYTES)
+    return store
+
+# Limits for the workbook cache shared by every session
+WORKBOOK_CACHE_MAX_ENTRIES = 8
+WORKBOOK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Process-wide workbook cache, keyed by a hash of the uploaded bytes so every session shares it;
+# visitors uploading the same file at the same time wait for one parse
+@st.cache_resource
+def get_workbook_cache():
+    return get_result_store().namespace(
+        'workbooks',
+        max_entries=WORKBOOK_CACHE_MAX_ENTRIES,
+        max_bytes=WORKBOOK_CACHE_MAX_BYTES,
+        sizeof=lambda workbook: workbook.nbytes,
+    )
+
+# Interpretation cache settings: 'store' uses the shared result store (and its file tier),
+# 'sqlite' a separate database that survives restarts, 'memory' lives in this process only
+INTERPRETATION_CACHE_BACKEND = 'store'
+INTERPRETATION_CACHE_PATH = '.cache/interpretations.sqlite'
+INTERPRETATION_CACHE_MAX_ENTRIES = 2048
+INTERPRETATION_CACHE_TTL = 24 * 60 * 60  # seconds
 
-# Function to load data from all sheets
+# Process-wide cache of Gemini interpretations so reruns with identical chart data skip the API call
+@st.cache_resource
+def get_interpretation_cache():
+    if INTERPRETATION_CACHE_BACKEND == 'store':
+        return get_result_store().namespace(
+            'interpretations',
+            max_entries=INTERPRETATION_CACHE_MAX_ENTRIES,
+            sizeof=lambda text: len(text.encode('utf-8')),
+            ttl=INTERPRETATION_CACHE_TTL,
+            persist=True,
+            version=PROMPT_VERSION,
+        )
+    if INTERPRETATION_CACHE_BACKEND == 'sqlite':
+        return SQLiteTTLCache(
+            INTERPRETATION_CACHE_PATH,
+            max_entries=INTERPRETATION_CACHE_MAX_ENTRIES,
+            ttl=INTERPRETATION_CACHE_TTL,
+        )
+    return MemoryTTLCache(max_entries=INTERPRETATION_CACHE_MAX_ENTRIES, ttl=INTERPRETATION_CACHE_TTL)
+
+set_interpretation_cache(get_interpretation_cache())
+
+# Start the shared chart renderer once per process. When it cannot start (e.g. Chrome is missing)
+# the error is returned here and rendering falls back to one kaleido call per chart, which raises
+# the same error where a chart image is needed (image-mode interpretations)
+@st.cache_resource
+def warm_renderer():
+    try:
+        start_renderer_pool()
+    except Exception as e:
+        return str(e)
+    return None
+
+warm_renderer()
+
+# Columnar (Parquet) cache of prepared sheets so repeat uploads of the same file skip Excel parsing
+SHEET_CACHE_DIR = '.cache/sheets'
+SHEET_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+SHEET_CACHE_EVICTION = 'lru'  # 'lru' or 'fifo'
+
+@st.cache_resource
+def get_sheet_cache():
+    if not ParquetSheetCache.available():
+        return None
+    return ParquetSheetCache(SHEET_CACHE_DIR, max_bytes=SHEET_CACHE_MAX_BYTES, eviction=SHEET_CACHE_EVICTION)
+
+# Process-wide pool that prepares charts and interpretations of options before they are opened
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher()
+
+# Function to prefetch every option of a sheet once per session and data. Selecting another sheet
+# cancels this session's queued prefetches, so the pool works on what the user is looking at.
+def prefetch_options(sheet_name, sheet_data, options):
+    session_id = st.session_state.setdefault('prefetch_session', uuid.uuid4().hex)
+    source = (sheet_name, data_key(sheet_data))
+    if st.session_state.get('prefetch_source') == source:
+        return
+    st.session_state['prefetch_source'] = source
+    prefetcher = get_prefetcher()
+    prefetcher.cancel(session_id)
+    for option in options:
+        prefetcher.submit(session_id, source + (option,), visualize, sheet_name, sheet_data, option, model)
+
+# Function to load a workbook lazily: only sheet names are read here, sheets are decoded on first use.
+# Raises WorkbookTooLargeError for uploads above the configured size limit.
 def load_data(uploaded_file):
     if uploaded_file is not None:
-        data = pd.read_excel(uploaded_file, sheet_name=None)
-        return data
+        check_upload_size(uploaded_file.size)
+        with span('load_data'):
+            file_bytes = uploaded_file.getvalue()
+            key = hash_bytes(file_bytes)
+            return get_workbook_cache().get_or_compute(
+                key, lambda: LazyWorkbook(file_bytes, key=key, sheet_cache=get_sheet_cache())
+            )
     else:
         return None
 
-# Function to get business info options based on selected sheet
-def get_business_options(sheet_name):
-    options = {
-        'Pelanggan': [
-            'Analisis demografi pelanggan',
-            'Distribusi usia dan jenis kelamin pelanggan',
-            'Segmentasi pelanggan berdasarkan preferensi'
-        ],
-        'Produk': [
-            'Kinerja penjualan produk dan stok',
-            'Distribusi penjualan berdasarkan kategori produk',
-            'Analisis harga produk dan trend penjualan'
-        ],
-        'Transaksi Penjualan': [
-            'Jumlah penjualan, pendapatan, dan metode pembayaran',
-            'Tren penjualan',
-            'Analisis status penjualan dan metode pembayaran'
-        ],
-        'Lokasi Penjualan': [
-            'Kinerja penjualan di berbagai lokasi',
-            'Distribusi penjualan berdasarkan kota/provinsi',
-            'Analisis lokasi dengan penjualan tertinggi/rendah'
-        ],
-        'Staf Penjualan': [
-            'Kinerja dan komisi staf penjualan',
-            'Analisis penilaian kinerja staf',
-            'Distribusi staf berdasarkan posisi/jabatan'
-        ],
-        'Inventaris': [
-            'Manajemen stok produk',
-            'Tren stok masuk dan keluar',
-            'Analisis produk dengan stok terbanyak/terkecil'
-        ],
-        'Promosi dan Pemasaran': [
-            'Efektivitas kampanye promosi',
-            'Distribusi penjualan berdasarkan media promosi',
-            'Analisis kode diskon promosi'
-        ],
-        'Feedback dan Pengembalian': [
-            'Masalah dan kepuasan pelanggan',
-            'Distribusi alasan pengembalian produk',
-            'Status pengembalian produk'
-        ],
-        'Analisis Penjualan': [
-            'Penjualan agregat dan tren',
-            'Analisis penjualan berdasarkan produk/kategori',
-            'Tren penjualan/tahunan'
-        ],
-        'Lainnya': [
-            'Analisis tambahan dan faktor eksternal',
-            'Tren penjualan berdasarkan faktor ekonomi',
-            'Distribusi biaya operasional terkait penjualan'
-        ]
-    }
-    return options.get(sheet_name, [])
+# How model output is shown: 'stream' renders chunks as they arrive (st.write_stream),
+# 'batched' redraws the accumulated text at most STREAM_FRAME_RATE times per second
+STREAM_DISPLAY_MODE = 'stream'
+STREAM_FRAME_RATE = 10
+
+# Function to show streamed text in batches at a fixed frame rate (fallback for st.write_stream)
+def display_stream_batched(chunks, frame_rate=STREAM_FRAME_RATE):
+    text = ""
+    box = st.empty()
+    last_flush = 0.0
+    for chunk in chunks:
+        text += chunk
+        now = time.monotonic()
+        if now - last_flush >= 1.0 / frame_rate:
+            box.markdown(text)
+            last_flush = now
+    box.markdown(text)
+    return text
+
+# Function to display a text stream (or a plain string) and return the full text
+def display_stream(chunks):
+    if isinstance(chunks, str):
+        chunks = [chunks] if chunks else []
+    # Includes the time spent waiting for the model, which the generate_content spans break down
+    with span('display_stream', mode=STREAM_DISPLAY_MODE):
+        if STREAM_DISPLAY_MODE == 'stream' and hasattr(st, 'write_stream'):
+            written = st.write_stream(chunks)
+            return written if isinstance(written, str) else "".join(str(part) for part in written)
+        return display_stream_batched(chunks)
+
+# Function to show the uploaded sheet one page at a time, with column selection and a text filter.
+# Only the visible page is sent to the browser; pages already seen are cached in st.session_state.
+def display_data_preview(sheet_data, sheet_name):
+    columns = list(sheet_data.columns)
+    selected_columns = st.multiselect(
+        "Kolom yang ditampilkan", columns, default=columns, key=f"preview_columns_{sheet_name}"
+    )
+    filter_box, query_box = st.columns(2)
+    filter_column = filter_box.selectbox("Filter kolom", [""] + columns, key=f"preview_filter_{sheet_name}")
+    query = query_box.text_input("Berisi teks", key=f"preview_query_{sheet_name}") if filter_column else ""
+
+    cache = st.session_state.setdefault('preview_cache', new_preview_cache())
+    pages = page_count(len(cached_positions(cache, sheet_data, filter_column, query)))
+    # The filter is part of the key so the page number starts over when the filter changes
+    page = st.number_input(
+        f"Halaman (dari {pages})", min_value=1, max_value=pages, value=1, step=1,
+        key=f"preview_page_{sheet_name}_{filter_column}_{query}",
+    )
+    rows, total = preview_page(cache, sheet_data, selected_columns, filter_column, query, page=int(page))
+    st.dataframe(rows)
+    first_row = (int(page) - 1) * PREVIEW_PAGE_SIZE
+    st.caption(f"Baris {min(first_row + 1, total):,}–{first_row + len(rows):,} dari {total:,}")
+
+# Function to display charts one by one
+def display_charts(charts):
+    for chart in charts:
+        figure = chart.get('figure')
+        try:
+            st.plotly_chart(figure)
+        except Exception as e:
+            st.write(f"### Error: Could not display Plotly figure. Error: {e}")
+        if chart.get('reduction'):
+            st.caption(describe_reduction(chart['reduction']))
+
+# Function to display the interpretation as it streams in from Gemini; stops the run on API errors
+def display_interpretation(interpretation):
+    try:
+        return display_stream(interpretation)
+    except InternalServerError as e:
+        st.error("Terjadi kesalahan pada server saat mencoba mendapatkan interpretasi. Silakan coba lagi nanti.")
+        st.stop()
+    except DeadlineExceeded as e:
+        st.error("Server terlalu lama merespons saat mencoba mendapatkan interpretasi. Silakan coba lagi nanti.")
+        st.stop()
+    except ResourceExhausted as e:
+        st.error("Batas penggunaan AI sedang penuh karena banyak pengguna. Silakan coba lagi sebentar lagi.")
+        st.stop()
+
+# Create a container for the chatbot section that appears after interpretation.
+# Each sheet/business option (chat_key) keeps its own chat session in st.session_state, so the
+# chart context is summarized once per session; every question still resends the chat history
+# (context included), which chat.trim_chat_history keeps within a token budget.
+def chatbot(charts, interpretation_text, model, chat_key):
+    if interpretation_text:
+        st.write("### 💬Chatbot AI")
+        st.write("Kamu masih punya pertanyaan terkait hasil visualisasinya? Tanyakan di bawah ya!")
+
+        sessions = st.session_state.setdefault('chat_sessions', {})
+        chat_state = get_chat_state(sessions, chat_key, model, build_chat_context(charts, interpretation_text))
+
+        # Input box for user questions
+        user_question = st.text_input("Ajukan pertanyaan kamu di sini...")
+
+        # Show earlier answers without asking the model again
+        for question, answer in chat_state['turns']:
+            st.write(f"**Kamu:** {question}")
+            st.markdown(answer)
+
+        last_question = chat_state['turns'][-1][0] if chat_state['turns'] else None
+        if user_question and user_question != last_question:
+            try:
+                response = send_question(chat_state, model, user_question)
+
+                # Display the response as it streams in
+                st.write("#### Jawaban Chatbot:")
+                chatbot_response = display_stream(chunk.text for chunk in response)
+                record_answer(chat_state, user_question, chatbot_response)
+            except Exception as e:
+                st.write(f"### Error: {e}")
 
 # Streamlit app
 st.sidebar.header("Unggah Data Penjualan Bisnis Kamu")
-uploaded_file = st.sidebar.file_uploader("Unggah file Excel", type=["xlsx"])
-data = load_data(uploaded_file)
+# Comparison mode takes several workbooks (e.g. one per month) and compares their matching sheets
+compare_mode = st.sidebar.checkbox("Bandingkan beberapa file")
+data = None
+sources = []
+try:
+    if compare_mode:
+        uploaded_files = st.sidebar.file_uploader(
+            f"Unggah 2–{COMPARE_MAX_SOURCES} file Excel", type=["xlsx"], accept_multiple_files=True
+        ) or []
+        if len(uploaded_files) > COMPARE_MAX_SOURCES:
+            st.sidebar.warning(f"Hanya {COMPARE_MAX_SOURCES} file pertama yang dibandingkan.")
+            uploaded_files = uploaded_files[:COMPARE_MAX_SOURCES]
+        labels = source_labels([uploaded.name for uploaded in uploaded_files])
+        sources = [(label, load_data(uploaded)) for label, uploaded in zip(labels, uploaded_files)]
+    else:
+        uploaded_file = st.sidebar.file_uploader("Unggah file Excel", type=["xlsx"])
+        data = load_data(uploaded_file)
+except WorkbookTooLargeError as e:
+    st.sidebar.error(str(e))
+    data = None
+    sources = []
 
 if data is not None:
     st.sidebar.success("Data berhasil diunggah!")
     sheet_names = list(data.keys())
+elif len(sources) >= 2:
+    st.sidebar.success(f"{len(sources)} file siap dibandingkan!")
+    sheet_names = common_sheets([workbook for _, workbook in sources])
+    if not sheet_names:
+        st.sidebar.warning("Tidak ada sheet dengan nama yang sama di semua file.")
+elif compare_mode:
+    st.sidebar.warning("Silakan unggah minimal dua file Excel untuk dibandingkan.")
+    sheet_names = []
 else:
     st.sidebar.warning("Silakan unggah file Excel untuk melanjutkan.")
     sheet_names = []
 
+with st.sidebar.expander("Statistik Cache"):
+    store_stats = get_result_store().stats()
+    st.write(
+        f"Penyimpanan bersama: {store_stats['entries']} entri, {store_stats['bytes'] / (1024 * 1024):.1f} MB "
+        f"dari {store_stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+        f"disk {(store_stats['file_bytes'] or 0) / (1024 * 1024):.1f} MB"
+    )
+    cache_stats = get_workbook_cache().stats()
+    st.write(
+        f"Workbook: {cache_stats['hits']} hit / {cache_stats['misses']} miss, "
+        f"{cache_stats['entries']} file, {cache_stats['bytes'] / (1024 * 1024):.1f} MB"
+    )
+    sheet_cache = get_sheet_cache()
+    if sheet_cache is not None:
+        sheet_cache_stats = sheet_cache.stats()
+        st.write(
+            f"Parquet: {sheet_cache_stats['hits']} hit / {sheet_cache_stats['misses']} miss, "
+            f"{sheet_cache_stats['bytes'] / (1024 * 1024):.1f} MB"
+        )
+    interpretation_stats = get_interpretation_cache().stats()
+    st.write(
+        f"Interpretasi: {interpretation_stats['hits']} hit / {interpretation_stats['misses']} miss, "
+        f"{interpretation_stats['entries']} entri"
+    )
+    aggregate_stats = aggregate_cache_stats()
+    st.write(
+        f"Agregat: {aggregate_stats['hits']} hit / {aggregate_stats['misses']} miss, "
+        f"{aggregate_stats['incremental']['merged']} diperbarui inkremental"
+    )
+    chart_stats = chart_cache_stats()
+    st.write(f"Grafik: {chart_stats['hits']} hit / {chart_stats['misses']} miss")
+    gemini_stats = model.stats()
+    st.write(
+        f"Gemini: {gemini_stats['api_calls']} panggilan untuk {gemini_stats['requests']} permintaan, "
+        f"{gemini_stats['coalesced']} digabung, {gemini_stats['retries']} diulang"
+    )
+    prefetch_stats = get_prefetcher().stats()
+    st.write(
+        f"Prefetch: {prefetch_stats['completed']} selesai, {prefetch_stats['queued']} antre, "
+        f"{prefetch_stats['cancelled']} dibatalkan, {prefetch_stats['dropped']} dilewati"
+    )
+    chart_render_stats = render_stats()
+    cold_ms = chart_render_stats['cold_ms']
+    warm_ms = chart_render_stats['warm_ms']
+    st.write(
+        f"Render grafik: {chart_render_stats['cache']['hits']} hit / {chart_render_stats['cache']['misses']} miss, "
+        f"cold {f'{cold_ms:.0f} ms' if cold_ms is not None else '-'}, "
+        f"warm {f'{warm_ms:.0f} ms' if warm_ms is not None else '-'}"
+    )
+
+# Optional debug panel with the timed stages of this run; filled in at the end of the script
+show_debug = st.sidebar.checkbox("Tampilkan panel debug")
+debug_panel = st.sidebar.empty()
+
+# Function to show where the time of this run went, per stage, plus the tokens and bytes exchanged
+def display_debug_panel(trace):
+    with debug_panel.container():
+        st.write("##### Waktu Proses (run ini)")
+        summary = trace.summary()
+        if not summary:
+            st.write("Belum ada tahap yang diukur pada run ini.")
+            return
+        st.dataframe(pd.DataFrame([
+            {'Tahap': name, 'Jumlah': stats['count'], 'Total (ms)': round(stats['total_ms'], 1),
+             'Maks (ms)': round(stats['max_ms'], 1)}
+            for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_ms'])
+        ]), hide_index=True)
+        counters = trace.counters
+        st.write(
+            f"Token prompt: {counters.get('prompt_tokens', 0):,}, token respons: {counters.get('response_tokens', 0):,}. "
+            f"Dikirim {counters.get('request_bytes', 0) / 1024:.1f} KB, diterima {counters.get('response_bytes', 0) / 1024:.1f} KB."
+        )
+        st.dataframe(pd.DataFrame(trace.spans), hide_index=True)
+
 # Navigation bar to select sheet
 selected_sheet = st.sidebar.selectbox("Pilih Kategori Data", [""] + sheet_names)
 
 if data is not None and selected_sheet:
     if selected_sheet != "":
         st.write(f"### 📶Dashboard Analitik - {selected_sheet}")
-        sheet_data = data[selected_sheet]
+        try:
+            sheet_data = data[selected_sheet]
+        except WorkbookTooLargeError as e:
+            st.error(str(e))
+            st.stop()
+        get_workbook_cache().refresh(data.key)
         st.write("##### Data yang Diunggah")
-        st.dataframe(sheet_data)
+        display_data_preview(sheet_data, selected_sheet)
+        if data.is_streamed(selected_sheet):
+            st.info(
+                f"Sheet ini berisi {data.reports[selected_sheet]['rows']:,} baris, sehingga hanya "
+                f"{len(sheet_data):,} baris pertama yang ditampilkan. Grafik tetap dihitung dari seluruh data."
+            )
+
+        # Show what the one-time ingestion step changed and which expected columns are missing
+        ingest_report = data.reports.get(selected_sheet)
+        if ingest_report:
+            if ingest_report['missing_columns']:
+                st.warning(
+                    "Kolom berikut tidak ditemukan, sehingga sebagian analisis tidak tersedia: "
+                    + ", ".join(ingest_report['missing_columns'])
+                )
+            with st.expander("Laporan Pemrosesan Data"):
+                before_mb = ingest_report['bytes_before'] / (1024 * 1024)
+                after_mb = ingest_report['bytes_after'] / (1024 * 1024)
+                st.write(
+                    f"{ingest_report['rows']} baris. Memori {before_mb:.2f} MB → {after_mb:.2f} MB. "
+                    f"Baca Excel {ingest_report['parse_ms']:.0f} ms, persiapan {ingest_report['prepare_ms']:.0f} ms."
+                )
+                if ingest_report['converted']:
+                    st.write("Tipe kolom: " + ", ".join(f"{col} → {dtype}" for col, dtype in ingest_report['converted'].items()))
+                coerced = {col: n for col, n in ingest_report['coerced'].items() if n}
+                if coerced:
+                    st.write("Nilai tidak valid (dikosongkan): " + ", ".join(f"{col}: {n}" for col, n in coerced.items()))
 
         st.write("##### 👇Pilih Informasi Bisnis yang Kamu Inginkan")
-        business_options = get_business_options(selected_sheet)
+        # Only options whose columns are present in the uploaded sheet are offered
+        business_options = available_options(selected_sheet, sheet_data.columns)
         selected_business_info = st.selectbox("", [""] + business_options)
+        prefetch_options(selected_sheet, sheet_data, business_options)
 
         if selected_business_info and selected_business_info != "":
-            # Function to get visualization and interpretation
-            def get_visualization_and_interpretation(sheet_data, selected_business_info, selected_sheet, model):
-                if selected_sheet == 'Pelanggan':
-                    return visualize_pelanggan(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Produk':
-                    return visualize_produk(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Transaksi Penjualan':
-                    return visualize_transaksi_penjualan(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Lokasi Penjualan':
-                    return visualize_lokasi_penjualan(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Staf Penjualan':
-                    return visualize_staf_penjualan(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Inventaris':
-                    return visualize_inventaris(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Promosi dan Pemasaran':
-                    return visualize_promosi_pemasaran(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Feedback dan Pengembalian':
-                    return visualize_feedback_pengembalian(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Analisis Penjualan':
-                    return visualize_analisis_penjualan(sheet_data, selected_business_info, model)
-                elif selected_sheet == 'Lainnya':
-                    return visualize_lainnya(sheet_data, selected_business_info, model)
-                else:
-                    return [], ""
-
-            # Get visualization and interpretation
+            # Get visualization and interpretation (the interpretation is a stream of text chunks)
             try:
-                charts, interpretation = get_visualization_and_interpretation(sheet_data, selected_business_info, selected_sheet, model)
-            except InternalServerError as e:
-                st.error("Terjadi kesalahan pada server saat mencoba mendapatkan interpretasi. Silakan coba lagi nanti.")
+                charts, interpretation = visualize(selected_sheet, sheet_data, selected_business_info, model, stream=True)
+            except PreviewOnlyError as e:
+                st.error(str(e))
                 st.stop()
 
-            # Function to display charts one by one
-            def display_charts(charts):
-                for chart in charts:
-                    figure = chart.get('figure')
-                    try:
-                        st.plotly_chart(figure)
-                    except Exception as e:
-                        st.write(f"### Error: Could not display Plotly figure. Error: {e}")
-
             # Display charts
             display_charts(charts)
+            append = appended_rows(selected_sheet, sheet_data)
+            if append and append['rows_added']:
+                st.caption(
+                    f"Data ini melanjutkan unggahan sebelumnya: {append['rows_added']:,} baris baru digabungkan "
+                    f"ke agregat {append['rows_reused']:,} baris lama tanpa menghitung ulang."
+                )
 
-            # Function to display interpretation one character at a time
-            def display_interpretation_one_by_one(interpretation):
-                if interpretation:
-                    interpretation_text = ""
-                    interpretation_box = st.empty()
-                    for i in range(len(interpretation)):
-                        interpretation_text += interpretation[i]
-                        interpretation_box.markdown(interpretation_text)
-                        time.sleep(0.005)  # Adjust the speed of typing effect
-                    return interpretation_text
-                return ""
-
-            # Display interpretation
-            interpretation_text = display_interpretation_one_by_one(interpretation)
+            # Display interpretation as it streams in from Gemini
+            interpretation_text = display_interpretation(interpretation)
             st.markdown("---")
 
-            # Create a container for the chatbot section that appears after interpretation
-            def chatbot(charts, interpretation_text, model):
-                if interpretation_text:
-                    st.write("### 💬Chatbot AI")
-                    st.write("Kamu masih punya pertanyaan terkait hasil visualisasinya? Tanyakan di bawah ya!")
-
-                    # Input box for user questions
-                    user_question = st.text_input("Ajukan pertanyaan kamu di sini...")
-
-                    if user_question:
-                        try:
-                            response = model.generate_content(
-                                f"Pertanyaan: {user_question}\n"
-                                f"Chart yang telah divisualkan: {charts}\n"
-                                f"Hasil interpretasi: {interpretation_text}\n"
-                                "Jawab dalam konteks bisnis."
-                            )
-                            chatbot_response = response.text
-
-                            # Display the response as typing effect
-                            st.write("#### Jawaban Chatbot:")
-                            typing_response = ""
-                            typing_box = st.empty()
-                            for i in range(len(chatbot_response)):
-                                typing_response += chatbot_response[i]
-                                typing_box.markdown(typing_response)
-                                time.sleep(0.005)  # Adjust the speed of typing effect
-                        except Exception as e:
-                            st.write(f"### Error: {e}")
-
             # Display chatbot
-            chatbot(charts, interpretation_text, model)
\ No newline at end of file
+            chatbot(charts, interpretation_text, model, (selected_sheet, selected_business_info))
+
+elif len(sources) >= 2 and selected_sheet:
+    # Comparison of one sheet across the uploaded workbooks: the sheets are stacked with their
+    # source as an extra column, aggregated in one pass and interpreted in one Gemini call
+    st.write(f"### 📶Perbandingan - {selected_sheet}")
+    try:
+        sheet_data = combine_sheets(selected_sheet, sources)
+    except WorkbookTooLargeError as e:
+        st.error(str(e))
+        st.stop()
+    for _, workbook in sources:
+        get_workbook_cache().refresh(workbook.key)
+    st.write("##### Data yang Dibandingkan")
+    st.dataframe(describe_sources(selected_sheet, sources), hide_index=True)
+
+    st.write("##### 👇Pilih Informasi Bisnis yang Kamu Inginkan")
+    business_options = available_options(selected_sheet, sheet_data.columns)
+    selected_business_info = st.selectbox("", [""] + business_options)
+
+    if selected_business_info:
+        try:
+            charts, interpretation = visualize(
+                selected_sheet, sheet_data, selected_business_info, model, stream=True, compare_by=SOURCE_COLUMN
+            )
+        except PreviewOnlyError as e:
+            st.error(str(e))
+            st.stop()
+        display_charts(charts)
+        interpretation_text = display_interpretation(interpretation)
+        st.markdown("---")
+        chatbot(charts, interpretation_text, model, ('compare', selected_sheet, selected_business_info, data_key(sheet_data)))
+
+if show_debug:
+    display_debug_panel(trace)
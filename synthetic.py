@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from aggregates import AGGREGATIONS, DERIVED_COLUMNS
+from workbook import expected_columns
+
+# Date range of the synthetic 'Tanggal' column (start date and number of days)
+SYNTHETIC_START_DATE = '2022-01-01'
+SYNTHETIC_DAYS = 3 * 365
+
+# How every column of the synthetic workbooks is generated: ('date',), ('int', low, high) with high
+# exclusive, or a list of values picked uniformly at random
+SYNTHETIC_COLUMNS = {
+    'Tanggal': ('date',),
+    'Jenis Kelamin Pelanggan': ['Laki-laki', 'Perempuan'],
+    'Umur Pelanggan': ('int', 17, 66),
+    'Segmentasi Pelanggan': ['Pelajar', 'Mahasiswa', 'Pekerja', 'Ibu Rumah Tangga', 'Pengusaha'],
+    'Preferensi Pembelian': ['Online', 'Offline', 'Pesan Antar'],
+    'Produk': [f'Produk {i:02d}' for i in range(1, 31)],
+    'Kategori Produk': ['Makanan', 'Minuman', 'Kerajinan', 'Pakaian', 'Kosmetik'],
+    'Harga Produk': [5000, 10000, 15000, 25000, 50000],
+    'Jumlah Terjual': ('int', 1, 50),
+    'Pendapatan': ('int', 10_000, 2_000_000),
+    'Metode Pembayaran': ['Tunai', 'QRIS', 'Transfer Bank', 'E-Wallet', 'Kartu Debit'],
+    'Status Penjualan': ['Selesai', 'Diproses', 'Dibatalkan'],
+    'Lokasi': ['Toko Utama', 'Cabang 1', 'Cabang 2', 'Bazar', 'Marketplace'],
+    'Kota/Provinsi': ['Jakarta', 'Bandung', 'Surabaya', 'Yogyakarta', 'Medan', 'Makassar', 'Denpasar'],
+    'Nama Staf': [f'Staf {i:02d}' for i in range(1, 21)],
+    'Komisi': ('int', 5_000, 500_000),
+    'Penilaian Kinerja': ('int', 1, 6),
+    'Posisi/Jabatan': ['Kasir', 'Sales', 'Admin', 'Gudang', 'Supervisor'],
+    'Stok': ('int', 0, 500),
+    'Stok Masuk': ('int', 0, 100),
+    'Stok Keluar': ('int', 0, 100),
+    'Kampanye Promosi': ['Ramadan Sale', 'Harbolnas', 'Promo Gajian', 'Diskon Akhir Tahun'],
+    'Media Promosi': ['Instagram', 'TikTok', 'WhatsApp', 'Facebook', 'Brosur'],
+    'Kode Diskon': ['HEMAT10', 'HEMAT20', 'GRATISONGKIR', 'BELI2GRATIS1'],
+    'Masalah Pelanggan': ['Pengiriman terlambat', 'Produk rusak', 'Salah kirim', 'Pelayanan lambat'],
+    'Alasan Pengembalian': ['Cacat produksi', 'Ukuran tidak sesuai', 'Tidak sesuai deskripsi', 'Berubah pikiran'],
+    'Status Pengembalian': ['Diajukan', 'Diproses', 'Selesai', 'Ditolak'],
+    'Faktor Eksternal': ['Musim hujan', 'Musim kemarau', 'Hari raya', 'Libur sekolah'],
+    'Faktor Ekonomi': ['Inflasi', 'Normal', 'Resesi'],
+    'Faktor Lingkungan': ['Banjir', 'Normal', 'Polusi tinggi'],
+}
+
+# Function to list the columns of a synthetic sheet: everything its charts need ('Tanggal' first)
+def synthetic_columns(sheet_name):
+    keys, values = expected_columns(sheet_name)
+    columns = keys | values
+    if any(col in DERIVED_COLUMNS for spec in AGGREGATIONS.get(sheet_name, {}).values() for col in spec[0]):
+        columns.add('Tanggal')
+    return sorted(columns, key=lambda col: (col != 'Tanggal', col))
+
+def _generate_column(column, rows, rng):
+    spec = SYNTHETIC_COLUMNS[column]
+    if isinstance(spec, list):
+        return rng.choice(np.array(spec, dtype=object), rows)
+    if spec[0] == 'date':
+        return pd.Timestamp(SYNTHETIC_START_DATE) + pd.to_timedelta(rng.integers(0, SYNTHETIC_DAYS, rows), unit='D')
+    return rng.integers(spec[1], spec[2], rows)
+
+# Function to generate one sheet of random but reproducible UMKM data
+def generate_sheet(sheet_name, rows, seed=0):
+    rng = np.random.default_rng([seed, list(AGGREGATIONS).index(sheet_name)])
+    return pd.DataFrame({col: _generate_column(col, rows, rng) for col in synthetic_columns(sheet_name)})
+
+# Function to write a workbook with rows rows in every sheet. openpyxl's write-only mode keeps memory
+# flat for large sheets; the sheet dimension is declared up front (Excel writes it as well) so
+# readers such as LazyWorkbook can tell the sheet size without scanning it.
+def write_workbook(path, rows, sheets=None, seed=0):
+    book = Workbook(write_only=True)
+    for sheet_name in sheets or list(AGGREGATIONS):
+        df = generate_sheet(sheet_name, rows, seed)
+        ws = book.create_sheet(sheet_name)
+        ref = f"A1:{get_column_letter(len(df.columns))}{rows + 1}"
+        ws.calculate_dimension = lambda ref=ref: ref
+        ws.append(list(df.columns))
+        columns = [
+            df[col].dt.to_pydatetime().tolist() if pd.api.types.is_datetime64_any_dtype(df[col]) else df[col].tolist()
+            for col in df.columns
+        ]
+        del df
+        for row in zip(*columns):
+            ws.append(row)
+    book.save(path)
+    return path
+
+# Function to get the path of a synthetic workbook in directory, generating it only when missing
+def synthetic_workbook(rows, directory, sheets=None, seed=0):
+    suffix = '' if not sheets else '_' + '_'.join(sorted(sheet.replace(' ', '-').replace('/', '-') for sheet in sheets))
+    path = os.path.join(directory, f"umkm_{rows}_{seed}{suffix}.xlsx")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        write_workbook(path + '.tmp', rows, sheets, seed)
+        os.replace(path + '.tmp', path)
+    return path
@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+import aggregates
+from aggregates import appended_rows, compute_partials, finalize_partials, get_aggregates
+from synthetic import generate_sheet
+from workbook import prepare_sheet
+
+SHEET = 'Transaksi Penjualan'
+
+@pytest.fixture(autouse=True)
+def fresh_versions():
+    aggregates._sheet_versions.clear()
+    aggregates._aggregate_cache.clear()
+    yield
+    aggregates._sheet_versions.clear()
+    aggregates._aggregate_cache.clear()
+
+# Function to prepare an upload of a sheet under its own source key
+def upload(df, name):
+    df = prepare_sheet(df.copy(), SHEET)[0]
+    df.attrs['source_key'] = name
+    return df
+
+def sorted_sheet(rows, seed):
+    df = generate_sheet(SHEET, rows, seed=seed).sort_values('Tanggal', kind='stable').reset_index(drop=True)
+    # One row per day, so the rows of an upload never share their last date with later rows
+    df['Tanggal'] = pd.date_range('2024-01-01', periods=rows, freq='D')
+    return df
+
+def assert_same_aggregates(result, df):
+    expected = finalize_partials(SHEET, compute_partials(SHEET, df))
+    for name, table in expected.items():
+        pd.testing.assert_frame_equal(
+            result[name].sort_values(list(table.columns)).reset_index(drop=True),
+            table.sort_values(list(table.columns)).reset_index(drop=True),
+            check_dtype=False, check_exact=False,
+        )
+
+@pytest.mark.parametrize('mode', ['hash', 'watermark'])
+def test_appended_rows_are_merged(monkeypatch, mode):
+    monkeypatch.setattr(aggregates, 'INCREMENTAL_MODE', mode)
+    full = sorted_sheet(300, seed=1)
+    get_aggregates(SHEET, upload(full.iloc[:200], 'lama'))
+    new = upload(full, 'baru')
+    result = get_aggregates(SHEET, new)
+    assert appended_rows(SHEET, new) == {'rows_reused': 200, 'rows_added': 100}
+    assert_same_aggregates(result, new)
+
+@pytest.mark.parametrize('mode', ['hash', 'watermark'])
+def test_another_upload_with_the_same_layout_is_not_merged(monkeypatch, mode):
+    monkeypatch.setattr(aggregates, 'INCREMENTAL_MODE', mode)
+    get_aggregates(SHEET, upload(sorted_sheet(200, seed=1), 'sesi-a'))
+    other = upload(sorted_sheet(300, seed=2), 'sesi-b')
+    result = get_aggregates(SHEET, other)
+    assert appended_rows(SHEET, other) is None
+    assert_same_aggregates(result, other)
@@ -0,0 +1,63 @@
+import os
+from cache import ResultStore
+
+def test_namespace_limits_evict_its_least_recently_used_entry():
+    store = ResultStore(max_bytes=1000)
+    charts = store.namespace('charts', max_entries=2, sizeof=len)
+    other = store.namespace('other', sizeof=len)
+    other.put('o', b'x' * 10)
+    charts.put('a', b'x' * 10)
+    charts.put('b', b'x' * 10)
+    charts.get('a')
+    charts.put('c', b'x' * 10)
+    assert 'a' in charts and 'b' not in charts and 'c' in charts
+    assert 'o' in other
+    assert charts.stats()['entries'] == 2 and charts.stats()['bytes'] == 20
+    assert charts.stats()['evictions'] == 1
+
+def test_namespace_byte_limit_keeps_the_new_entry():
+    store = ResultStore(max_bytes=1000)
+    renders = store.namespace('renders', max_bytes=25, sizeof=len)
+    renders.put('a', b'x' * 10)
+    renders.put('b', b'x' * 10)
+    renders.put('c', b'x' * 30)
+    assert len(renders) == 1 and 'c' in renders
+    assert renders.stats()['bytes'] == 30
+
+def test_shared_budget_evicts_the_oldest_entry_of_any_namespace():
+    store = ResultStore(max_bytes=100)
+    first = store.namespace('first', sizeof=len)
+    second = store.namespace('second', sizeof=len)
+    first.put('x', b'x' * 40)
+    second.put('y', b'x' * 40)
+    first.put('z', b'x' * 40)
+    assert 'x' not in first and 'y' in second and 'z' in first
+    assert store.stats()['bytes'] == 80
+    assert first.stats()['bytes'] == 40 and second.stats()['bytes'] == 40
+
+def test_refresh_and_clear_keep_sizes_in_step():
+    store = ResultStore(max_bytes=1000)
+    lists = store.namespace('lists', sizeof=len)
+    value = [1]
+    lists.put('a', value)
+    value.extend([2, 3])
+    lists.refresh('a')
+    assert lists.stats()['bytes'] == 3 and store.stats()['bytes'] == 3
+    lists.clear()
+    assert len(lists) == 0 and lists.stats()['bytes'] == 0 and store.stats()['bytes'] == 0
+
+def test_file_deleted_during_a_read_is_a_miss(tmp_path, monkeypatch):
+    store = ResultStore()
+    store.enable_file_tier(str(tmp_path))
+    persisted = store.namespace('persisted', persist=True, sizeof=len)
+    persisted.put('k', b'data')
+    persisted.clear()
+
+    # Another thread evicts the file between reading and touching it
+    def evicted(path, *args, **kwargs):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert persisted.get('k') is None
+    assert persisted.stats()['misses'] == 1
@@ -0,0 +1,311 @@
+import threading
+import pytest
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+from gemini_client import CoalescedResponse, GeminiClient, RetryBudget, TokenBucket
+from instrumentation import start_trace
+
+# Clock whose sleep only advances the time, so waits and backoffs cost nothing
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+    def __iter__(self):
+        for word in self.text.split(' '):
+            yield FakeResponse(word)
+
+# Model answering every prompt with its first part; errors (exception instances) are raised by the
+# first calls, and with a gate every call waits until the test opens it
+class FakeModel:
+    def __init__(self, errors=(), gate=None):
+        self.errors = list(errors)
+        self.gate = gate
+        self.calls = []
+        self.started = threading.Event()
+        self.history = []
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.calls.append(contents)
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse(f"jawaban {contents[0]}")
+
+    def start_chat(self, history=None):
+        self.history = list(history or [])
+        return self
+
+    def send_message(self, content, stream=False, **kwargs):
+        return self.generate_content([content], stream=stream)
+
+def make_client(model, clock, **options):
+    options = {'rate_per_minute': 60, 'burst': 10, 'retries': 2, 'backoff': 1.0,
+               'budget_ratio': 0.2, 'budget_capacity': 10, **options}
+    return GeminiClient(model, clock=clock, sleep=clock.sleep, **options)
+
+# Function to wait (in real time) until a client has counted the expected coalesced requests
+def wait_for_coalesced(client, expected):
+    for _ in range(500):
+        if client.stats()['coalesced'] >= expected:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("request was not coalesced")
+
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(0.5)
+
+def test_token_bucket_refills_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 100
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(1.0)
+
+def test_retry_budget_is_spent_and_earned_back():
+    budget = RetryBudget(ratio=0.5, capacity=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert budget.try_spend()
+    for _ in range(10):
+        budget.record_request()
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+
+def test_client_throttles_beyond_burst():
+    clock = FakeClock()
+    client = make_client(FakeModel(), clock, rate_per_minute=60, burst=2)
+    for prompt in ("a", "b", "c"):
+        client.generate_content([prompt])
+    stats = client.stats()
+    assert stats['api_calls'] == 3
+    assert stats['throttled_s'] == pytest.approx(1.0)
+
+def test_client_retries_transient_errors_with_backoff():
+    clock = FakeClock()
+    model = FakeModel(errors=[ServiceUnavailable("sibuk"), ServiceUnavailable("sibuk")])
+    client = make_client(model, clock)
+    assert client.generate_content(["a"]).text == "jawaban a"
+    assert len(model.calls) == 3
+    assert client.stats()['retries'] == 2
+    # Exponential backoff with jitter between 0.5x and 1.5x
+    assert 0.5 <= clock.sleeps[0] < 1.5
+    assert 1.0 <= clock.sleeps[1] < 3.0
+
+def test_client_gives_up_after_max_retries():
+    clock = FakeClock()
+    model = FakeModel(errors=[ServiceUnavailable("sibuk")] * 3)
+    client = make_client(model, clock, retries=2)
+    with pytest.raises(ServiceUnavailable):
+        client.generate_content(["a"])
+    assert len(model.calls) == 3
+
+def test_client_does_not_retry_other_errors():
+    clock = FakeClock()
+    model = FakeModel(errors=[InvalidArgument("salah")])
+    client = make_client(model, clock)
+    with pytest.raises(InvalidArgument):
+        client.generate_content(["a"])
+    assert len(model.calls) == 1
+    assert client.stats()['retries'] == 0
+
+def test_client_stops_retrying_when_budget_is_exhausted():
+    clock = FakeClock()
+    model = FakeModel(errors=[ServiceUnavailable("sibuk")] * 4)
+    client = make_client(model, clock, budget_ratio=0, budget_capacity=1)
+    with pytest.raises(ServiceUnavailable):
+        client.generate_content(["a"])
+    with pytest.raises(ServiceUnavailable):
+        client.generate_content(["b"])
+    stats = client.stats()
+    assert stats['retries'] == 1
+    assert stats['budget_exhausted'] == 2
+    assert len(model.calls) == 3
+
+def test_identical_concurrent_requests_share_one_call():
+    clock = FakeClock()
+    gate = threading.Event()
+    model = FakeModel(gate=gate)
+    client = make_client(model, clock)
+    results = {}
+    leader = threading.Thread(target=lambda: results.update(leader=client.generate_content(["a"])))
+    follower = threading.Thread(target=lambda: results.update(follower=client.generate_content(["a"])))
+    leader.start()
+    assert model.started.wait(5)
+    follower.start()
+    wait_for_coalesced(client, 1)
+    gate.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(model.calls) == 1
+    assert isinstance(results['follower'], CoalescedResponse)
+    assert results['follower'].text == results['leader'].text == "jawaban a"
+    assert client.stats()['requests'] == 2
+
+def test_coalesced_requests_share_the_leaders_error():
+    clock = FakeClock()
+    gate = threading.Event()
+    model = FakeModel(errors=[InvalidArgument("salah")], gate=gate)
+    client = make_client(model, clock)
+    errors = []
+
+    def request():
+        try:
+            client.generate_content(["a"])
+        except InvalidArgument as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=request)
+    follower = threading.Thread(target=request)
+    leader.start()
+    assert model.started.wait(5)
+    follower.start()
+    wait_for_coalesced(client, 1)
+    gate.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+    assert len(model.calls) == 1
+
+def test_different_and_sequential_requests_are_not_coalesced():
+    clock = FakeClock()
+    model = FakeModel()
+    client = make_client(model, clock)
+    client.generate_content(["a"])
+    client.generate_content(["a"])
+    client.generate_content(["b"])
+    assert len(model.calls) == 3
+    assert client.stats()['coalesced'] == 0
+
+def test_stream_yields_chunks_and_followers_get_the_full_text():
+    clock = FakeClock()
+    gate = threading.Event()
+    model = FakeModel(gate=gate)
+    client = make_client(model, clock)
+    results = {}
+    leader = threading.Thread(
+        target=lambda: results.update(leader=[c.text for c in client.generate_content(["a b"], stream=True)])
+    )
+    follower = threading.Thread(
+        target=lambda: results.update(follower=[c.text for c in client.generate_content(["a b"], stream=True)])
+    )
+    leader.start()
+    assert model.started.wait(5)
+    follower.start()
+    wait_for_coalesced(client, 1)
+    gate.set()
+    leader.join(5)
+    follower.join(5)
+    assert results['leader'] == ["jawaban", "a", "b"]
+    assert results['follower'] == ["jawabanab"]
+    assert len(model.calls) == 1
+
+def test_followers_call_again_when_the_leader_closes_its_stream():
+    clock = FakeClock()
+    gate = threading.Event()
+    model = FakeModel(gate=gate)
+    client = make_client(model, clock)
+    results = {}
+
+    def lead():
+        stream = client.generate_content(["a b"], stream=True)
+        results['leader'] = next(stream).text
+        stream.close()
+
+    leader = threading.Thread(target=lead)
+    follower = threading.Thread(
+        target=lambda: results.update(follower=[c.text for c in client.generate_content(["a b"], stream=True)])
+    )
+    leader.start()
+    assert model.started.wait(5)
+    follower.start()
+    wait_for_coalesced(client, 1)
+    gate.set()
+    leader.join(5)
+    follower.join(5)
+    assert results['leader'] == "jawaban"
+    assert results['follower'] == ["jawaban", "a", "b"]
+    assert len(model.calls) == 2
+    assert client.stats()['coalesced'] == 0
+
+def test_stream_retries_only_before_the_first_chunk():
+    clock = FakeClock()
+    model = FakeModel(errors=[ServiceUnavailable("sibuk")])
+    client = make_client(model, clock)
+    assert [c.text for c in client.generate_content(["a"], stream=True)] == ["jawaban", "a"]
+    assert client.stats()['retries'] == 1
+
+    class BrokenStream:
+        def __iter__(self):
+            yield FakeResponse("awal")
+            raise ServiceUnavailable("putus")
+
+    model.generate_content = lambda contents, stream=False, **kwargs: BrokenStream()
+    chunks = []
+    with pytest.raises(ServiceUnavailable):
+        for chunk in client.generate_content(["b"], stream=True):
+            chunks.append(chunk.text)
+    assert chunks == ["awal"]
+    assert client.stats()['retries'] == 1
+
+def test_usage_is_estimated_without_usage_metadata():
+    clock = FakeClock()
+    client = make_client(FakeModel(), clock)
+    trace = start_trace()
+    client.generate_content(["x" * 40])
+    assert trace.counters['request_bytes'] == 40
+    assert trace.counters['prompt_tokens'] == 10
+    assert trace.counters['response_bytes'] == len("jawaban " + "x" * 40)
+
+def test_image_parts_are_hashed_and_counted_as_sent():
+    clock = FakeClock()
+    model = FakeModel()
+    client = make_client(model, clock)
+    png = b"\x89PNG gambar"
+    trace = start_trace()
+    client.generate_content(["a", {'mime_type': 'image/png', 'data': png}])
+    client.generate_content(["a", {'mime_type': 'image/png', 'data': png + b"lain"}])
+    assert len(model.calls) == 2
+    assert model.calls[0][1]['data'] is png
+    assert trace.counters['request_bytes'] == 2 * (1 + len(png)) + len(b"lain")
+
+def test_chat_is_retried_and_counts_its_history():
+    clock = FakeClock()
+    model = FakeModel(errors=[ServiceUnavailable("sibuk")])
+    chat = make_client(model, clock).start_chat(history=[{'role': 'user', 'parts': ["k" * 40]}])
+    trace = start_trace()
+    assert chat.send_message("tanya").text == "jawaban tanya"
+    assert len(model.calls) == 2
+    assert trace.counters['request_bytes'] == 40 + len("tanya")
+
+def test_streamed_chat_records_usage_once_read():
+    clock = FakeClock()
+    model = FakeModel()
+    chat = make_client(model, clock).start_chat()
+    trace = start_trace()
+    response = chat.send_message("tanya lagi", stream=True)
+    assert 'response_bytes' not in trace.counters
+    assert [chunk.text for chunk in response] == ["jawaban", "tanya", "lagi"]
+    assert trace.counters['response_bytes'] == len("jawabantanyalagi")
@@ -0,0 +1,51 @@
+import threading
+from prefetch import Prefetcher
+
+# Function to queue a task that blocks its worker until gate is opened
+def block_worker(prefetcher, gate):
+    started = threading.Event()
+
+    def wait():
+        started.set()
+        gate.wait(5)
+
+    prefetcher.submit('blocker', 'blocker', wait)
+    assert started.wait(5)
+
+def test_cancelled_tasks_are_skipped_and_sessions_forgotten():
+    prefetcher = Prefetcher(workers=1)
+    gate = threading.Event()
+    block_worker(prefetcher, gate)
+    ran = []
+    prefetcher.submit('sesi-a', 'opsi-1', ran.append, 'opsi-1')
+    prefetcher.submit('sesi-a', 'opsi-2', ran.append, 'opsi-2')
+    prefetcher.cancel('sesi-a')
+    gate.set()
+    prefetcher._queue.join()
+    assert ran == []
+    assert prefetcher.stats()['cancelled'] == 2
+    assert prefetcher._generations == {}
+
+def test_a_shared_task_runs_while_one_session_still_wants_it():
+    prefetcher = Prefetcher(workers=1)
+    gate = threading.Event()
+    block_worker(prefetcher, gate)
+    ran = []
+    assert prefetcher.submit('sesi-a', 'opsi', ran.append, 'opsi')
+    assert not prefetcher.submit('sesi-b', 'opsi', ran.append, 'opsi')
+    prefetcher.cancel('sesi-a')
+    gate.set()
+    prefetcher._queue.join()
+    assert ran == ['opsi']
+    assert prefetcher._generations == {}
+
+def test_cancel_without_pending_tasks_keeps_nothing():
+    prefetcher = Prefetcher(workers=1)
+    for index in range(100):
+        prefetcher.cancel(f"sesi-{index}")
+    assert prefetcher._generations == {}
+    ran = []
+    prefetcher.submit('sesi-0', 'opsi', ran.append, 'opsi')
+    prefetcher._queue.join()
+    assert ran == ['opsi']
+    assert prefetcher._generations == {}
@@ -0,0 +1,108 @@
+import re
+import threading
+import time
+import pandas as pd
+import plotly.express as px
+import pytest
+from google.api_core.exceptions import InternalServerError
+from gemini_client import GeminiClient
+from vis_interpret import interpret_chart, set_interpretation_cache
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+    def __iter__(self):
+        for word in self.text.split(' '):
+            yield FakeResponse(word + ' ')
+
+# Model that answers with the chart type of the prompt after a per-chart latency, recording how many
+# calls run at the same time; errors (exception instances) are raised by the first calls
+class LatencyModel:
+    def __init__(self, latencies, errors=()):
+        self.latencies = latencies
+        self.errors = list(errors)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        chart_type = re.search(r"Tipe Visualisasi: ([^(]+) \(", contents[0]).group(1)
+        with self._lock:
+            self.requests.append((chart_type, kwargs))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            error = self.errors.pop(0) if self.errors else None
+        try:
+            time.sleep(self.latencies.get(chart_type, 0))
+            if error is not None:
+                raise error
+            return FakeResponse(f"Interpretasi {chart_type}")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+def make_charts(count):
+    data = pd.DataFrame({'Bulan': ['Jan', 'Feb'], 'Penjualan': [10, 20]})
+    figure = px.bar(data, x='Bulan', y='Penjualan')
+    return [{'type': f"Grafik {index}", 'figure': figure, 'data': data} for index in range(count)]
+
+@pytest.fixture(autouse=True)
+def no_interpretation_cache():
+    set_interpretation_cache(None)
+    yield
+    set_interpretation_cache(None)
+
+def test_results_keep_chart_order():
+    model = LatencyModel({'Grafik 0': 0.3, 'Grafik 1': 0.2, 'Grafik 2': 0.1, 'Grafik 3': 0.0})
+    text = interpret_chart("Penjualan", make_charts(4), model, max_workers=4, mode='data')
+    assert text.split("\n\n") == [f"Interpretasi Grafik {index}" for index in range(4)]
+
+def test_charts_are_interpreted_concurrently_within_the_limit():
+    model = LatencyModel({f"Grafik {index}": 0.2 for index in range(4)})
+    start = time.perf_counter()
+    interpret_chart("Penjualan", make_charts(4), model, max_workers=2, mode='data')
+    elapsed = time.perf_counter() - start
+    assert model.max_active == 2
+    assert 0.4 <= elapsed < 0.8
+
+def test_single_worker_interprets_sequentially():
+    model = LatencyModel({})
+    interpret_chart("Penjualan", make_charts(3), model, max_workers=1, mode='data')
+    assert model.max_active == 1
+    assert [chart_type for chart_type, _ in model.requests] == ["Grafik 0", "Grafik 1", "Grafik 2"]
+
+def test_timeout_is_sent_with_every_request():
+    model = LatencyModel({})
+    interpret_chart("Penjualan", make_charts(2), model, timeout=7, mode='data')
+    assert [kwargs['request_options'] for _, kwargs in model.requests] == [{'timeout': 7}] * 2
+
+def test_server_errors_are_retried_through_the_client():
+    model = LatencyModel({}, errors=[InternalServerError("gagal")])
+    client = GeminiClient(model, sleep=lambda seconds: None)
+    text = interpret_chart("Penjualan", make_charts(3), client, mode='data')
+    assert text.split("\n\n") == [f"Interpretasi Grafik {index}" for index in range(3)]
+    assert client.stats()['retries'] == 1
+
+def test_stream_matches_the_full_text():
+    model = LatencyModel({'Grafik 1': 0.1})
+    chunks = list(interpret_chart("Penjualan", make_charts(3), model, mode='data', stream=True))
+    assert len(chunks) > 3
+    assert [part.strip() for part in "".join(chunks).split("\n\n")] == \
+        [f"Interpretasi Grafik {index}" for index in range(3)]
+
+def test_closing_a_stream_does_not_wait_for_the_remaining_charts():
+    model = LatencyModel({f"Grafik {index}": 1.0 for index in range(1, 4)})
+    stream = interpret_chart("Penjualan", make_charts(4), model, max_workers=2, mode='data', stream=True)
+    assert next(stream) == "Interpretasi "
+    start = time.perf_counter()
+    stream.close()
+    assert time.perf_counter() - start < 0.5
+    time.sleep(1.2)
+    # Only the chart already running was sent; the queued ones were cancelled
+    assert len(model.requests) == 2
+
+def test_no_model_skips_interpretation():
+    assert interpret_chart("Penjualan", make_charts(2), None) == ""
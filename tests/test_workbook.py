@@ -0,0 +1,49 @@
+import re
+import zipfile
+from io import BytesIO
+import pytest
+from openpyxl import Workbook
+import workbook
+from workbook import LazyWorkbook, WorkbookTooLargeError
+
+# Function to write a one-sheet workbook of rows rows whose dimension record is replaced by dimension
+# (e.g. a stale range, or '' to leave it out, as some writers do)
+def workbook_bytes(rows, dimension=None):
+    book = Workbook()
+    sheet = book.active
+    sheet.title = 'Produk'
+    sheet.append(['Nama Produk', 'Harga'])
+    for index in range(rows):
+        sheet.append([f"Produk {index}", index])
+    buffer = BytesIO()
+    book.save(buffer)
+    if dimension is None:
+        return buffer.getvalue()
+    source = zipfile.ZipFile(BytesIO(buffer.getvalue()))
+    output = BytesIO()
+    with zipfile.ZipFile(output, 'w') as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == 'xl/worksheets/sheet1.xml':
+                data = re.sub(rb'<dimension[^>]*>', dimension.encode('ascii'), data)
+            target.writestr(item, data)
+    return output.getvalue()
+
+def test_row_limit_applies_when_the_dimension_is_stale(monkeypatch):
+    monkeypatch.setattr(workbook, 'MAX_SHEET_ROWS', 5)
+    data = LazyWorkbook(workbook_bytes(10, '<dimension ref="A1:B3"/>'))
+    assert not data._needs_streaming('Produk')
+    with pytest.raises(WorkbookTooLargeError):
+        data['Produk']
+
+def test_row_limit_applies_when_the_dimension_is_missing(monkeypatch):
+    monkeypatch.setattr(workbook, 'MAX_SHEET_ROWS', 5)
+    data = LazyWorkbook(workbook_bytes(10, ''))
+    assert data._needs_streaming('Produk')
+    with pytest.raises(WorkbookTooLargeError):
+        data['Produk']
+
+def test_sheets_within_the_limit_are_parsed_whole():
+    data = LazyWorkbook(workbook_bytes(10, '<dimension ref="A1:B3"/>'))
+    assert len(data['Produk']) == 10
+    assert not data.is_streamed('Produk')
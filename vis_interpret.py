@@ -1,20 +1,262 @@
-from io import BytesIO
-from PIL import Image
 import plotly.express as px
 import pandas as pd
-import random
-
-# Function to save Plotly figure as an image and load it using PIL
-def fig_to_pil_image(fig):
-    buf = BytesIO()
-    fig.write_image(buf, format='png')
-    buf.seek(0)
-    image = Image.open(buf)
-    return image
-
-# Function to interpret chart data using Gemini
-def interpret_chart(sheet_name, charts, model):
-    general_prompt = (
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cache import hash_bytes, shared_store
+from charts import CHART_REGISTRY, build_charts
+from instrumentation import bind_context, span
+
+# Concurrency and per-chart timeout (seconds) for Gemini calls in interpret_chart.
+# Rate limiting and retries are handled by the shared client (see gemini_client.GeminiClient).
+INTERPRET_CONCURRENCY = 4
+INTERPRET_TIMEOUT = 60
+
+# What each chart type sends to Gemini: 'image' is the rendered PNG (needs kaleido),
+# 'data' is the aggregated table as compact text, which skips rasterization entirely
+DEFAULT_INTERPRET_MODE = 'image'
+INTERPRET_MODES = {
+    'Analisis harga produk dan trend penjualan': 'data',
+    'Tren penjualan': 'data',
+    'Tren stok masuk dan keluar': 'data',
+    'Penjualan agregat dan tren': 'data',
+    'Tren penjualan/tahunan': 'data',
+    'Tren penjualan berdasarkan faktor ekonomi': 'data',
+}
+DATA_PROMPT_FORMAT = 'csv'  # 'csv' or 'json'
+DATA_PROMPT_MAX_ROWS = 200  # longer tables are downsampled to this many evenly spaced rows
+
+# Rendered PNG cache (encoded bytes, keyed by figure JSON) and renderer pool size
+RENDER_CACHE_MAX_ENTRIES = 1024
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RENDER_POOL_SIZE = 2
+RENDER_WARMUP_TIMEOUT = 30  # seconds the warm-up render may take before the shared renderer is given up
+
+# Size of the chart digest sent as chatbot context (see summarize_charts)
+CHAT_CONTEXT_TOP_N = 10
+CHAT_CONTEXT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4  # rough average for Gemini tokenization
+
+# Bump whenever the interpretation prompt changes so cached answers are not reused
+PROMPT_VERSION = 2
+
+# Optional shared cache for chart interpretations (see set_interpretation_cache)
+_interpretation_cache = None
+
+# Function to plug in a cache (e.g. MemoryTTLCache or SQLiteTTLCache) used by interpret_chart
+def set_interpretation_cache(cache):
+    global _interpretation_cache
+    _interpretation_cache = cache
+
+# Function to pick the interpretation mode ('image' or 'data') for a chart
+def interpret_mode_for(chart, mode=None):
+    if mode is None:
+        mode = INTERPRET_MODES.get(chart['type'], DEFAULT_INTERPRET_MODE)
+    if mode == 'data' and chart.get('data') is None:
+        return 'image'
+    return mode
+
+# Function to identify the backend and model that answers through model (a GeminiClient passes
+# model_id through to its backend), so answers of different models are never cached for each other
+def model_identity(model):
+    return getattr(model, 'model_id', None) or type(model).__name__
+
+# Function to build the cache key of one chart: sheet, business option, aggregated data, mode,
+# prompt version and the answering model (see model_identity)
+def interpretation_key(sheet_name, chart, mode='image', model_id=''):
+    data = chart.get('data')
+    data_hash = hash_bytes(data.to_csv(index=False).encode('utf-8')) if data is not None else ''
+    return hash_bytes(
+        f"{sheet_name}\x1f{chart['type']}\x1f{data_hash}\x1f{mode}\x1f{PROMPT_VERSION}\x1f{model_id}".encode('utf-8')
+    )
+
+# Function to serialize an aggregated chart table as compact CSV/JSON text for the prompt.
+# Tables longer than max_rows are downsampled to evenly spaced rows (first and last row kept).
+def chart_data_to_text(data, fmt=None, max_rows=None):
+    fmt = DATA_PROMPT_FORMAT if fmt is None else fmt
+    max_rows = DATA_PROMPT_MAX_ROWS if max_rows is None else max_rows
+    note = ""
+    if max_rows and len(data) > max_rows:
+        positions = np.unique(np.linspace(0, len(data) - 1, max_rows).round().astype(int))
+        note = f", diringkas dari {len(data)} menjadi {len(positions)} baris"
+        data = data.iloc[positions]
+    if fmt == 'json':
+        text = data.to_json(orient='split', index=False, date_format='iso', double_precision=2)
+    else:
+        text = data.to_csv(index=False, float_format='%.2f', date_format='%Y-%m-%d')
+    return text, note
+
+_render_cache = shared_store().namespace(
+    'renders', max_entries=RENDER_CACHE_MAX_ENTRIES, max_bytes=RENDER_CACHE_MAX_BYTES, sizeof=len, persist=True
+)
+_render_slots = threading.BoundedSemaphore(RENDER_POOL_SIZE)
+_render_stats_lock = threading.Lock()
+_render_stats = {'cold_ms': None, 'warm_ms_total': 0.0, 'warm_count': 0}
+_renderer_started = False
+
+# Function to tell whether kaleido can find a Chrome/Chromium to render with (including one
+# downloaded with plotly_get_chrome); kaleido versions without choreographer bring their own
+def _chrome_available():
+    try:
+        from choreographer.browsers.chromium import Chromium
+    except ImportError:
+        return True
+    return Chromium.find_browser(skip_local=False) is not None
+
+# Function to render a tiny figure once, giving up after timeout seconds. A kaleido sync server
+# that cannot reach its browser blocks forever, so the render runs in a daemon thread and does
+# not take a render slot; a render stuck there is left behind.
+def _warm_up_render(timeout):
+    result = {}
+
+    def run():
+        try:
+            result['png'] = px.bar(x=[0], y=[0]).to_image(format='png')
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run, name='renderer-warmup', daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"Chart renderer did not answer within {timeout} seconds")
+    if 'error' in result:
+        raise result['error']
+    with _render_stats_lock:
+        if _render_stats['cold_ms'] is None:
+            _render_stats['cold_ms'] = (time.perf_counter() - start) * 1000
+
+# Function to start a warm, shared kaleido renderer so sessions don't each pay its startup cost.
+# kaleido >= 1.0 keeps a pool of RENDER_POOL_SIZE browser tabs; older kaleido keeps one process alive.
+# The pool is only started when Chrome can be found, and it is stopped again when the warm-up render
+# fails or times out; renders then go through kaleido one call at a time, so its error (e.g. Chrome
+# missing) is raised here and again by every render instead of hanging.
+def start_renderer_pool(size=None, timeout=None):
+    global _renderer_started
+    if _renderer_started:
+        return
+    size = RENDER_POOL_SIZE if size is None else size
+    timeout = RENDER_WARMUP_TIMEOUT if timeout is None else timeout
+    kaleido = None
+    try:
+        import kaleido
+        if hasattr(kaleido, 'start_sync_server') and _chrome_available():
+            kaleido.start_sync_server(n=size, silence_warnings=True)
+        else:
+            kaleido = None
+    except ImportError:
+        pass
+    _renderer_started = True
+    # Render a tiny figure once so the first real chart hits a warm renderer
+    try:
+        _warm_up_render(timeout)
+    except Exception:
+        if kaleido is not None:
+            kaleido.stop_sync_server(silence_warnings=True)
+        raise
+
+# Function to render a figure to PNG bytes, recording cold (first) and warm render latency
+def _render_png(fig):
+    with _render_slots, span('render'):
+        start = time.perf_counter()
+        png = fig.to_image(format='png')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    with _render_stats_lock:
+        if _render_stats['cold_ms'] is None:
+            _render_stats['cold_ms'] = elapsed_ms
+        else:
+            _render_stats['warm_ms_total'] += elapsed_ms
+            _render_stats['warm_count'] += 1
+    return png
+
+# Function to get the PNG bytes of a figure, reusing earlier renders of an identical figure
+def fig_to_png_bytes(fig):
+    key = hash_bytes(fig.to_json().encode('utf-8'))
+    return _render_cache.get_or_compute(key, lambda: _render_png(fig))
+
+# Function to report render latency and render cache usage
+def render_stats():
+    with _render_stats_lock:
+        warm_count = _render_stats['warm_count']
+        stats = {
+            'cold_ms': _render_stats['cold_ms'],
+            'warm_ms': _render_stats['warm_ms_total'] / warm_count if warm_count else None,
+            'renders': warm_count + (1 if _render_stats['cold_ms'] is not None else 0),
+        }
+    stats['cache'] = _render_cache.stats()
+    return stats
+
+# Function to format a number compactly for prompts (integers without decimals)
+def _format_number(value):
+    if pd.isna(value):
+        return "-"
+    if float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:,.2f}"
+
+# Function to list the chart kinds of a figure (px.line traces are reported as 'line', not 'scatter')
+def chart_kinds(fig):
+    return sorted({
+        'line' if trace.type == 'scatter' and 'lines' in (trace.mode or '') else trace.type
+        for trace in fig.data
+    })
+
+# Function to turn one chart dict into a small text digest: type, axes, totals and top-N values
+def summarize_chart(chart, top_n=None):
+    top_n = CHAT_CONTEXT_TOP_N if top_n is None else top_n
+    fig = chart['figure']
+    kinds = ", ".join(chart_kinds(fig)) or "-"
+    x_title = fig.layout.xaxis.title.text
+    y_title = fig.layout.yaxis.title.text
+    lines = [f"- {chart['type']} (grafik {kinds}" + (f"; sumbu x: {x_title}, sumbu y: {y_title}" if x_title or y_title else "") + ")"]
+
+    data = chart.get('data')
+    if data is None or data.empty:
+        return "\n".join(lines)
+    lines.append(f"  {len(data)} baris, kolom: {', '.join(map(str, data.columns))}")
+    for col in data.columns:
+        if pd.api.types.is_datetime64_any_dtype(data[col]):
+            lines.append(f"  Rentang {col}: {data[col].min():%Y-%m-%d} s/d {data[col].max():%Y-%m-%d}")
+    numeric_cols = list(data.select_dtypes('number').columns)
+    if numeric_cols:
+        value_col = numeric_cols[-1]
+        values = data[value_col]
+        lines.append(
+            f"  {value_col}: total {_format_number(values.sum())}, rata-rata {_format_number(values.mean())}, "
+            f"min {_format_number(values.min())}, maks {_format_number(values.max())}"
+        )
+        top_rows = data.nlargest(top_n, value_col)
+        label_cols = [col for col in data.columns if col != value_col]
+        lines.append(f"  Top {len(top_rows)} menurut {value_col}:")
+        for _, row in top_rows.iterrows():
+            label = " / ".join(
+                f"{row[col]:%Y-%m-%d}" if isinstance(row[col], pd.Timestamp) else str(row[col])
+                for col in label_cols
+            )
+            lines.append(f"    {label}: {_format_number(row[value_col])}")
+    return "\n".join(lines)
+
+# Function to build the chatbot's chart context, truncated to a token budget
+def summarize_charts(charts, token_budget=None):
+    token_budget = CHAT_CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    summary = "\n".join(summarize_chart(chart) for chart in charts)
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit("\n", 1)[0] + "\n  ... (ringkasan dipotong)"
+    return summary
+
+# Function to build the image part of a request from a figure's cached PNG bytes; the SDK sends
+# the bytes as they are, so the PNG is neither decoded nor encoded again
+def fig_to_image_part(fig):
+    with span('fig_to_image_part'):
+        return {'mime_type': 'image/png', 'data': fig_to_png_bytes(fig)}
+
+# Function to build the shared part of the interpretation prompt for a sheet
+def build_general_prompt(sheet_name):
+    return (
         f"""
         Kamu adalah seorang data analyst dan business intelligence handal dan profesional. Tugas Kamu adalah menginterpretasikan data 
         penjualan UMKM dari sheet {sheet_name}. Gunakan bahasa yang lumayan santai, mudah dipahami, beginner hingga expert friendly, dan tetap bercirikhas bisnis.
@@ -26,454 +268,185 @@ def interpret_chart(sheet_name, charts, model):
         Berikut adalah visualisasi yang tersedia:
         """
     )
-    
-    chart_prompts = []
-    for chart in charts:
-        chart_image = fig_to_pil_image(chart['figure'])
-        chart_prompt = f"Tipe Visualisasi: {chart['type']}. Interpretasikan data berikut:"
-        combined_prompt = f"{general_prompt}\n{chart_prompt}"
-        response = model.generate_content([combined_prompt, chart_image])
-        chart_description = response.text.strip()
-        chart_prompts.append(chart_description)
-    
-    return "\n\n".join(chart_prompts)
-
-def convert_to_date(df, columns):
-    for col in columns:
-        if (col in df.columns) and (df[col].dtype != 'datetime64[ns]'):
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    return df
-
-def visualize_pelanggan(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Analisis demografi pelanggan':
-        if 'Jenis Kelamin Pelanggan' in df.columns:
-            gender_counts = df['Jenis Kelamin Pelanggan'].value_counts().reset_index()
-            gender_counts.columns = ['Jenis Kelamin Pelanggan', 'Jumlah']
-            charts.append({
-                'type': 'Analisis demografi pelanggan',
-                'figure': px.bar(data_frame=gender_counts, 
-                                 x='Jenis Kelamin Pelanggan', 
-                                 y='Jumlah', 
-                                 labels={'Jenis Kelamin Pelanggan': 'Jenis Kelamin Pelanggan', 'Jumlah': 'Jumlah'})
-            })
-        if 'Umur Pelanggan' in df.columns:
-            age_counts = df['Umur Pelanggan'].value_counts().reset_index()
-            age_counts.columns = ['Umur Pelanggan', 'Jumlah']
-            charts.append({
-                'type': 'Analisis demografi pelanggan',
-                'figure': px.bar(data_frame=age_counts, 
-                                 x='Umur Pelanggan', 
-                                 y='Jumlah', 
-                                 labels={'Umur Pelanggan': 'Umur Pelanggan', 'Jumlah': 'Jumlah'})
-            })
-        if 'Segmentasi Pelanggan' in df.columns:
-            segmentation_counts = df['Segmentasi Pelanggan'].value_counts().reset_index()
-            segmentation_counts.columns = ['Segmentasi Pelanggan', 'Jumlah']
-            charts.append({
-                'type': 'Analisis demografi pelanggan',
-                'figure': px.pie(data_frame=segmentation_counts, 
-                                 names='Segmentasi Pelanggan', 
-                                 values='Jumlah')
-            })
-
-    elif selected_business_info == 'Distribusi usia dan jenis kelamin pelanggan':
-        if 'Umur Pelanggan' in df.columns and 'Jenis Kelamin Pelanggan' in df.columns:
-            age_gender_counts = df.groupby(['Umur Pelanggan', 'Jenis Kelamin Pelanggan']).size().reset_index(name='Jumlah')
-            charts.append({
-                'type': 'Distribusi usia dan jenis kelamin pelanggan',
-                'figure': px.histogram(data_frame=age_gender_counts, 
-                                       x='Umur Pelanggan', 
-                                       y='Jumlah', 
-                                       color='Jenis Kelamin Pelanggan', 
-                                       barmode='group')
-            })
-
-    elif selected_business_info == 'Segmentasi pelanggan berdasarkan preferensi':
-        if 'Preferensi Pembelian' in df.columns and 'Segmentasi Pelanggan' in df.columns:
-            pref_segment_counts = df.groupby(['Preferensi Pembelian', 'Segmentasi Pelanggan']).size().reset_index(name='Jumlah')
-            charts.append({
-                'type': 'Segmentasi pelanggan berdasarkan preferensi',
-                'figure': px.sunburst(data_frame=pref_segment_counts, 
-                                      path=['Preferensi Pembelian', 'Segmentasi Pelanggan'], 
-                                      values='Jumlah')
-            })
-
-    interpretation = interpret_chart('Pelanggan', charts, model)
-    return charts, interpretation
-
-def visualize_produk(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Kinerja penjualan produk dan stok':
-        if 'Produk' in df.columns and 'Jumlah Terjual' in df.columns:
-            product_sales = df.groupby('Produk')['Jumlah Terjual'].sum().reset_index()
-            charts.append({
-                'type': 'Kinerja penjualan produk dan stok',
-                'figure': px.bar(data_frame=product_sales, 
-                                 x='Produk', 
-                                 y='Jumlah Terjual', 
-                                 labels={'Produk': 'Produk', 'Jumlah Terjual': 'Jumlah Terjual'})
-            })
-    elif selected_business_info == 'Distribusi penjualan berdasarkan kategori produk':
-        if 'Kategori Produk' in df.columns and 'Jumlah Terjual' in df.columns:
-            category_sales = df.groupby('Kategori Produk')['Jumlah Terjual'].sum().reset_index()
-            charts.append({
-                'type': 'Distribusi penjualan berdasarkan kategori produk',
-                'figure': px.pie(data_frame=category_sales, 
-                                 names='Kategori Produk', 
-                                 values='Jumlah Terjual')
-            })
-
-    elif selected_business_info == 'Analisis harga produk dan trend penjualan':
-        if 'Tanggal' in df.columns and 'Harga Produk' in df.columns and 'Jumlah Terjual' in df.columns:
-            price_trends = df.groupby(['Tanggal', 'Harga Produk'])['Jumlah Terjual'].sum().reset_index()
-            charts.append({
-                'type': 'Analisis harga produk dan trend penjualan',
-                'figure': px.line(data_frame=price_trends, 
-                                  x='Tanggal', 
-                                  y='Jumlah Terjual', 
-                                  color='Harga Produk', 
-                                  labels={'Tanggal': 'Tanggal', 'Jumlah Terjual': 'Jumlah Terjual', 'Harga Produk': 'Harga Produk'})
-            })
-
-    interpretation = interpret_chart('Produk', charts, model)
-    return charts, interpretation
 
-def visualize_transaksi_penjualan(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Jumlah penjualan, pendapatan, dan metode pembayaran':
-        if 'Metode Pembayaran' in df.columns and 'Pendapatan' in df.columns:
-            payment_sales = df.groupby('Metode Pembayaran')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Jumlah penjualan, pendapatan, dan metode pembayaran',
-                'figure': px.bar(data_frame=payment_sales, 
-                                 x='Metode Pembayaran', 
-                                 y='Pendapatan', 
-                                 labels={'Metode Pembayaran': 'Metode Pembayaran', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Tren penjualan':
-        if 'Tanggal' in df.columns and 'Pendapatan' in df.columns:
-            daily_trends = df.groupby('Tanggal')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Tren penjualan',
-                'figure': px.line(data_frame=daily_trends, 
-                                  x='Tanggal', 
-                                  y='Pendapatan', 
-                                  labels={'Tanggal': 'Tanggal', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Analisis status penjualan dan metode pembayaran':
-        if 'Status Penjualan' in df.columns and 'Metode Pembayaran' in df.columns:
-            status_payment_sales = df.groupby(['Status Penjualan', 'Metode Pembayaran']).size().reset_index(name='Jumlah')
-            charts.append({
-                'type': 'Analisis status penjualan dan metode pembayaran',
-                'figure': px.bar(data_frame=status_payment_sales, 
-                                 x='Status Penjualan', 
-                                 y='Jumlah', 
-                                 color='Metode Pembayaran', 
-                                 barmode='group')
-            })
-
-    interpretation = interpret_chart('Transaksi Penjualan', charts, model)
-    return charts, interpretation
-
-def visualize_lokasi_penjualan(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Kinerja penjualan di berbagai lokasi':
-        if 'Lokasi' in df.columns and 'Pendapatan' in df.columns:
-            location_sales = df.groupby('Lokasi')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Kinerja penjualan di berbagai lokasi',
-                'figure': px.bar(data_frame=location_sales, 
-                                 x='Lokasi', 
-                                 y='Pendapatan', 
-                                 labels={'Lokasi': 'Lokasi', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Distribusi penjualan berdasarkan kota/provinsi':
-        if 'Kota/Provinsi' in df.columns and 'Pendapatan' in df.columns:
-            city_province_sales = df.groupby('Kota/Provinsi')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Distribusi penjualan berdasarkan kota/provinsi',
-                'figure': px.pie(data_frame=city_province_sales, 
-                                 names='Kota/Provinsi', 
-                                 values='Pendapatan')
-            })
-
-    elif selected_business_info == 'Analisis lokasi dengan penjualan tertinggi/rendah':
-        if 'Lokasi' in df.columns and 'Pendapatan' in df.columns:
-            location_sales = df.groupby('Lokasi')['Pendapatan'].sum().reset_index()
-            top_location_sales = location_sales.sort_values('Pendapatan', ascending=False).head(10)
-            charts.append({
-                'type': 'Analisis lokasi dengan penjualan tertinggi/rendah',
-                'figure': px.bar(data_frame=top_location_sales, 
-                                 x='Lokasi', 
-                                 y='Pendapatan', 
-                                 labels={'Lokasi': 'Lokasi', 'Pendapatan': 'Pendapatan'})
-            })
-
-    interpretation = interpret_chart('Lokasi Penjualan', charts, model)
-    return charts, interpretation
-
-def visualize_staf_penjualan(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Kinerja dan komisi staf penjualan':
-        if 'Nama Staf' in df.columns and 'Komisi' in df.columns:
-            staff_commission = df.groupby('Nama Staf')['Komisi'].sum().reset_index()
-            charts.append({
-                'type': 'Kinerja dan komisi staf penjualan',
-                'figure': px.bar(data_frame=staff_commission, 
-                                 x='Nama Staf', 
-                                 y='Komisi', 
-                                 labels={'Nama Staf': 'Nama Staf', 'Komisi': 'Komisi'})
-            })
-
-    elif selected_business_info == 'Analisis penilaian kinerja staf':
-        if 'Nama Staf' in df.columns and 'Penilaian Kinerja' in df.columns:
-            staff_performance = df.groupby('Nama Staf')['Penilaian Kinerja'].mean().reset_index()
-            charts.append({
-                'type': 'Analisis penilaian kinerja staf',
-                'figure': px.bar(data_frame=staff_performance, 
-                                 x='Nama Staf', 
-                                 y='Penilaian Kinerja', 
-                                 labels={'Nama Staf': 'Nama Staf', 'Penilaian Kinerja': 'Penilaian Kinerja'})
-            })
-
-    elif selected_business_info == 'Distribusi staf berdasarkan posisi/jabatan':
-        if 'Posisi/Jabatan' in df.columns:
-            position_counts = df['Posisi/Jabatan'].value_counts().reset_index()
-            position_counts.columns = ['Posisi/Jabatan', 'Jumlah']
-            charts.append({
-                'type': 'Distribusi staf berdasarkan posisi/jabatan',
-                'figure': px.pie(data_frame=position_counts, 
-                                 names='Posisi/Jabatan', 
-                                 values='Jumlah')
-            })
-
-    interpretation = interpret_chart('Staf Penjualan', charts, model)
-    return charts, interpretation
-
-def visualize_inventaris(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Manajemen stok produk':
-        if 'Produk' in df.columns and 'Stok' in df.columns:
-            product_stock = df.groupby('Produk')['Stok'].sum().reset_index()
-            charts.append({
-                'type': 'Manajemen stok produk',
-                'figure': px.bar(data_frame=product_stock, 
-                                 x='Produk', 
-                                 y='Stok', 
-                                 labels={'Produk': 'Produk', 'Stok': 'Stok'})
-            })
-
-    elif selected_business_info == 'Tren stok masuk dan keluar':
-        if 'Tanggal' in df.columns and 'Stok Masuk' in df.columns and 'Stok Keluar' in df.columns:
-            stock_trends = df.groupby('Tanggal').agg({'Stok Masuk': 'sum', 'Stok Keluar': 'sum'}).reset_index()
-            stock_trends = stock_trends.melt(id_vars='Tanggal', value_vars=['Stok Masuk', 'Stok Keluar'], var_name='Tipe', value_name='Jumlah')
-            charts.append({
-                'type': 'Tren stok masuk dan keluar',
-                'figure': px.line(data_frame=stock_trends, 
-                                  x='Tanggal', 
-                                  y='Jumlah', 
-                                  color='Tipe', 
-                                  labels={'Tanggal': 'Tanggal', 'Jumlah': 'Jumlah', 'Tipe': 'Tipe'})
-            })
-
-    elif selected_business_info == 'Analisis produk dengan stok terbanyak/terkecil':
-        if 'Produk' in df.columns and 'Stok' in df.columns:
-            top_stock_products = df.groupby('Produk')['Stok'].sum().reset_index().sort_values('Stok', ascending=False).head(10)
-            charts.append({
-                'type': 'Analisis produk dengan stok terbanyak/terkecil',
-                'figure': px.bar(data_frame=top_stock_products, 
-                                 x='Produk', 
-                                 y='Stok', 
-                                 labels={'Produk': 'Produk', 'Stok': 'Stok'})
-            })
-
-    interpretation = interpret_chart('Inventaris', charts, model)
-    return charts, interpretation
+# Function to build the request contents for one chart in the given mode
+def build_chart_contents(general_prompt, chart, mode='image'):
+    if mode == 'data':
+        fig_types = chart_kinds(chart['figure'])
+        data_text, note = chart_data_to_text(chart['data'])
+        fmt = DATA_PROMPT_FORMAT.upper()
+        chart_prompt = (
+            f"Tipe Visualisasi: {chart['type']} (grafik {', '.join(fig_types)}). "
+            f"Interpretasikan data berikut (format {fmt}{note}):\n{data_text}"
+        )
+        return [f"{general_prompt}\n{chart_prompt}"]
+    chart_image = fig_to_image_part(chart['figure'])
+    chart_prompt = f"Tipe Visualisasi: {chart['type']}. Interpretasikan data berikut:"
+    combined_prompt = f"{general_prompt}\n{chart_prompt}"
+    return [combined_prompt, chart_image]
+
+# Function to build the request contents of one interpretation covering every chart of a comparison.
+# The charts' tables hold the compared column (see charts.build_charts), so they are always sent as data.
+def build_comparison_contents(general_prompt, charts):
+    column = charts[0]['compare_by']
+    sources = []
+    sections = []
+    for chart in charts:
+        sources += [source for source in chart['data'][column].unique() if source not in sources]
+        data_text, note = chart_data_to_text(chart['data'])
+        sections.append(
+            f"Tipe Visualisasi: {chart['type']} (grafik {', '.join(chart_kinds(chart['figure']))}). "
+            f"Data (format {DATA_PROMPT_FORMAT.upper()}{note}):\n{data_text}"
+        )
+    comparison_prompt = (
+        f"Data berikut membandingkan {len(sources)} sumber data ({', '.join(map(str, sources))}; kolom {column}). "
+        f"Buat satu interpretasi perbandingan untuk semua grafik: jelaskan persamaan, perbedaan, dan perubahan "
+        f"antar sumber, lalu berikan rekomendasinya."
+    )
+    return [f"{general_prompt}\n{comparison_prompt}\n\n" + "\n\n".join(sections)]
+
+# Function to build the cache key of a comparison interpretation from the keys of its charts
+def comparison_interpretation_key(sheet_name, charts, model_id=''):
+    keys = [interpretation_key(sheet_name, chart, 'compare', model_id) for chart in charts]
+    return hash_bytes("\x1f".join(keys).encode('utf-8'))
+
+# Function to stream one chart's interpretation chunk by chunk, caching the full text at the end
+def stream_single_chart(sheet_name, chart, model, general_prompt, timeout=None, mode=None):
+    mode = interpret_mode_for(chart, mode)
+    yield from _stream_cached(
+        interpretation_key(sheet_name, chart, mode, model_identity(model)),
+        lambda: build_chart_contents(general_prompt, chart, mode),
+        model, timeout,
+    )
 
-def visualize_promosi_pemasaran(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Efektivitas kampanye promosi':
-        if 'Kampanye Promosi' in df.columns and 'Pendapatan' in df.columns:
-            campaign_sales = df.groupby('Kampanye Promosi')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Efektivitas kampanye promosi',
-                'figure': px.bar(data_frame=campaign_sales, 
-                                 x='Kampanye Promosi', 
-                                 y='Pendapatan', 
-                                 labels={'Kampanye Promosi': 'Kampanye Promosi', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Distribusi penjualan berdasarkan media promosi':
-        if 'Media Promosi' in df.columns and 'Pendapatan' in df.columns:
-            media_sales = df.groupby('Media Promosi')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Distribusi penjualan berdasarkan media promosi',
-                'figure': px.pie(data_frame=media_sales, 
-                                 names='Media Promosi', 
-                                 values='Pendapatan')
-            })
-
-    elif selected_business_info == 'Analisis kode diskon promosi':
-        if 'Kode Diskon' in df.columns and 'Pendapatan' in df.columns:
-            discount_code_sales = df.groupby('Kode Diskon')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Analisis kode diskon promosi',
-                'figure': px.bar(data_frame=discount_code_sales, 
-                                 x='Kode Diskon', 
-                                 y='Pendapatan', 
-                                 labels={'Kode Diskon': 'Kode Diskon', 'Pendapatan': 'Pendapatan'})
-            })
-
-    interpretation = interpret_chart('Promosi dan Pemasaran', charts, model)
-    return charts, interpretation
+# Function to stream the answer to a request chunk by chunk, caching the full text under cache_key.
+# build_contents is only called on a cache miss.
+def _stream_cached(cache_key, build_contents, model, timeout=None):
+    if _interpretation_cache is not None:
+        cached = _interpretation_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    timeout = INTERPRET_TIMEOUT if timeout is None else timeout
+    contents = build_contents()
+    parts = []
+    for chunk in model.generate_content(contents, stream=True, request_options={'timeout': timeout}):
+        text = chunk.text
+        if not parts:
+            text = text.lstrip()
+        parts.append(text)
+        yield text
+    if _interpretation_cache is not None:
+        _interpretation_cache.put(cache_key, "".join(parts).strip())
+
+# Function to interpret a single chart, served from the interpretation cache when possible
+def interpret_single_chart(sheet_name, chart, model, general_prompt, timeout=None, mode=None):
+    mode = interpret_mode_for(chart, mode)
+    cache_key = interpretation_key(sheet_name, chart, mode, model_identity(model))
+    if _interpretation_cache is not None:
+        cached = _interpretation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    with span('interpret_chart', sheet=sheet_name, mode=mode):
+        contents = build_chart_contents(general_prompt, chart, mode)
+        timeout = INTERPRET_TIMEOUT if timeout is None else timeout
+        response = model.generate_content(contents, request_options={'timeout': timeout})
+        chart_description = response.text.strip()
+    if _interpretation_cache is not None:
+        _interpretation_cache.put(cache_key, chart_description)
+    return chart_description
+
+# Function to stream the interpretation of all charts in order. The first chart is streamed
+# token by token while the remaining charts are interpreted concurrently in the background.
+# A stream closed early (e.g. by a Streamlit rerun) cancels the queued charts without waiting
+# for the running ones, so the rerun is not blocked.
+def stream_interpretation(sheet_name, charts, model, max_workers=None, timeout=None, mode=None):
+    general_prompt = build_general_prompt(sheet_name)
+    max_workers = INTERPRET_CONCURRENCY if max_workers is None else max_workers
+    first, rest = charts[0], charts[1:]
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers - 1, len(rest))))
+    try:
+        futures = [
+            executor.submit(bind_context(interpret_single_chart), sheet_name, chart, model, general_prompt, timeout, mode)
+            for chart in rest
+        ]
+        yield from stream_single_chart(sheet_name, first, model, general_prompt, timeout, mode)
+        for future in futures:
+            yield "\n\n" + future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to interpret chart data using Gemini.
+# Charts are sent concurrently (at most max_workers at a time); results keep the chart order.
+# mode forces 'image' or 'data' for every chart; by default INTERPRET_MODES decides per chart type.
+# With stream=True a generator of text chunks is returned instead of the full text.
+def interpret_chart(sheet_name, charts, model, max_workers=None, timeout=None, mode=None, stream=False):
+    # Chart-only callers (e.g. benchmark.py) pass model=None to skip interpretation
+    if model is None or not charts:
+        return ""
+    if stream:
+        return stream_interpretation(sheet_name, charts, model, max_workers, timeout, mode)
+    general_prompt = build_general_prompt(sheet_name)
+    max_workers = INTERPRET_CONCURRENCY if max_workers is None else max_workers
+
+    if len(charts) <= 1 or max_workers <= 1:
+        chart_prompts = [
+            interpret_single_chart(sheet_name, chart, model, general_prompt, timeout, mode)
+            for chart in charts
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(charts))) as executor:
+            chart_prompts = list(executor.map(
+                bind_context(lambda chart: interpret_single_chart(sheet_name, chart, model, general_prompt, timeout, mode)),
+                charts,
+            ))
 
-def visualize_feedback_pengembalian(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Masalah dan kepuasan pelanggan':
-        if 'Masalah Pelanggan' in df.columns:
-            issue_counts = df['Masalah Pelanggan'].value_counts().reset_index()
-            issue_counts.columns = ['Masalah Pelanggan', 'Jumlah']
-            charts.append({
-                'type': 'Masalah dan kepuasan pelanggan',
-                'figure': px.bar(data_frame=issue_counts, 
-                                 x='Masalah Pelanggan', 
-                                 y='Jumlah', 
-                                 labels={'Masalah Pelanggan': 'Masalah Pelanggan', 'Jumlah': 'Jumlah'})
-            })
-
-    elif selected_business_info == 'Distribusi alasan pengembalian produk':
-        if 'Alasan Pengembalian' in df.columns:
-            return_reason_counts = df['Alasan Pengembalian'].value_counts().reset_index()
-            return_reason_counts.columns = ['Alasan Pengembalian', 'Jumlah']
-            charts.append({
-                'type': 'Distribusi alasan pengembalian produk',
-                'figure': px.pie(data_frame=return_reason_counts, 
-                                 names='Alasan Pengembalian', 
-                                 values='Jumlah')
-            })
-
-    elif selected_business_info == 'Status pengembalian produk':
-        if 'Status Pengembalian' in df.columns:
-            return_status_counts = df['Status Pengembalian'].value_counts().reset_index()
-            return_status_counts.columns = ['Status Pengembalian', 'Jumlah']
-            charts.append({
-                'type': 'Status pengembalian produk',
-                'figure': px.bar(data_frame=return_status_counts, 
-                                 x='Status Pengembalian', 
-                                 y='Jumlah', 
-                                 labels={'Status Pengembalian': 'Status Pengembalian', 'Jumlah': 'Jumlah'})
-            })
-
-    interpretation = interpret_chart('Feedback dan Pengembalian', charts, model)
-    return charts, interpretation
+    return "\n\n".join(chart_prompts)
 
-def visualize_analisis_penjualan(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Penjualan agregat dan tren':
-        if 'Tanggal' in df.columns and 'Pendapatan' in df.columns:
-            sales_trends = df.groupby('Tanggal')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Penjualan agregat dan tren',
-                'figure': px.line(data_frame=sales_trends, 
-                                  x='Tanggal', 
-                                  y='Pendapatan', 
-                                  labels={'Tanggal': 'Tanggal', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Analisis penjualan berdasarkan produk/kategori':
-        if 'Produk' in df.columns and 'Pendapatan' in df.columns:
-            product_sales = df.groupby('Produk')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Analisis penjualan berdasarkan produk/kategori',
-                'figure': px.bar(data_frame=product_sales, 
-                                 x='Produk', 
-                                 y='Pendapatan', 
-                                 labels={'Produk': 'Produk', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Tren penjualan/tahunan':
-        if 'Tanggal' in df.columns and 'Pendapatan' in df.columns:
-            df['Bulan'] = df['Tanggal'].dt.to_period('M')
-            df['Tahun'] = df['Tanggal'].dt.year
-            monthly_trends = df.groupby('Bulan')['Pendapatan'].sum().reset_index()
-            yearly_trends = df.groupby('Tahun')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Tren penjualan/tahunan',
-                'figure': px.line(data_frame=monthly_trends, 
-                                  x='Bulan', 
-                                  y='Pendapatan', 
-                                  labels={'Bulan': 'Bulan', 'Pendapatan': 'Pendapatan'})
-            })
-            charts.append({
-                'type': 'Tren penjualan/tahunan',
-                'figure': px.line(data_frame=yearly_trends, 
-                                  x='Tahun', 
-                                  y='Pendapatan', 
-                                  labels={'Tahun': 'Tahun', 'Pendapatan': 'Pendapatan'})
-            })
-
-    interpretation = interpret_chart('Analisis Penjualan', charts, model)
+# Function to interpret the charts of a comparison (built with compare_by) with a single Gemini call
+# covering every chart and source, instead of one call per chart. Cached like chart interpretations.
+def interpret_comparison(sheet_name, charts, model, timeout=None, stream=False):
+    if model is None or not charts:
+        return ""
+    general_prompt = build_general_prompt(sheet_name)
+    cache_key = comparison_interpretation_key(sheet_name, charts, model_identity(model))
+    if stream:
+        return _stream_cached(cache_key, lambda: build_comparison_contents(general_prompt, charts), model, timeout)
+    if _interpretation_cache is not None:
+        cached = _interpretation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    with span('interpret_comparison', sheet=sheet_name, charts=len(charts)):
+        contents = build_comparison_contents(general_prompt, charts)
+        timeout = INTERPRET_TIMEOUT if timeout is None else timeout
+        response = model.generate_content(contents, request_options={'timeout': timeout})
+        text = response.text.strip()
+    if _interpretation_cache is not None:
+        _interpretation_cache.put(cache_key, text)
+    return text
+
+# Function to draw the charts of one business option (see charts.CHART_REGISTRY) and interpret them
+# With stream=True the span only covers the charts; the streamed interpretation has its own spans.
+# compare_by draws a comparison (see charts.build_charts) that is interpreted in one call.
+def visualize(sheet_name, df, selected_business_info, model, stream=False, compare_by=None):
+    with span('visualize', sheet=sheet_name, option=selected_business_info, stream=stream, compare_by=compare_by):
+        charts = build_charts(sheet_name, selected_business_info, df, compare_by)
+        if compare_by:
+            interpretation = interpret_comparison(sheet_name, charts, model, stream=stream)
+        else:
+            interpretation = interpret_chart(sheet_name, charts, model, stream=stream)
     return charts, interpretation
 
-def visualize_lainnya(df, selected_business_info, model):
-    df = convert_to_date(df, ['Tanggal'])
-    charts = []
-
-    if selected_business_info == 'Analisis tambahan dan faktor eksternal':
-        if 'Faktor Eksternal' in df.columns and 'Pendapatan' in df.columns:
-            external_factor_sales = df.groupby('Faktor Eksternal')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Analisis tambahan dan faktor eksternal',
-                'figure': px.bar(data_frame=external_factor_sales, 
-                                 x='Faktor Eksternal', 
-                                 y='Pendapatan', 
-                                 labels={'Faktor Eksternal': 'Faktor Eksternal', 'Pendapatan': 'Pendapatan'})
-            })
-
-    elif selected_business_info == 'Tren penjualan berdasarkan faktor ekonomi':
-        if 'Tanggal' in df.columns and 'Faktor Ekonomi' in df.columns and 'Pendapatan' in df.columns:
-            economic_factor_trends = df.groupby(['Tanggal', 'Faktor Ekonomi'])['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Tren penjualan berdasarkan faktor ekonomi',
-                'figure': px.line(data_frame=economic_factor_trends, 
-                                  x='Tanggal', 
-                                  y='Pendapatan', 
-                                  color='Faktor Ekonomi', 
-                                  labels={'Tanggal': 'Tanggal', 'Pendapatan': 'Pendapatan', 'Faktor Ekonomi': 'Faktor Ekonomi'})
-            })
-
-    elif selected_business_info == 'Analisis faktor lingkungan dan penjualan':
-        if 'Faktor Lingkungan' in df.columns and 'Pendapatan' in df.columns:
-            environmental_factor_sales = df.groupby('Faktor Lingkungan')['Pendapatan'].sum().reset_index()
-            charts.append({
-                'type': 'Analisis faktor lingkungan dan penjualan',
-                'figure': px.bar(data_frame=environmental_factor_sales, 
-                                 x='Faktor Lingkungan', 
-                                 y='Pendapatan', 
-                                 labels={'Faktor Lingkungan': 'Faktor Lingkungan', 'Pendapatan': 'Pendapatan'})
-            })
-
-    interpretation = interpret_chart('Lainnya', charts, model)
-    return charts, interpretation
\ No newline at end of file
+# Visualization function for each sheet
+VISUALIZERS = {sheet_name: partial(visualize, sheet_name) for sheet_name in CHART_REGISTRY}
+
+visualize_pelanggan = VISUALIZERS['Pelanggan']
+visualize_produk = VISUALIZERS['Produk']
+visualize_transaksi_penjualan = VISUALIZERS['Transaksi Penjualan']
+visualize_lokasi_penjualan = VISUALIZERS['Lokasi Penjualan']
+visualize_staf_penjualan = VISUALIZERS['Staf Penjualan']
+visualize_inventaris = VISUALIZERS['Inventaris']
+visualize_promosi_pemasaran = VISUALIZERS['Promosi dan Pemasaran']
+visualize_feedback_pengembalian = VISUALIZERS['Feedback dan Pengembalian']
+visualize_analisis_penjualan = VISUALIZERS['Analisis Penjualan']
+visualize_lainnya = VISUALIZERS['Lainnya']
@@ -0,0 +1,442 @@
+import json
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+import pandas as pd
+from openpyxl import load_workbook
+from aggregates import (
+    AGGREGATIONS, DERIVED_COLUMNS, PREVIEW_ONLY_ATTR, combine_partials, compute_partials, seed_aggregates
+)
+from cache import hash_bytes
+from instrumentation import span
+
+# pyarrow is optional: without it workbooks are always parsed from Excel
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Ingestion settings applied once per sheet at load time (see prepare_sheet)
+DATE_COLUMNS = ['Tanggal']
+CATEGORY_MAX_UNIQUE_RATIO = 0.5  # text columns with at most this share of distinct values become 'category'
+CATEGORY_MIN_ROWS = 50  # tiny sheets are left as they are
+
+# Format of prepared sheets: bump it whenever prepare_sheet (or the settings above) changes what a
+# sheet looks like, so Parquet-cached sheets and data-keyed results of earlier versions are not reused
+PREPARE_VERSION = 1
+
+# Streaming ingestion: sheets with more rows than STREAMING_ROW_THRESHOLD are read row by row with
+# openpyxl and aggregated in chunks of STREAM_CHUNK_ROWS, keeping only the first PREVIEW_ROWS rows.
+# Sheets above MAX_SHEET_ROWS and uploads above MAX_UPLOAD_BYTES are refused.
+STREAMING_ROW_THRESHOLD = 200_000
+STREAM_CHUNK_ROWS = 50_000
+PREVIEW_ROWS = 1_000
+MAX_SHEET_ROWS = 2_000_000
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+
+# Raised when an upload or a sheet exceeds the configured ingestion limits
+class WorkbookTooLargeError(ValueError):
+    pass
+
+# Function to build the error for a sheet with more than max_rows rows
+def _too_many_rows(sheet_name, max_rows):
+    return WorkbookTooLargeError(
+        f"Sheet '{sheet_name}' memiliki lebih dari {max_rows:,} baris, melebihi batas yang diizinkan. "
+        "Silakan pisahkan data ke beberapa file atau sheet."
+    )
+
+# Function to refuse uploads larger than max_bytes before anything is parsed
+def check_upload_size(size, max_bytes=None):
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    if max_bytes and size > max_bytes:
+        raise WorkbookTooLargeError(
+            f"Ukuran file {size / 1024 / 1024:.1f} MB melebihi batas {max_bytes / 1024 / 1024:.0f} MB. "
+            "Silakan unggah file yang lebih kecil atau pisahkan datanya."
+        )
+
+# Function to list the columns the visualizations expect for a sheet, split into keys and numeric values
+def expected_columns(sheet_name):
+    keys, values = set(), set()
+    for spec_keys, spec_values, _ in AGGREGATIONS.get(sheet_name, {}).values():
+        keys.update(col for col in spec_keys if col not in DERIVED_COLUMNS)
+        values.update(spec_values)
+    return keys, values
+
+# Function to measure the memory held by a DataFrame
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+# Function to prepare a freshly parsed sheet once: parse dates, turn repeated text into categoricals,
+# coerce and downcast numeric value columns, and validate the columns the charts expect.
+# Returns the prepared DataFrame and a report with before/after memory and timing.
+# Chunks of a streamed sheet are prepared with categorize=False so their group keys stay comparable.
+def prepare_sheet(df, sheet_name, categorize=True):
+    start = time.perf_counter()
+    report = {'rows': len(df), 'bytes_before': frame_nbytes(df), 'converted': {}, 'coerced': {}}
+    expected_keys, expected_values = expected_columns(sheet_name)
+
+    for col in DATE_COLUMNS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            parsed = pd.to_datetime(df[col], errors='coerce')
+            report['coerced'][col] = int(parsed.isna().sum() - df[col].isna().sum())
+            df[col] = parsed
+            report['converted'][col] = str(df[col].dtype)
+
+    for col in expected_values:
+        if col not in df.columns:
+            continue
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            parsed = pd.to_numeric(df[col], errors='coerce')
+            report['coerced'][col] = int(parsed.isna().sum() - df[col].isna().sum())
+            df[col] = parsed
+        # Only integer-valued columns are downcast; floats stay float64 so large Rupiah sums keep precision
+        values = df[col].dropna()
+        if pd.api.types.is_float_dtype(df[col]) and not df[col].isna().any() and (values % 1 == 0).all():
+            df[col] = df[col].astype('int64')
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        report['converted'][col] = str(df[col].dtype)
+
+    if categorize and len(df) >= CATEGORY_MIN_ROWS:
+        for col in df.columns:
+            if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+                if df[col].nunique(dropna=True) <= CATEGORY_MAX_UNIQUE_RATIO * len(df):
+                    df[col] = df[col].astype('category')
+                    report['converted'][col] = 'category'
+
+    report['missing_columns'] = sorted((expected_keys | expected_values) - set(df.columns))
+    report['bytes_after'] = frame_nbytes(df)
+    report['prepare_ms'] = (time.perf_counter() - start) * 1000
+    return df, report
+
+# Function to read a sheet row by row with openpyxl's read-only iterator, yielding DataFrames of
+# at most chunk_rows rows. The first row is the header, as with pd.read_excel.
+def iter_sheet_chunks(file_bytes, sheet_name, chunk_rows=None, max_rows=None):
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    max_rows = MAX_SHEET_ROWS if max_rows is None else max_rows
+    book = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = book[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if name is None else str(name) for i, name in enumerate(header)]
+        chunk = []
+        total = 0
+        for row in rows:
+            if not any(value is not None for value in row):
+                continue
+            total += 1
+            if max_rows and total > max_rows:
+                raise _too_many_rows(sheet_name, max_rows)
+            chunk.append(row[:len(columns)])
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        book.close()
+
+# Function to ingest a large sheet chunk by chunk without holding it whole. Every chunk is prepared
+# and folded into the running partial aggregates; only the first preview_rows rows are kept.
+# Sheets that turn out to have at most full_rows rows are returned whole with partials=None.
+# Returns (df, partials, report).
+def stream_sheet(file_bytes, sheet_name, chunk_rows=None, max_rows=None, preview_rows=None, full_rows=None):
+    preview_rows = PREVIEW_ROWS if preview_rows is None else preview_rows
+    full_rows = STREAMING_ROW_THRESHOLD if full_rows is None else full_rows
+    start = time.perf_counter()
+    partials = None
+    kept = []  # every chunk while the sheet is small enough to keep whole, then None
+    preview = None
+    rows = 0
+    chunks = 0
+    coerced = {}
+    for chunk in iter_sheet_chunks(file_bytes, sheet_name, chunk_rows, max_rows):
+        chunk, chunk_report = prepare_sheet(chunk, sheet_name, categorize=False)
+        for col, count in chunk_report['coerced'].items():
+            coerced[col] = coerced.get(col, 0) + count
+        chunk_partials = compute_partials(sheet_name, chunk)
+        partials = chunk_partials if partials is None else combine_partials([partials, chunk_partials])
+        rows += len(chunk)
+        chunks += 1
+        if kept is not None:
+            kept.append(chunk)
+            if rows > full_rows:
+                preview = pd.concat(kept, ignore_index=True).head(preview_rows)
+                kept = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if kept is not None:
+        df = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame()
+        df, report = prepare_sheet(df, sheet_name)
+        report['parse_ms'] = elapsed_ms
+        return df, None, report
+
+    df = preview
+    _, report = prepare_sheet(df.copy(), sheet_name, categorize=False)
+    partial_bytes = sum(frame_nbytes(partial) for partial in partials.values())
+    report.update({
+        'rows': rows,
+        'streamed': True,
+        'chunks': chunks,
+        'preview_rows': len(df),
+        'coerced': coerced,
+        'bytes_after': frame_nbytes(df) + partial_bytes,
+        'parse_ms': elapsed_ms,
+    })
+    return df, partials, report
+
+# On-disk cache of prepared sheets as Parquet files, one directory per workbook hash.
+# Later uploads of the same file memory-map these instead of re-parsing the Excel XML.
+# The total size is bounded by max_bytes; eviction drops whole workbooks, either the least
+# recently used ('lru') or the oldest written ('fifo'). Workbooks prepared by another PREPARE_VERSION
+# count as missing and are prepared (and written) again.
+class ParquetSheetCache:
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, eviction='lru'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def available():
+        return pq is not None
+
+    def _workbook_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _sheet_path(self, key, sheet_name):
+        return os.path.join(self._workbook_dir(key), hash_bytes(sheet_name.encode('utf-8'))[:16] + '.parquet')
+
+    def _read_manifest(self, key, any_version=False):
+        try:
+            with open(os.path.join(self._workbook_dir(key), self.MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not any_version and manifest.get('prepare_version') != PREPARE_VERSION:
+            return None
+        return manifest
+
+    def _write_manifest(self, key, manifest):
+        path = os.path.join(self._workbook_dir(key), self.MANIFEST)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    # Function to get the sheet names of a cached workbook (None when it is not cached)
+    def sheet_names(self, key):
+        manifest = self._read_manifest(key)
+        return manifest['sheet_names'] if manifest else None
+
+    def save_sheet_names(self, key, sheet_names):
+        with self._lock:
+            os.makedirs(self._workbook_dir(key), exist_ok=True)
+            manifest = self._read_manifest(key) or {
+                'created_at': time.time(), 'prepare_version': PREPARE_VERSION, 'reports': {}
+            }
+            manifest['sheet_names'] = list(sheet_names)
+            self._write_manifest(key, manifest)
+
+    # Function to read a prepared sheet and its ingest report, or None on a miss
+    def read(self, key, sheet_name):
+        path = self._sheet_path(key, sheet_name)
+        manifest = self._read_manifest(key)
+        if not self.available() or manifest is None or sheet_name not in manifest['reports'] or not os.path.exists(path):
+            self.misses += 1
+            return None
+        df = pq.read_table(path, memory_map=True).to_pandas()
+        os.utime(self._workbook_dir(key))  # marks the workbook as recently used for LRU eviction
+        self.hits += 1
+        return df, manifest['reports'][sheet_name]
+
+    # Function to store a prepared sheet; sheets pyarrow cannot encode (e.g. mixed-type columns) are skipped
+    def write(self, key, sheet_name, df, report):
+        if not self.available():
+            return False
+        path = self._sheet_path(key, sheet_name)
+        tmp_path = path + '.tmp'
+        try:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        except (pa.ArrowException, TypeError, ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+        with self._lock:
+            manifest = self._read_manifest(key) or {
+                'created_at': time.time(), 'prepare_version': PREPARE_VERSION, 'sheet_names': [], 'reports': {}
+            }
+            manifest['reports'][sheet_name] = report
+            self._write_manifest(key, manifest)
+            self._evict(keep=key)
+        return True
+
+    def _workbook_size(self, path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def _evict(self, keep=None):
+        workbooks = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            if self.eviction == 'fifo':
+                manifest = self._read_manifest(entry.name, any_version=True) or {}
+                order = manifest.get('created_at', entry.stat().st_mtime)
+            else:
+                order = entry.stat().st_mtime
+            workbooks.append((order, entry.name, self._workbook_size(entry.path)))
+        total = sum(size for _, _, size in workbooks)
+        for _, key, size in sorted(workbooks):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._workbook_dir(key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'bytes': sum(
+                self._workbook_size(entry.path) for entry in os.scandir(self.directory) if entry.is_dir()
+            ),
+        }
+
+# Workbook that only reads sheet names up front and decodes each sheet on first access.
+# Decoded sheets are memoized, so a sheet is parsed at most once per workbook. Very large sheets
+# are streamed (see stream_sheet): only a preview is kept and their aggregates are seeded directly.
+# With a sheet_cache (ParquetSheetCache) and a key, sheets seen before are read from Parquet
+# and the Excel file is not opened at all.
+class LazyWorkbook:
+    def __init__(self, file_bytes, key=None, sheet_cache=None):
+        self.key = key
+        self._file_bytes = file_bytes
+        self._source_prefix = None
+        self._excel = None
+        self._sheet_cache = sheet_cache if key and sheet_cache is not None and sheet_cache.available() else None
+        cached_names = self._sheet_cache.sheet_names(key) if self._sheet_cache else None
+        if cached_names is not None:
+            self.sheet_names = cached_names
+        else:
+            self.sheet_names = list(self._open_excel().sheet_names)
+            if self._sheet_cache:
+                self._sheet_cache.save_sheet_names(key, self.sheet_names)
+        self._sheets = {}
+        self._sheet_bytes = {}
+        self._partials = {}
+        self.reports = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self.sheet_names:
+            raise KeyError(sheet_name)
+        with self._lock:
+            if sheet_name not in self._sheets:
+                cached = None
+                if self._sheet_cache:
+                    with span('read_parquet', sheet=sheet_name):
+                        cached = self._sheet_cache.read(self.key, sheet_name)
+                partials = None
+                if cached is not None:
+                    df, report = cached
+                elif self._needs_streaming(sheet_name):
+                    with span('stream_sheet', sheet=sheet_name):
+                        df, partials, report = stream_sheet(self._file_bytes, sheet_name)
+                else:
+                    with span('parse_sheet', sheet=sheet_name):
+                        start = time.perf_counter()
+                        df = self._open_excel().parse(sheet_name)
+                        parse_ms = (time.perf_counter() - start) * 1000
+                    # The streaming decision trusts the sheet's dimension record, which writers may
+                    # leave stale, so the row limit is checked on the parsed sheet as well
+                    if MAX_SHEET_ROWS and len(df) > MAX_SHEET_ROWS:
+                        raise _too_many_rows(sheet_name, MAX_SHEET_ROWS)
+                    with span('prepare_sheet', sheet=sheet_name):
+                        df, report = prepare_sheet(df, sheet_name)
+                    report['parse_ms'] = parse_ms
+                # Streamed sheets only hold a preview, so they are not written to the Parquet cache
+                if cached is None and partials is None and self._sheet_cache:
+                    self._sheet_cache.write(self.key, sheet_name, df, report)
+                self.reports[sheet_name] = report
+                # Lets downstream caches (e.g. aggregates) identify this sheet without rehashing it;
+                # the prepare version keeps results of differently prepared data apart
+                if self._source_prefix is None:
+                    self._source_prefix = f"{self.key or hash_bytes(self._file_bytes)}:p{PREPARE_VERSION}"
+                df.attrs['source_key'] = f"{self._source_prefix}:{sheet_name}"
+                self._sheets[sheet_name] = df
+                self._sheet_bytes[sheet_name] = report['bytes_after']
+                if partials is not None:
+                    self._partials[sheet_name] = partials
+                    df.attrs[PREVIEW_ONLY_ATTR] = True
+                if len(self._sheets) == len(self.sheet_names):
+                    self._release_file()
+            df = self._sheets[sheet_name]
+            if sheet_name in self._partials:
+                # The aggregates of a streamed sheet cannot be recomputed from its preview (which
+                # refuses to be aggregated), so they are seeded again whenever the sheet is used
+                seed_aggregates(sheet_name, df, self._partials[sheet_name])
+            return df
+
+    # Function to decide whether a sheet is too large to parse whole; read-only openpyxl sheets report
+    # their size from the sheet's dimension record, and sheets without one are streamed to be safe
+    def _needs_streaming(self, sheet_name):
+        try:
+            max_row = self._open_excel().book[sheet_name].max_row
+        except (AttributeError, KeyError):
+            return False
+        return max_row is None or max_row - 1 > STREAMING_ROW_THRESHOLD
+
+    # Whether a sheet was too large to hold and only its preview plus aggregates are kept
+    def is_streamed(self, sheet_name):
+        return sheet_name in self._partials
+
+    def _open_excel(self):
+        if self._excel is None:
+            self._excel = pd.ExcelFile(BytesIO(self._file_bytes))
+        return self._excel
+
+    # Function to drop the uploaded bytes and the open Excel file once every sheet is decoded
+    def _release_file(self):
+        if self._excel is not None:
+            self._excel.close()
+            self._excel = None
+        self._file_bytes = None
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.sheet_names
+
+    def __iter__(self):
+        return iter(self.sheet_names)
+
+    def __len__(self):
+        return len(self.sheet_names)
+
+    def keys(self):
+        return list(self.sheet_names)
+
+    def is_loaded(self, sheet_name):
+        return sheet_name in self._sheets
+
+    # Memory held by the sheets decoded so far plus the uploaded file, which is kept (and counted)
+    # until every sheet is decoded
+    @property
+    def nbytes(self):
+        return sum(self._sheet_bytes.values()) + (len(self._file_bytes) if self._file_bytes is not None else 0)